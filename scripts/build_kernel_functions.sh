@@ -56,11 +56,49 @@
 #   DEBEMAIL
 #   DEBFULLNAME
 #
+# Variables related to caching:
+# ----------------------------
+#   KERNEL_CACHE_DIR
+#   KERNEL_RELEASES_CACHE_TTL
+#   KERNEL_PRISTINE_TREES
+#   KERNEL_PRISTINE_TREE_MODE
+#
+# Variables related to kernel config:
+# ----------------------------------
+#   KERNEL_KCONFIG_INDEX
+#   KERNEL_KCONFIG_ENGINE
+#   KERNEL_OLDCONFIG_MODE
+#
+# Variables related to downloads:
+# ------------------------------
+#   KERNEL_HTTP_CONNECT_TIMEOUT
+#   KERNEL_HTTP_READ_TIMEOUT
+#   KERNEL_HTTP_RETRIES
+#   KERNEL_HTTP_BACKOFF
+#   KERNEL_MIRRORS
+#   KERNEL_DOWNLOAD_SEGMENTS
+#   KERNEL_GIT_MIRROR
+#   KERNEL_GIT_MIRROR_DEPTH
+#   KERNEL_GIT_SPARSE
+#   KERNEL_GIT_SPARSE_EXTRA
+#   KERNEL_VERIFY_SOURCE
+#   KERNEL_GPGV_KEYRING
+#   KERNEL_TAR_PRUNE
+#   KERNEL_TAR_PRUNE_EXCLUDE
+#
 # Other variables:
 # ---------------
 #   NUM_THREADS
+#   KERNEL_JOB_MEM_MB
+#   KERNEL_MAKE_LOAD_LIMIT
+#   KERNEL_DEDICATED_BUILDER
 #   META_PKGNAME_PREFIX
 #   GIT_CLONE_COMMAND
+#   KERNEL_BUILD_PIPELINE
+#   KERNEL_CCACHE
+#   KERNEL_CCACHE_DIR
+#   KERNEL_CCACHE_MAXSIZE
+#   KERNEL_INCREMENTAL_BUILD
 #-------------------------------------------------------------------------
 
 if [ -n "$BASH_SOURCE" ]; then
@@ -77,7 +115,7 @@ SCRIPT_DIR="${PROG_DIR}"
 # The list below is also THE set of config variables that are used
 # (except KERNEL_BUILD_CONFIG)
 #-------------------------------------------------------------------------
-CONFIG_VARS="KERNEL_BUILD_CONFIG DEBEMAIL DEBFULLNAME KERNEL_BUILD_DIR DPUT_PPA_NAME GPG_DEFAULT_KEY_SET KERNEL_TYPE LOCAL_DEB_REPO_DIR LOCAL_DEB_DISTS META_PKGNAME_PREFIX NUM_THREADS GPG_KEYID KERNEL_VERSION KERNEL_CONFIG KERNEL_PATCH_DIR KERNEL_CONFIG_PREFS KERNEL__BUILD_SRC_PKG KERNEL__BUILD_META_PACKAGE KERNEL__DO_LOCAL_UPLOAD KERNEL__APPLY_PATCHES KERNEL_SOURCE_URL GIT_CLONE_COMMAND DISABLE_GPG_PASSPHRASE_CACHING KERNEL_BUILD_ZFS"
+CONFIG_VARS="KERNEL_BUILD_CONFIG DEBEMAIL DEBFULLNAME KERNEL_BUILD_DIR DPUT_PPA_NAME GPG_DEFAULT_KEY_SET KERNEL_TYPE LOCAL_DEB_REPO_DIR LOCAL_DEB_DISTS META_PKGNAME_PREFIX NUM_THREADS GPG_KEYID KERNEL_VERSION KERNEL_CONFIG KERNEL_PATCH_DIR KERNEL_CONFIG_PREFS KERNEL__BUILD_SRC_PKG KERNEL__BUILD_META_PACKAGE KERNEL__DO_LOCAL_UPLOAD KERNEL__APPLY_PATCHES KERNEL_SOURCE_URL GIT_CLONE_COMMAND DISABLE_GPG_PASSPHRASE_CACHING KERNEL_BUILD_ZFS KERNEL_CACHE_DIR KERNEL_RELEASES_CACHE_TTL KERNEL_HTTP_CONNECT_TIMEOUT KERNEL_HTTP_READ_TIMEOUT KERNEL_HTTP_RETRIES KERNEL_HTTP_BACKOFF KERNEL_MIRRORS KERNEL_DOWNLOAD_SEGMENTS KERNEL_GIT_MIRROR KERNEL_GIT_MIRROR_DEPTH KERNEL_GIT_SPARSE KERNEL_GIT_SPARSE_EXTRA KERNEL_VERIFY_SOURCE KERNEL_GPGV_KEYRING KERNEL_TAR_PRUNE KERNEL_TAR_PRUNE_EXCLUDE KERNEL_PRISTINE_TREES KERNEL_PRISTINE_TREE_MODE KERNEL_BUILD_PIPELINE KERNEL_CCACHE KERNEL_CCACHE_DIR KERNEL_CCACHE_MAXSIZE KERNEL_INCREMENTAL_BUILD KERNEL_JOB_MEM_MB KERNEL_MAKE_LOAD_LIMIT KERNEL_DEDICATED_BUILDER KERNEL_KCONFIG_INDEX KERNEL_KCONFIG_ENGINE KERNEL_OLDCONFIG_MODE"
 readonly CONFIG_VARS
 for v in $CONFIG_VARS
 do
@@ -128,11 +166,16 @@ START_END_TIME_FILE=start_end.out
 METAPKG_BUILD_OUT="build_meta.out"
 # Output of local_upload.sh
 LOCAL_UPLOAD_BUILD_OUT="local_upload.out"
+# Output of get_kernel_source when run in background
+# (KERNEL_BUILD_PIPELINE=overlap)
+SOURCE_OUT="get_source.out"
+# Chosen kernel version, URLs etc - written ONCE per build by
+# RESOLVE_KERNEL_SCRIPT and read by all later steps
+BUILD_MANIFEST_FILENAME=build_manifest.json
 
 # Required scripts - must be in same dir as this script
-KERNEL_SOURCE_SCRIPT=get_kernel_source_url.py
-SHOW_AVAIL_KERNELS_SCRIPT=show_available_kernels.py
-SHOW_CHOSEN_KERNEL_SCRIPT=show_chosen_kernel.py
+RESOLVE_KERNEL_SCRIPT=resolve_kernel.py
+TARBALL_CACHE_SCRIPT=tarball_cache.py
 SHOW_CONFIG_VER_SCRIPT=show_config_version.py
 UPDATE_CONFIG_SCRIPT=update_kernel_config.py
 CHECK_REQD_PKGS_SCRIPT=required_pkgs.sh
@@ -148,6 +191,11 @@ readonly KERNEL_IMAGE_NAME
 MAKE_CONFIG_COMMAND="make oldconfig"
 readonly MAKE_CONFIG_COMMAND
 
+# Dirs under arch/ in kernel source (current and removed architectures)
+# Used for pruned extraction of kernel source (KERNEL_TAR_PRUNE)
+KERNEL_ARCH_DIRS="alpha arc arm arm64 avr32 blackfin c6x cris csky frv h8300 hexagon ia64 loongarch m32r m68k metag microblaze mips mn10300 nds32 nios2 openrisc parisc powerpc riscv s390 score sh sparc tile um unicore32 x86 xtensa"
+readonly KERNEL_ARCH_DIRS
+
 # git clone command
 if [ -z "$GIT_CLONE_COMMAND" ]; then
     GIT_CLONE_COMMAND="git clone --depth 1"
@@ -157,6 +205,12 @@ fi
 
 # Name of directory we create
 KB_TOP_DIR=__kernel_build
+# Persistent kernel object dirs (KERNEL_INCREMENTAL_BUILD) - NOT deleted
+# by create_dirs
+KB_OBJS_DIR=__kernel_objs
+# Number of kernel object dirs kept (most recently used)
+KB_OBJS_KEEP=2
+readonly KB_OBJS_KEEP
 # Dir under DEB_DIR where source package is built
 KB_SRC_PKG_DIR=__src_pkg
 
@@ -317,23 +371,129 @@ function get_tar_fmt_ind {
 	esac
 }
 
+function get_decompress_cmd {
+    # $1: KERNEL_SRC URL - can be tar / xz / bz2 / gz
+    # Echoes command that decompresses stdin to stdout
+    # Uses parallel decompressor if installed, else the standard one:
+    #   xz  : pixz, xz -T0 (xz >= 5.4 decompresses multi-block files in
+    #         parallel - older xz ignores -T0 when decompressing)
+    #   bz2 : pbzip2
+    #   gz  : pigz
+    # Echoes 'cat' for uncompressed tar
+    # Returns 1 if $1 has invalid suffix
+    local fmt_ind
+    fmt_ind=$(get_tar_fmt_ind "$1") || return 1
+    case "$fmt_ind" in
+        "J")
+            if which pixz 1>/dev/null 2>&1; then
+                echo "pixz -d"
+            elif xz -T0 --version 1>/dev/null 2>&1; then
+                echo "xz -d -c -T0"
+            else
+                echo "xz -d -c"
+            fi
+            ;;
+        "j")
+            if which pbzip2 1>/dev/null 2>&1; then
+                echo "pbzip2 -d -c"
+            else
+                echo "bzip2 -d -c"
+            fi
+            ;;
+        "z")
+            if which pigz 1>/dev/null 2>&1; then
+                echo "pigz -d -c"
+            else
+                echo "gzip -d -c"
+            fi
+            ;;
+        *)
+            echo "cat"
+            ;;
+    esac
+}
+
+function decompress_timed {
+    # Decompresses stdin to stdout - for use in a pipeline
+    # $1: decompress command (from get_decompress_cmd)
+    # $2: file to write time taken by decompressor to:
+    #     elapsed user system (seconds)
+    local TIMEFORMAT="%R %U %S"
+    { time $1 2>&3 ; } 3>&2 2>"$2"
+}
+
+function show_decompress_time {
+    # $1: decompress command (from get_decompress_cmd)
+    # $2: file written by decompress_timed
+    # Uses: START_END_TIME_FILEPATH
+    local times=$(tail -1 "$2" 2>/dev/null)
+    if [ -z "$times" ]; then
+        return
+    fi
+    local elapsed=$(echo $times | awk '{printf "%.1fs wall %.1fs cpu", $1, $2 + $3}')
+    show_timing_msg "${START_END_TIME_FILEPATH}" "Decompress ($(echo $1 | awk '{print $1}'))" "yestee" "$elapsed"
+}
+
+function get_num_cores() {
+    # Echoes number of CPUs (int)
+    local num_cores=$(lscpu 2>/dev/null | grep '^CPU(s)' | awk '{print $2}')
+    if [ -z "$num_cores" ]; then
+        num_cores=$(nproc)
+    fi
+    echo $num_cores
+}
+
+function is_dedicated_builder() {
+    # Returns 0 if KERNEL_DEDICATED_BUILDER is yes, 1 otherwise
+    [ "${KERNEL_DEDICATED_BUILDER:-no}" = "yes" ]
+}
+
 function choose_num_threads() {
     # Echoes number of threads to use (int)
+    # Reasons for the choice are echoed to stderr (one per line)
     # $1: (optional): value of NUM_THREADS environment variable
+    #
+    # Uses:
+    #   KERNEL_DEDICATED_BUILDER
+    #   KERNEL_JOB_MEM_MB
+    #
+    # Threads = min(core limit, load limit, memory limit) - minimum of 1
+    #   core limit  : (cores - 1) - cores if dedicated builder
+    #                 NUM_THREADS replaces core limit if it is not larger
+    #                 than (cores - 1) - (2 x cores) if dedicated builder
+    #   load limit  : cores - current 1-minute load average
+    #                 Not applied on dedicated builders
+    #   memory limit: MemAvailable / KERNEL_JOB_MEM_MB
     local num_threads_env_var=$1
 
-    # Fix NUM_THREADS to be min(NUM_THREADS, number_of_cores)
-    local NUM_CORES=$(lscpu | grep '^CPU(s)' | awk '{print $2}')
+    local NUM_CORES=$(get_num_cores)
     local TARGETED_CORES=$(($NUM_CORES - 1))
+    local max_threads=$TARGETED_CORES
+    if is_dedicated_builder; then
+        TARGETED_CORES=$NUM_CORES
+        max_threads=$(($NUM_CORES * 2))
+    fi
     if [ $TARGETED_CORES -lt 1 ]; then
         TARGETED_CORES=1
     fi
+    if [ $max_threads -lt 1 ]; then
+        max_threads=1
+    fi
+    if is_dedicated_builder; then
+        >&2 echo "Cores: $NUM_CORES (dedicated builder) - core limit $TARGETED_CORES"
+    else
+        >&2 echo "Cores: $NUM_CORES - core limit $TARGETED_CORES"
+    fi
 
     if [ -n "$num_threads_env_var" ]; then
         echo $num_threads_env_var | grep -q '^[1-9][0-9]*$'
         if [ $? -eq 0 ]; then
-            if [ $num_threads_env_var -gt $TARGETED_CORES ]; then
-                >&2 echo "Ignoring NUM_THREADS > (available cores - 1) ($TARGETED_CORES)"
+            if [ $num_threads_env_var -gt $max_threads ]; then
+                if is_dedicated_builder; then
+                    >&2 echo "Ignoring NUM_THREADS > (2 x available cores) ($max_threads)"
+                else
+                    >&2 echo "Ignoring NUM_THREADS > (available cores - 1) ($max_threads)"
+                fi
                 unset num_threads_env_var
             fi
         else
@@ -343,10 +503,79 @@ function choose_num_threads() {
     fi
     if [ -n "$num_threads_env_var" ]; then
         TARGETED_CORES=$num_threads_env_var
+        >&2 echo "NUM_THREADS: $TARGETED_CORES"
+    fi
+
+    # Other work on the host
+    if ! is_dedicated_builder; then
+        local load=$(awk '{printf "%d", $1 + 0.5}' /proc/loadavg 2>/dev/null)
+        if [ -n "$load" ]; then
+            local load_limit=$(($NUM_CORES - $load))
+            if [ $load_limit -lt 1 ]; then
+                load_limit=1
+            fi
+            if [ $load_limit -lt $TARGETED_CORES ]; then
+                TARGETED_CORES=$load_limit
+                >&2 echo "Load average: $load - limited to $TARGETED_CORES"
+            else
+                >&2 echo "Load average: $load - allows $load_limit"
+            fi
+        fi
+    fi
+
+    # Memory - avoid swapping
+    local job_mem_mb=${KERNEL_JOB_MEM_MB:-1536}
+    echo $job_mem_mb | grep -q '^[1-9][0-9]*$'
+    if [ $? -ne 0 ]; then
+        >&2 echo "Ignoring invalid value for KERNEL_JOB_MEM_MB : $job_mem_mb"
+        job_mem_mb=1536
+    fi
+    local avail_mb=$(awk '/^MemAvailable:/ {printf "%d", $2 / 1024}' /proc/meminfo 2>/dev/null)
+    if [ -n "$avail_mb" ]; then
+        local mem_limit=$(($avail_mb / $job_mem_mb))
+        if [ $mem_limit -lt 1 ]; then
+            mem_limit=1
+        fi
+        if [ $mem_limit -lt $TARGETED_CORES ]; then
+            TARGETED_CORES=$mem_limit
+            >&2 echo "Available memory: $avail_mb MB / $job_mem_mb MB per job - limited to $TARGETED_CORES"
+        else
+            >&2 echo "Available memory: $avail_mb MB / $job_mem_mb MB per job - allows $mem_limit"
+        fi
     fi
     echo $TARGETED_CORES
 }
 
+function choose_load_limit() {
+    # Echoes load limit for make -l - empty for no load limit
+    #
+    # Uses:
+    #   KERNEL_MAKE_LOAD_LIMIT
+    #   KERNEL_DEDICATED_BUILDER
+    #
+    # KERNEL_MAKE_LOAD_LIMIT:
+    #   auto (default): number of cores - no load limit on dedicated builders
+    #   no            : no load limit
+    #   <number>      : used as is (may be fractional)
+    local load_limit=${KERNEL_MAKE_LOAD_LIMIT:-auto}
+    case "$load_limit" in
+        auto)
+            is_dedicated_builder || get_num_cores
+            ;;
+        no)
+            ;;
+        *)
+            echo "$load_limit" | grep -q '^[0-9]*\.\?[0-9]\+$'
+            if [ $? -eq 0 ]; then
+                echo "$load_limit"
+            else
+                >&2 echo "Ignoring invalid value for KERNEL_MAKE_LOAD_LIMIT : $load_limit"
+                is_dedicated_builder || get_num_cores
+            fi
+            ;;
+    esac
+}
+
 function read_config {
     #-------------------------------------------------------------------------
     # Uses KERNEL_BUILD_CONFIG if set to choose config file - defaults to
@@ -400,9 +629,8 @@ function set_vars {
     CONFIG_PREFS_FILE=$(basename "$CONFIG_PREFS_FILE")
     PATCH_DIR=$(basename "$PATCH_DIR")
 
-    KERNEL_SOURCE_SCRIPT=$(basename "$KERNEL_SOURCE_SCRIPT")
-    SHOW_AVAIL_KERNELS_SCRIPT=$(basename "$SHOW_AVAIL_KERNELS_SCRIPT")
-    SHOW_CHOSEN_KERNEL_SCRIPT=$(basename "$SHOW_CHOSEN_KERNEL_SCRIPT")
+    RESOLVE_KERNEL_SCRIPT=$(basename "$RESOLVE_KERNEL_SCRIPT")
+    TARBALL_CACHE_SCRIPT=$(basename "$TARBALL_CACHE_SCRIPT")
     SHOW_CONFIG_VER_SCRIPT=$(basename "$SHOW_CONFIG_VER_SCRIPT")
     UPDATE_CONFIG_SCRIPT=$(basename "$UPDATE_CONFIG_SCRIPT")
     CHECK_REQD_PKGS_SCRIPT=$(basename "$CHECK_REQD_PKGS_SCRIPT")
@@ -415,14 +643,15 @@ function set_vars {
     START_END_TIME_FILE=$(basename "$START_END_TIME_FILE")
     METAPKG_BUILD_OUT=$(basename "$METAPKG_BUILD_OUT")
     LOCAL_UPLOAD_BUILD_OUT=$(basename "$LOCAL_UPLOAD_BUILD_OUT")
+    SOURCE_OUT=$(basename "$SOURCE_OUT")
+    BUILD_MANIFEST_FILENAME=$(basename "$BUILD_MANIFEST_FILENAME")
 
     CONFIG_FILE_PATH=$(readlink -f "${SCRIPT_DIR}/../config/${CONFIG_FILE}")
     CONFIG_FILE_PREFS_PATH=$(readlink -f "${SCRIPT_DIR}/../config/${CONFIG_PREFS_FILE}")
 
     # Required scripts can ONLY be in the same dir as this script
-    KERNEL_SOURCE_SCRIPT="${SCRIPT_DIR}/${KERNEL_SOURCE_SCRIPT}"
-    SHOW_AVAIL_KERNELS_SCRIPT="${SCRIPT_DIR}/${SHOW_AVAIL_KERNELS_SCRIPT}"
-    SHOW_CHOSEN_KERNEL_SCRIPT="${SCRIPT_DIR}/${SHOW_CHOSEN_KERNEL_SCRIPT}"
+    RESOLVE_KERNEL_SCRIPT="${SCRIPT_DIR}/${RESOLVE_KERNEL_SCRIPT}"
+    TARBALL_CACHE_SCRIPT="${SCRIPT_DIR}/${TARBALL_CACHE_SCRIPT}"
     SHOW_CONFIG_VER_SCRIPT="${SCRIPT_DIR}/${SHOW_CONFIG_VER_SCRIPT}"
     UPDATE_CONFIG_SCRIPT="${SCRIPT_DIR}/${UPDATE_CONFIG_SCRIPT}"
     CHECK_REQD_PKGS_SCRIPT="${SCRIPT_DIR}/${CHECK_REQD_PKGS_SCRIPT}"
@@ -430,18 +659,14 @@ function set_vars {
     LOCAL_UPLOAD_SCRIPT="${SCRIPT_DIR}/${LOCAL_UPLOAD_SCRIPT}"
     WRITE_CHANGELOG_SCRIPT="${SCRIPT_DIR}/${WRITE_CHANGELOG_SCRIPT}"
 
-    # Fix NUM_THREADS to be min(NUM_THREADS, number_of_cores)
-    THREADS_USED=$(choose_num_threads "$NUM_THREADS")
-    MAKE_THREADED="make -j${THREADS_USED}"
     INDENT="    "
 
     # Set variables that CANNOT be overridden as read-only
      for v in COMPILE_OUT_FILENAME OLDCONFIG_OUT_FILENAME \
-         CHOSEN_OUT_FILENAME START_END_TIME_FILE KERNEL_SOURCE_SCRIPT \
-         SHOW_AVAIL_KERNELS_SCRIPT SHOW_CHOSEN_KERNEL_SCRIPT \
-         SHOW_CONFIG_VER_SCRIPT UPDATE_CONFIG_SCRIPT CHECK_REQD_PKGS_SCRIPT \
-         METAPACKAGE_BUILD_SCRIPT LOCAL_UPLOAD_SCRIPT THREADS_USED \
-         MAKE_THREADED INDENT WRITE_CHANGELOG_SCRIPT
+         CHOSEN_OUT_FILENAME START_END_TIME_FILE RESOLVE_KERNEL_SCRIPT TARBALL_CACHE_SCRIPT \
+         BUILD_MANIFEST_FILENAME SHOW_CONFIG_VER_SCRIPT UPDATE_CONFIG_SCRIPT CHECK_REQD_PKGS_SCRIPT \
+         METAPACKAGE_BUILD_SCRIPT LOCAL_UPLOAD_SCRIPT \
+         INDENT WRITE_CHANGELOG_SCRIPT
           do
               readonly $v
           done
@@ -449,6 +674,22 @@ function set_vars {
     # read_config will not override environment vars from config
     read_config || return 1
 
+    # Threads chosen from cores, load and memory - after read_config, so
+    # that NUM_THREADS etc. can be set in config
+    local threads_reason_file=$(mktemp)
+    THREADS_USED=$(choose_num_threads "$NUM_THREADS" 2>"$threads_reason_file")
+    THREADS_REASON=$(cat "$threads_reason_file")
+    \rm -f "$threads_reason_file"
+    THREADS_LOAD_LIMIT=$(choose_load_limit)
+    MAKE_THREADED="make -j${THREADS_USED}"
+    if [ -n "$THREADS_LOAD_LIMIT" ]; then
+        MAKE_THREADED="${MAKE_THREADED} -l${THREADS_LOAD_LIMIT}"
+    fi
+    for v in THREADS_USED THREADS_REASON THREADS_LOAD_LIMIT MAKE_THREADED
+        do
+            readonly $v
+        done
+
     # Paths - only setting variables - not creating / deleting directories
     oldpwd=$(pwd)
     if [ -z "$KERNEL_BUILD_DIR" ]; then
@@ -456,6 +697,7 @@ function set_vars {
     fi
     KB_TOP_DIR=${KERNEL_BUILD_DIR}/$(basename ${KB_TOP_DIR})
     KB_TOP_DIR=$(readlink -m "${KB_TOP_DIR}")
+    KB_OBJS_DIR=$(readlink -m "${KERNEL_BUILD_DIR}/$(basename ${KB_OBJS_DIR})")
     BUILD_DIR_PARENT=${KB_TOP_DIR}/build
     BUILD_DIR=${BUILD_DIR_PARENT}/linux
     DEB_DIR=${KB_TOP_DIR}/debs
@@ -463,7 +705,7 @@ function set_vars {
     METAPKG_BUILD_DIR=${KB_TOP_DIR}/meta
 
     # Dir names cannot be changed - also export them
-     for v in KERNEL_BUILD_DIR KB_TOP_DIR BUILD_DIR_PARENT BUILD_DIR DEB_DIR \
+     for v in KERNEL_BUILD_DIR KB_TOP_DIR KB_OBJS_DIR BUILD_DIR_PARENT BUILD_DIR DEB_DIR \
          DEBUG_DIR METAPKG_BUILD_DIR
           do
               readonly $v
@@ -477,11 +719,13 @@ function set_vars {
     START_END_TIME_FILEPATH="${DEBUG_DIR}/$START_END_TIME_FILE"
     METAPKG_BUILD_OUT_FILEPATH="${DEBUG_DIR}/${METAPKG_BUILD_OUT}"
     LOCAL_UPLOAD_BUILD_OUT_FILEPATH="${DEBUG_DIR}/${LOCAL_UPLOAD_BUILD_OUT}"
+    SOURCE_OUT_FILEPATH="${DEBUG_DIR}/${SOURCE_OUT}"
+    BUILD_MANIFEST_FILEPATH="${DEBUG_DIR}/${BUILD_MANIFEST_FILENAME}"
 
     # debug filenames cannot be changed
      for v in COMPILE_OUT_FILEPATH OLDCONFIG_OUT_FILEPATH CHOSEN_OUT_FILEPATH \
          START_END_TIME_FILEPATH METAPKG_BUILD_OUT_FILEPATH \
-         LOCAL_UPLOAD_BUILD_OUT_FILEPATH
+         LOCAL_UPLOAD_BUILD_OUT_FILEPATH SOURCE_OUT_FILEPATH BUILD_MANIFEST_FILEPATH
           do
               readonly $v; export $v
           done
@@ -536,15 +780,27 @@ function set_vars {
     if [ "$KERNEL__BUILD_SRC_PKG" = "no" ]; then
         # echo "Not building source packages: KERNEL__BUILD_SRC_PKG = $KERNEL__BUILD_SRC_PKG"
         KERNEL_BUILD_TARGET=bindeb-pkg
+    elif [ "$KERNEL_INCREMENTAL_BUILD" = "yes" ]; then
+        # deb-pkg runs 'make clean' and cannot build source tarball
+        # out of tree
+        echo "Not building source packages: KERNEL_INCREMENTAL_BUILD = $KERNEL_INCREMENTAL_BUILD"
+        KERNEL_BUILD_TARGET=bindeb-pkg
     fi
     readonly KERNEL_BUILD_TARGET
+    if [ "$KERNEL_TAR_PRUNE" = "yes" ] && ! tar_prune_enabled; then
+        echo "Not pruning kernel source: source package (deb-pkg) needs full source"
+    fi
+    if [ "$KERNEL_GIT_SPARSE" = "yes" ] && ! git_sparse_enabled; then
+        echo "Not using sparse checkout: source package (deb-pkg) needs full source"
+    fi
 
-    # We can set KERN_VER early using SHOW_CHOSEN_KERNEL_SCRIPT
+    # We can set KERN_VER early from the build manifest
     # so that we can run metapackage_build.sh as soon as possible
     if [ -z "$KERNEL_SOURCE_URL" ]; then
-        KERN_VER=$(${SHOW_CHOSEN_KERNEL_SCRIPT})
+        load_build_manifest
 
         if [ $? -eq 0 ]; then
+            KERN_VER=$MANIFEST_KERN_VER
             if [[ $KERN_VER == unknown* ]] ; then
                 unset KERN_VER
             else
@@ -560,6 +816,47 @@ function set_vars {
     fi
 }
 
+function load_build_manifest {
+    # Sets MANIFEST_* variables (see RESOLVE_KERNEL_SCRIPT)
+    # Kernel is resolved (releases.json fetched, config read) ONCE per
+    # build - ONLY by the build entry point (patch_and_build_kernel.sh sets
+    # KB_MANIFEST_WRITE=yes) - and written to BUILD_MANIFEST_FILEPATH.
+    # KB_MANIFEST_RESOLVED is exported, so that child scripts (e.g.
+    # metapackage_build.sh) only read the manifest
+    # Other scripts (ppa_upload.sh, local_upload.sh ...) read the manifest
+    # of the last build and never overwrite it. Without a manifest, they
+    # resolve into a temporary file
+    # Returns: 0 if manifest was written / read, 1 otherwise
+    if [ ! -x "${RESOLVE_KERNEL_SCRIPT}" ]; then
+        echo "Kernel resolve script not found: ${RESOLVE_KERNEL_SCRIPT}"
+        return 1
+    fi
+    local mode=resolve
+    local manifest="$BUILD_MANIFEST_FILEPATH"
+    if [ "$KB_MANIFEST_WRITE" = "yes" ]; then
+        if [ "$KB_MANIFEST_RESOLVED" = "yes" -a -f "$manifest" ]; then
+            mode=vars
+        fi
+    elif [ -f "$manifest" ]; then
+        mode=vars
+    else
+        manifest=$(mktemp) || return 1
+    fi
+    mkdir -p "$(dirname "$manifest")" || return 1
+    local manifest_vars
+    manifest_vars=$("${RESOLVE_KERNEL_SCRIPT}" $mode "$manifest")
+    local ret=$?
+    if [ "$manifest" != "$BUILD_MANIFEST_FILEPATH" ]; then
+        \rm -f "$manifest"
+    fi
+    if [ $ret -ne 0 ]; then
+        return 1
+    fi
+    eval "$manifest_vars"
+    KB_MANIFEST_RESOLVED=yes
+    export KB_MANIFEST_RESOLVED
+}
+
 function create_dirs {
     BAD_DIR_MSG="Linux kernel cannot be built under a path containing spaces or colons
 This is a limitation of the Linux kernel Makefile - you will get an error
@@ -588,6 +885,20 @@ that looks like:
             fi
         fi
     fi
+    # Build manifest was written by set_vars - keep it
+    local manifest_json=""
+    if [ -f "$BUILD_MANIFEST_FILEPATH" ]; then
+        manifest_json=$(cat "$BUILD_MANIFEST_FILEPATH")
+    fi
+    # BUILD_DIR may be an overlay mount of a pristine tree (see
+    # pristine_tree_clone) - rm -rf would only create whiteouts
+    if mountpoint -q "$BUILD_DIR" 2>/dev/null; then
+        umount "$BUILD_DIR"
+        if [ $? -ne 0 ]; then
+            echo "Could not unmount BUILD_DIR : $BUILD_DIR"
+            return 1
+        fi
+    fi
     # Dir deletion
     \rm -rf $KB_TOP_DIR
     if [ $? -ne 0 ]; then
@@ -610,7 +921,7 @@ that looks like:
     # Create the debug files
     for v in OLDCONFIG_OUT_FILEPATH CHOSEN_OUT_FILEPATH COMPILE_OUT_FILEPATH \
         START_END_TIME_FILEPATH METAPKG_BUILD_OUT_FILEPATH \
-        LOCAL_UPLOAD_BUILD_OUT_FILEPATH
+        LOCAL_UPLOAD_BUILD_OUT_FILEPATH SOURCE_OUT_FILEPATH
         do
             touch "${!v}"
             if [ $? -ne 0 ]; then
@@ -618,6 +929,9 @@ that looks like:
                 return 1
             fi
         done
+    if [ -n "$manifest_json" ]; then
+        echo "$manifest_json" > "$BUILD_MANIFEST_FILEPATH"
+    fi
 }
 
 function show_vars() {
@@ -630,6 +944,10 @@ function show_vars() {
     printf "%-24s : %s\n" "KERNEL_BUILD_ZFS" "${KERNEL_BUILD_ZFS:-not set}"
     printf "%-24s : %s\n" "KERNEL_VERSION" "${KERNEL_VERSION:-not set}"
     printf "%-24s : %s\n" "Threads" "${THREADS_USED:-not set}"
+    printf "%-24s : %s\n" "Make load limit" "${THREADS_LOAD_LIMIT:-none}"
+    if [ -n "$THREADS_REASON" ]; then
+        echo "$THREADS_REASON" | sed -e "s/^/${INDENT}/"
+    fi
     printf "%-24s : %s\n" "Build target" "${KERNEL_BUILD_TARGET:-not set}"
     printf "%-24s : %s\n" "Applying patches" "${KERNEL__APPLY_PATCHES:-yes}"
     printf "%-24s : %s\n" "Building source packages" "${KERNEL__BUILD_SRC_PKG:-yes}"
@@ -647,12 +965,21 @@ function show_vars() {
     printf "%-24s : %s\n" "Config file" "${CONFIG_FILE_PATH:-not set}"
     printf "%-24s : %s\n" "Config prefs" "${KERNEL_CONFIG_PREFS:-not set}"
 
+    if [ "$KERNEL_INCREMENTAL_BUILD" = "yes" ]; then
+        printf "%-24s : %s\n" "Kernel object dirs" "$KB_OBJS_DIR"
+    fi
     printf "%-24s : %s\n" "Config choices output" "$CHOSEN_OUT_FILEPATH"
     printf "%-24s : %s\n" "make oldconfig output" "$OLDCONFIG_OUT_FILEPATH"
     printf "%-24s : %s\n" "Compile output" "$COMPILE_OUT_FILEPATH"
 
     printf "%-24s : %s\n" "Metapackage build output" "$METAPKG_BUILD_OUT_FILEPATH"
     printf "%-24s : %s\n" "Local upload output" "$LOCAL_UPLOAD_BUILD_OUT_FILEPATH"
+    if [ "$KERNEL_BUILD_PIPELINE" = "overlap" ]; then
+        printf "%-24s : %s\n" "Kernel source output" "$SOURCE_OUT_FILEPATH"
+    elif [ "$KERNEL_BUILD_PIPELINE" = "dag" ]; then
+        printf "%-24s : %s\n" "Build step outputs" "${DEBUG_DIR}/steps"
+    fi
+    printf "%-24s : %s\n" "Build manifest" "$BUILD_MANIFEST_FILEPATH"
 
 }
 
@@ -713,27 +1040,173 @@ function kernel_version()
     return $?
 }
 
+function get_gpgv_keyring {
+    # Echoes path of keyring used to verify kernel tarball signatures
+    # or nothing if there is no keyring
+    # Uses: KERNEL_GPGV_KEYRING
+    local keyring=${KERNEL_GPGV_KEYRING:-$(get_kernel_cache_dir)/kernel.org.gpg}
+    if [ -f "$keyring" -a -r "$keyring" ]; then
+        readlink -f "$keyring"
+    fi
+}
+
 function get_kernel_source_tar() {
     # $1: URL
+    # $2 (optional): URL of signature (.tar.sign - over UNCOMPRESSED tar)
+    # $3 (optional): expected sha256 of $1
     # Will extract under BUILD_DIR_PARENT and rename top-level dir to BUILD_DIR
+    # Tarball is read from persistent cache under KERNEL_CACHE_DIR if
+    # present. Otherwise TARBALL_CACHE_SCRIPT downloads it into the cache
+    # (KERNEL_DOWNLOAD_SEGMENTS parallel connections) while streaming it
+    # into tar. Without TARBALL_CACHE_SCRIPT, it is streamed with wget
+    # Verification costs no extra read of the tarball:
+    #   sha256 is computed by TARBALL_CACHE_SCRIPT while streaming
+    #   decompressed stream is tee-d into gpgv while tar extracts
+    # On mismatch 1 is returned. Cached tarball and signature are evicted
+    # only if gpgv reports a BAD signature over the complete stream - not
+    # on a missing public key or a stream cut short by a failed stage
+    # Sets KERNEL_SOURCE_VERIFIED to yes if sha256 or signature was verified
+    # Uses:
+    #   TARBALL_CACHE_SCRIPT
+    #   MANIFEST_ORIGIN_URL (set by load_build_manifest)
+    #   KERNEL_VERIFY_SOURCE
+    KERNEL_SOURCE_VERIFIED=no
     local kurl="$1"
-    is_valid_url "$1"
-    if [ $? -ne 0 ]; then
-        echo "Invalid kernel source URL: $kurl"
-        return 1
+    local sig_url="$2"
+    local sha256="$3"
+    local sha256_opt=""
+    if [ "$KERNEL_VERIFY_SOURCE" = "no" ]; then
+        sig_url=""
+        sha256=""
+    fi
+    if [ -n "$sha256" ]; then
+        sha256_opt="--sha256 $sha256"
+    fi
+    local tarball=""
+    if [ -x "$TARBALL_CACHE_SCRIPT" ]; then
+        # Cached tarball with a different sha256 is evicted
+        tarball=$("$TARBALL_CACHE_SCRIPT" path $sha256_opt "$kurl")
+    fi
+    # URL is checked only if tarball has to be downloaded - a cached
+    # tarball needs no network requests
+    if [ -z "$tarball" ]; then
+        is_valid_url "$kurl"
+        if [ $? -ne 0 ]; then
+            echo "Invalid kernel source URL: $kurl"
+            return 1
+        fi
     fi
 
     oldpwd=$(pwd)
     cd $BUILD_DIR_PARENT || return 1
 
-    local TAR_FMT_IND=$(get_tar_fmt_ind "$kurl")
+    local DECOMPRESS_CMD
+    DECOMPRESS_CMD=$(get_decompress_cmd "$kurl")
     if [ $? -ne 0 ]; then
         echo "URL suffix not supported"
+        cd $oldpwd
         return 1
     fi
     show_timing_msg "${START_END_TIME_FILEPATH}" "Retrieve kernel source start" "yestee"
     SECONDS=0
-    wget -q -O - -nd "$kurl" | tar "${TAR_FMT_IND}xf" -
+    local decompress_time_file=$(mktemp)
+
+    # Signature is verified by gpgv reading a copy of the decompressed
+    # stream (tee) from a FIFO while tar extracts
+    local tee_cmd="cat"
+    local gpgv_pid=""
+    local gpgv_dir=""
+    local keyring=$(get_gpgv_keyring)
+    if [ -n "$sig_url" ]; then
+        if [ -z "$keyring" ]; then
+            echo "Not verifying signature - no keyring: ${KERNEL_GPGV_KEYRING:-$(get_kernel_cache_dir)/kernel.org.gpg}"
+        elif ! which gpgv 1>/dev/null 2>&1 ; then
+            echo "Not verifying signature - gpgv not found"
+        else
+            local sig_file=""
+            if [ -x "$TARBALL_CACHE_SCRIPT" ]; then
+                sig_file=$("$TARBALL_CACHE_SCRIPT" fetch "$sig_url")
+            fi
+            if [ -z "$sig_file" ]; then
+                echo "Could not download signature: $sig_url"
+                cd $oldpwd
+                return 1
+            fi
+            gpgv_dir=$(mktemp -d)
+            mkfifo "$gpgv_dir/fifo"
+            gpgv --status-fd 1 --keyring "$keyring" "$sig_file" - < "$gpgv_dir/fifo" > "$gpgv_dir/gpgv.out" 2>&1 &
+            gpgv_pid=$!
+            tee_cmd="tee -p $gpgv_dir/fifo"
+        fi
+    fi
+
+    # Pruned extraction - tar skips paths not needed to build for our arch
+    local tar_opts=""
+    local exclude_file=""
+    if tar_prune_enabled; then
+        exclude_file=$(mktemp)
+        get_tar_exclude_patterns > "$exclude_file"
+        tar_opts="--anchored --no-wildcards-match-slash --exclude-from=$exclude_file"
+        echo "Pruned extraction for arch $(get_kernel_src_arches | paste -sd ' ')"
+    fi
+
+    # Decompression runs as a separate stage of the pipeline, so that
+    # its time is recorded separately from download time
+    if [ -n "$tarball" ]; then
+        show_timing_msg "${START_END_TIME_FILEPATH}" "Kernel source found in cache" "yestee"
+        decompress_timed "$DECOMPRESS_CMD" "$decompress_time_file" < "$tarball" | $tee_cmd | tar xf - $tar_opts
+    elif [ -x "$TARBALL_CACHE_SCRIPT" ]; then
+        local aliases=""
+        if [ -z "$KERNEL_SOURCE_URL" ]; then
+            aliases=$MANIFEST_ORIGIN_URL
+        fi
+        # Segmented parallel download into cache, streamed into tar
+        # Exits with non-zero return code on sha256 mismatch
+        "$TARBALL_CACHE_SCRIPT" stream $sha256_opt "$kurl" $aliases | decompress_timed "$DECOMPRESS_CMD" "$decompress_time_file" | $tee_cmd | tar xf - $tar_opts
+    else
+        wget -q -O - -nd "$kurl" | decompress_timed "$DECOMPRESS_CMD" "$decompress_time_file" | $tee_cmd | tar xf - $tar_opts
+    fi
+    local pipe_status=(${PIPESTATUS[@]})
+    show_decompress_time "$DECOMPRESS_CMD" "$decompress_time_file"
+    rm -f "$decompress_time_file" $exclude_file
+    local failed=0
+    local rc
+    for rc in ${pipe_status[@]}
+    do
+        if [ $rc -ne 0 ]; then
+            failed=1
+        fi
+    done
+    local sig_verified=no
+    if [ -n "$gpgv_pid" ]; then
+        wait $gpgv_pid
+        if [ $? -eq 0 ]; then
+            sig_verified=yes
+            show_timing_msg "${START_END_TIME_FILEPATH}" "Signature verified" "yestee"
+        else
+            echo "Signature verification FAILED: $kurl"
+            grep -v '^\[GNUPG:\] ' "$gpgv_dir/gpgv.out"
+            if [ $failed -eq 0 ] && grep -q '^\[GNUPG:\] BADSIG ' "$gpgv_dir/gpgv.out"; then
+                failed=2
+            else
+                failed=1
+            fi
+        fi
+        rm -rf "$gpgv_dir"
+    fi
+    if [ $failed -ne 0 ]; then
+        echo "Could not retrieve kernel source: $kurl"
+        if [ $failed -eq 2 -a -x "$TARBALL_CACHE_SCRIPT" ]; then
+            "$TARBALL_CACHE_SCRIPT" evict "$kurl"
+            "$TARBALL_CACHE_SCRIPT" evict "$sig_url"
+        fi
+        cd $oldpwd
+        return 1
+    fi
+    # sha256 is checked only by TARBALL_CACHE_SCRIPT
+    if [ "$sig_verified" = "yes" ] || [ -n "$sha256" -a -x "$TARBALL_CACHE_SCRIPT" ]; then
+        KERNEL_SOURCE_VERIFIED=yes
+    fi
     show_timing_msg "${START_END_TIME_FILEPATH}" "Retrieve kernel source finished" "yestee" "$(get_hms)"
     local num_dirs=$(echo $(find . -maxdepth 1 -type d -ls) | wc -l)
     if [ $num_dirs -gt 1 ]; then
@@ -749,15 +1222,582 @@ function get_kernel_source_tar() {
     cd $oldpwd
 }
 
+function get_kernel_source_incr() {
+    # $1: URL of stable kernel tarball - e.g. linux-5.10.18.tar.xz
+    # $2 (optional): URL of signature of $1
+    # $3 (optional): expected sha256 of $1
+    # If $1 is not cached, but an older tarball of the same series is
+    # (e.g. linux-5.10.17.tar.xz), extracts that and applies kernel.org
+    # incremental patches (e.g. incr/patch-5.10.17-18.xz) instead of
+    # downloading the whole tarball
+    # Will extract under BUILD_DIR_PARENT and rename top-level dir to BUILD_DIR
+    # Returns 1 (leaving BUILD_DIR_PARENT empty) if not possible or failed
+    # Always extracts full source (KERNEL_TAR_PRUNE is not used), since
+    # patches may touch any path
+    # sha256 of $1 cannot be checked on a patched tree. If $2 or $3 is set
+    # (and KERNEL_VERIFY_SOURCE is not 'no'), signatures (.sign) of base
+    # tarball and of each patch are verified with gpgv instead - over the
+    # decompressed base while tar extracts, and over each decompressed
+    # patch before it is applied. If they cannot be verified (no keyring,
+    # no gpgv, signature not available), 1 is returned
+    # Sets KERNEL_SOURCE_VERIFIED to yes if signatures were verified
+    # Uses:
+    #   TARBALL_CACHE_SCRIPT
+    #   KERNEL_VERIFY_SOURCE
+    #   BUILD_DIR_PARENT
+    #   BUILD_DIR
+    #   START_END_TIME_FILEPATH
+    KERNEL_SOURCE_VERIFIED=no
+    if [ ! -x "$TARBALL_CACHE_SCRIPT" ]; then
+        return 1
+    fi
+    local keyring=""
+    local sigs_opt=""
+    if [ "$KERNEL_VERIFY_SOURCE" != "no" ] && [ -n "$2" -o -n "$3" ]; then
+        keyring=$(get_gpgv_keyring)
+        if [ -z "$keyring" ] || ! which gpgv 1>/dev/null 2>&1 ; then
+            echo "Not using incremental patches - signatures cannot be verified"
+            return 1
+        fi
+        sigs_opt="--sigs"
+    fi
+    local plan
+    plan=$("$TARBALL_CACHE_SCRIPT" incremental $sigs_opt "$1" 2>/dev/null)
+    if [ $? -ne 0 -o -z "$plan" ]; then
+        return 1
+    fi
+    local base_url=$(echo "$plan" | head -1 | awk '{print $1}')
+    local base_path=$(echo "$plan" | head -1 | awk '{print $2}')
+    local base_sig=$(echo "$plan" | head -1 | awk '{print $3}')
+    local num_patches=$(($(echo "$plan" | wc -l) - 1))
+    echo "Updating $(basename $base_url) to $(basename $1) with $num_patches incremental patch(es)"
+
+    oldpwd=$(pwd)
+    cd $BUILD_DIR_PARENT || return 1
+    show_timing_msg "${START_END_TIME_FILEPATH}" "Incremental update start" "yestee"
+    SECONDS=0
+    local DECOMPRESS_CMD=$(get_decompress_cmd "$base_url")
+    local gpgv_dir=$(mktemp -d)
+    local tee_cmd="cat"
+    local gpgv_pid=""
+    if [ -n "$sigs_opt" ]; then
+        mkfifo "$gpgv_dir/fifo"
+        gpgv --keyring "$keyring" "$base_sig" - < "$gpgv_dir/fifo" > "$gpgv_dir/gpgv.out" 2>&1 &
+        gpgv_pid=$!
+        tee_cmd="tee -p $gpgv_dir/fifo"
+    fi
+    $DECOMPRESS_CMD < "$base_path" | $tee_cmd | tar xf -
+    local pipe_status=(${PIPESTATUS[@]})
+    local failed=0
+    local rc
+    for rc in ${pipe_status[@]}
+    do
+        if [ $rc -ne 0 ]; then
+            failed=1
+        fi
+    done
+    if [ -n "$gpgv_pid" ]; then
+        wait $gpgv_pid
+        if [ $? -ne 0 ]; then
+            echo "Signature verification FAILED: $base_url"
+            cat "$gpgv_dir/gpgv.out"
+            failed=1
+        fi
+    fi
+    local kernel_dir=$(find . -mindepth 1 -maxdepth 1 -type d | sed -e 's/^\.//' -e 's/^\///')
+    if [ $failed -eq 0 ]; then
+        cd "$kernel_dir" || failed=1
+    fi
+    if [ $failed -eq 0 ]; then
+        local patch_url patch_path patch_sig
+        while read patch_url patch_path patch_sig
+        do
+            xz -d -c "$patch_path" > "$gpgv_dir/patch"
+            if [ $? -ne 0 ]; then
+                echo "Could not decompress incremental patch: $patch_url"
+                failed=1
+                break
+            fi
+            if [ -n "$sigs_opt" ]; then
+                gpgv --keyring "$keyring" "$patch_sig" "$gpgv_dir/patch" > "$gpgv_dir/gpgv.out" 2>&1
+                if [ $? -ne 0 ]; then
+                    echo "Signature verification FAILED: $patch_url"
+                    cat "$gpgv_dir/gpgv.out"
+                    failed=1
+                    break
+                fi
+            fi
+            patch -p1 -s -f -N --no-backup-if-mismatch < "$gpgv_dir/patch" 1>/dev/null
+            if [ $? -ne 0 ]; then
+                echo "Incremental patch failed: $patch_url"
+                failed=1
+                break
+            fi
+        done < <(echo "$plan" | tail -n +2)
+        cd $BUILD_DIR_PARENT
+    fi
+    \rm -rf "$gpgv_dir"
+    if [ $failed -eq 0 ]; then
+        \mv -f "$kernel_dir" "$BUILD_DIR" || failed=1
+    fi
+    if [ $failed -ne 0 ]; then
+        echo "Incremental update failed - downloading full tarball"
+        \rm -rf "${BUILD_DIR_PARENT:?}"/*
+        cd $oldpwd
+        return 1
+    fi
+    if [ -n "$sigs_opt" ]; then
+        KERNEL_SOURCE_VERIFIED=yes
+        show_timing_msg "${START_END_TIME_FILEPATH}" "Signatures of base tarball and patches verified" "yestee"
+    fi
+    show_timing_msg "${START_END_TIME_FILEPATH}" "Incremental update finished" "yestee" "$(get_hms)"
+    cd $oldpwd
+}
+
+function pristine_trees_enabled {
+    # Returns 0 if pristine tree cache is enabled, 1 otherwise
+    # Uses: KERNEL_PRISTINE_TREES (max number of pristine trees kept)
+    [[ "$KERNEL_PRISTINE_TREES" =~ ^[1-9][0-9]*$ ]]
+}
+
+function tar_prune_enabled {
+    # Returns 0 if kernel tarball is extracted pruned, 1 otherwise
+    # Source package built by deb-pkg needs the full source, so pruning
+    # is used only when building binary packages (bindeb-pkg)
+    # Uses:
+    #   KERNEL_TAR_PRUNE
+    #   KERNEL_BUILD_TARGET
+    [ "$KERNEL_TAR_PRUNE" = "yes" -a "$KERNEL_BUILD_TARGET" != "deb-pkg" ]
+}
+
+function git_sparse_enabled {
+    # Returns 0 if git kernel source is a partial clone with sparse
+    # checkout, 1 otherwise
+    # Source package built by deb-pkg needs the full source, so sparse
+    # checkout is used only when building binary packages (bindeb-pkg)
+    # Uses:
+    #   KERNEL_GIT_SPARSE
+    #   KERNEL_BUILD_TARGET
+    [ "$KERNEL_GIT_SPARSE" = "yes" -a "$KERNEL_BUILD_TARGET" != "deb-pkg" ]
+}
+
+function get_pristine_tree_key {
+    # $1: URL of kernel tarball
+    # $2: 'pruned' if tree is extracted with KERNEL_TAR_PRUNE=yes
+    # $3: 'unverified' if sha256 / signature of source was not verified
+    # Echoes dir name of pristine tree - e.g. linux-5.10.18 or
+    # linux-5.10.18-pruned-1a2b3c4d (hash of tar exclude patterns)
+    # Unverified trees get suffix -unverified
+    local name=$(basename "$1")
+    name=${name%.tar*}
+    if [ "$2" = "pruned" ]; then
+        name="${name}-pruned-$(get_tar_exclude_patterns | md5sum | cut -c1-8)"
+    fi
+    if [ "$3" = "unverified" ]; then
+        name="${name}-unverified"
+    fi
+    echo "$name"
+}
+
+function overlay_mount {
+    # $1: lower (read-only) dir
+    # $2: mount point - upper and work dirs are created next to it
+    # Needs root and overlay filesystem support
+    if [ $(id -u) -ne 0 ]; then
+        return 1
+    fi
+    grep -qw overlay /proc/filesystems || return 1
+    local ovl_dir="$(dirname "$2")/.overlay"
+    mkdir -p "$ovl_dir/upper" "$ovl_dir/work" "$2" || return 1
+    mount -t overlay overlay -o "lowerdir=$1,upperdir=$ovl_dir/upper,workdir=$ovl_dir/work" "$2" 2>/dev/null
+}
+
+function pristine_tree_clone {
+    # $1: pristine tree
+    # $2: dir to create - must not exist
+    # Tries methods in KERNEL_PRISTINE_TREE_MODE (default 'auto' - all,
+    # in this order):
+    #   reflink  - cp --reflink (btrfs, xfs) - blocks shared copy-on-write
+    #   overlay  - overlayfs mount with $1 as lower dir
+    #   hardlink - hardlink farm - patch(1) replaces files it patches, so
+    #              patching does not modify the pristine tree. Tools
+    #              that write to source files in place would modify it
+    #   copy     - plain copy
+    # Echoes method used. Returns 1 if all methods failed
+    local modes=${KERNEL_PRISTINE_TREE_MODE:-auto}
+    if [ "$modes" = "auto" ]; then
+        modes="reflink overlay hardlink copy"
+    fi
+    local m
+    for m in $modes
+    do
+        case "$m" in
+            reflink)
+                cp -a --reflink=always "$1" "$2" 2>/dev/null
+                ;;
+            overlay)
+                overlay_mount "$1" "$2"
+                ;;
+            hardlink)
+                cp -al "$1" "$2" 2>/dev/null
+                ;;
+            copy)
+                cp -a "$1" "$2"
+                ;;
+            *)
+                echo "Unknown KERNEL_PRISTINE_TREE_MODE: $m" 1>&2
+                false
+                ;;
+        esac
+        if [ $? -eq 0 ]; then
+            echo "$m"
+            return 0
+        fi
+        \rm -rf "$2"
+    done
+    return 1
+}
+
+function pristine_tree_checkout {
+    # $1: URL of kernel tarball
+    # $2: 'yes' if source must be verified - unverified trees are used
+    #     only otherwise
+    # Creates BUILD_DIR from pristine tree of $1 if one is cached
+    # A pruned tree (KERNEL_TAR_PRUNE=yes, see tar_prune_enabled) is
+    # preferred when pruning is enabled, but a full tree is also used
+    # Returns 1 if there is no pristine tree or it could not be used
+    # Uses:
+    #   KERNEL_PRISTINE_TREES
+    #   KERNEL_TAR_PRUNE
+    #   BUILD_DIR
+    #   START_END_TIME_FILEPATH
+    pristine_trees_enabled || return 1
+    local trees_dir="$(get_kernel_cache_dir)/trees"
+    local keys=$(get_pristine_tree_key "$1")
+    if tar_prune_enabled; then
+        keys="$(get_pristine_tree_key "$1" pruned) $keys"
+    fi
+    if [ "$2" != "yes" ]; then
+        local k
+        for k in $keys
+        do
+            keys="$keys ${k}-unverified"
+        done
+    fi
+    local k
+    local tree=""
+    for k in $keys
+    do
+        if [ -d "$trees_dir/$k" ]; then
+            tree="$trees_dir/$k"
+            break
+        fi
+    done
+    if [ -z "$tree" ]; then
+        return 1
+    fi
+    show_timing_msg "${START_END_TIME_FILEPATH}" "Pristine tree checkout start" "yestee"
+    SECONDS=0
+    # Shared lock - prune_pristine_trees must not delete tree while in use
+    local mode
+    mode=$( (
+        flock -s 9 || exit 1
+        pristine_tree_clone "$tree" "$BUILD_DIR"
+    ) 9>"${trees_dir}/.lock")
+    if [ $? -ne 0 ]; then
+        echo "Could not create BUILD_DIR from pristine tree $tree"
+        return 1
+    fi
+    touch "$tree"
+    echo "BUILD_DIR created from pristine tree ($mode): $tree"
+    show_timing_msg "${START_END_TIME_FILEPATH}" "Pristine tree checkout finished" "yestee" "$(get_hms)"
+}
+
+function pristine_tree_save {
+    # $1: URL of kernel tarball
+    # $2: 'pruned' if BUILD_DIR was extracted with KERNEL_TAR_PRUNE=yes
+    # $3: 'yes' if source must be verified
+    # Moves just-extracted (unpatched) BUILD_DIR into pristine tree cache
+    # and recreates BUILD_DIR from it with pristine_tree_clone
+    # Tree is saved only if KERNEL_SOURCE_VERIFIED is yes. If $3 is not
+    # yes, an unverified tree is saved with key suffix -unverified, which
+    # builds that verify the source never use
+    # KERNEL_CACHE_DIR should be on the same filesystem as
+    # KERNEL_BUILD_DIR - otherwise mv copies the tree and reflink and
+    # hardlink cannot be used
+    # Returns 0 if disabled
+    # Uses:
+    #   KERNEL_PRISTINE_TREES
+    #   KERNEL_SOURCE_VERIFIED (set by get_kernel_source_tar and
+    #       get_kernel_source_incr)
+    #   BUILD_DIR
+    #   START_END_TIME_FILEPATH
+    pristine_trees_enabled || return 0
+    local unverified=""
+    if [ "$KERNEL_SOURCE_VERIFIED" != "yes" ]; then
+        if [ "$3" = "yes" ]; then
+            echo "Not saving pristine tree - source was not verified"
+            return 0
+        fi
+        unverified=unverified
+    fi
+    local trees_dir="$(get_kernel_cache_dir)/trees"
+    local tree="$trees_dir/$(get_pristine_tree_key "$1" "$2" $unverified)"
+    mkdir -p "$trees_dir" || return 0
+    if [ -d "$tree" ]; then
+        return 0
+    fi
+    SECONDS=0
+    local mode
+    mode=$( (
+        flock 9 || exit 1
+        \mv -T "$BUILD_DIR" "$tree" || exit 1
+        pristine_tree_clone "$tree" "$BUILD_DIR" && exit 0
+        # Should not happen - put tree back
+        \mv -T "$tree" "$BUILD_DIR"
+        exit 1
+    ) 9>"${trees_dir}/.lock")
+    if [ $? -ne 0 ]; then
+        echo "Could not save pristine tree $tree"
+        [ -d "$BUILD_DIR" ]
+        return $?
+    fi
+    echo "Saved pristine tree - BUILD_DIR recreated ($mode): $tree"
+    show_timing_msg "${START_END_TIME_FILEPATH}" "Pristine tree saved" "yestee" "$(get_hms)"
+    prune_pristine_trees
+    return 0
+}
+
+function prune_pristine_trees {
+    # Deletes least recently used pristine trees, keeping
+    # KERNEL_PRISTINE_TREES trees. Trees used as overlay lower dirs are
+    # not deleted
+    # Uses: KERNEL_PRISTINE_TREES
+    local trees_dir="$(get_kernel_cache_dir)/trees"
+    (
+        flock 9 || exit 1
+        local tree
+        ls -1td "$trees_dir"/*/ 2>/dev/null | tail -n +$((KERNEL_PRISTINE_TREES + 1)) | while read tree
+        do
+            tree=${tree%/}
+            if grep -q "lowerdir=$tree[,: ]" /proc/mounts; then
+                continue
+            fi
+            echo "Deleting pristine tree $tree"
+            \rm -rf "$tree"
+        done
+    ) 9>"${trees_dir}/.lock"
+}
+
+function get_kernel_cache_dir {
+    # Echoes persistent cache dir - same as get_cache_dir() in pyutils.py
+    # Uses: KERNEL_CACHE_DIR
+    local d=${KERNEL_CACHE_DIR:-~/.cache/kernel_build}
+    readlink -m "${d/#\~/$HOME}"
+}
+
+function get_kernel_arch {
+    # Echoes kernel architecture (SRCARCH) - e.g. x86, arm64
+    # Uses ARCH if set, else maps architecture of this machine
+    local arch=${ARCH:-$(uname -m)}
+    case "$arch" in
+        x86_64|amd64|i386|i486|i586|i686|x86)
+            echo x86
+            ;;
+        aarch64|arm64)
+            echo arm64
+            ;;
+        arm*)
+            echo arm
+            ;;
+        ppc*|powerpc*)
+            echo powerpc
+            ;;
+        s390*)
+            echo s390
+            ;;
+        riscv*)
+            echo riscv
+            ;;
+        mips*)
+            echo mips
+            ;;
+        *)
+            echo "$arch"
+            ;;
+    esac
+}
+
+function get_kernel_src_arches {
+    # Echoes (one per line) dirs under arch/ needed to build for
+    # get_kernel_arch - arm64 device trees include files from arch/arm
+    local arch=$(get_kernel_arch)
+    echo "$arch"
+    if [ "$arch" = "arm64" ]; then
+        echo arm
+    fi
+}
+
+function get_sparse_patterns {
+    # Echoes (one per line) non-cone sparse-checkout patterns for kernel
+    # source - everything except:
+    #   Documentation/ (except Kconfig and Makefile files)
+    #   tools/testing/
+    #   arch/* other than the one we build (get_kernel_src_arches)
+    # Uses: KERNEL_GIT_SPARSE_EXTRA (space-separated paths to add back)
+    echo '/*'
+    echo '!/Documentation/'
+    echo '/Documentation/**/Kconfig'
+    echo '/Documentation/**/Makefile'
+    echo '!/tools/testing/'
+    echo '!/arch/*/'
+    local p
+    for p in $(get_kernel_src_arches)
+    do
+        echo "/arch/$p/"
+    done
+    for p in $KERNEL_GIT_SPARSE_EXTRA
+    do
+        echo "/${p#/}"
+    done
+}
+
+function get_tar_exclude_patterns {
+    # Echoes (one per line) GNU tar exclude patterns for pruned extraction
+    # of kernel source tarball - skips the same paths as
+    # get_sparse_patterns:
+    #   Documentation/ (except Kconfig and Makefile - used by Kbuild)
+    #   tools/testing/
+    #   arch/* other than the one we build (get_kernel_src_arches)
+    #   paths in KERNEL_TAR_PRUNE_EXCLUDE
+    # Patterns are for use with --anchored --no-wildcards-match-slash
+    # Leading '*/' matches the top-level dir in the tarball
+    # Uses: KERNEL_TAR_PRUNE_EXCLUDE (space-separated paths to skip)
+    echo '*/Documentation/[!KM]*'
+    echo '*/tools/testing'
+    local keep=" $(echo $(get_kernel_src_arches)) "
+    local p
+    for p in $KERNEL_ARCH_DIRS
+    do
+        if [ "${keep/ $p /}" = "$keep" ]; then
+            echo "*/arch/$p"
+        fi
+    done
+    for p in $KERNEL_TAR_PRUNE_EXCLUDE
+    do
+        p=${p#/}
+        echo "*/${p%/}"
+    done
+}
+
+function kernel_sparse_add {
+    # Adds paths to sparse checkout of BUILD_DIR - missing blobs are
+    # fetched on demand from the partial clone's remote
+    # $@: paths relative to top of kernel source - e.g. arch/arm64
+    # Uses: BUILD_DIR
+    if [ "$(git -C "$BUILD_DIR" config --get core.sparseCheckout)" != "true" ]; then
+        return 0
+    fi
+    local p
+    local patterns=""
+    for p in "$@"
+    do
+        patterns="$patterns /${p#/}"
+    done
+    if [ -z "$patterns" ]; then
+        return 0
+    fi
+    echo "Adding to sparse checkout:$patterns"
+    git -C "$BUILD_DIR" sparse-checkout add $patterns
+}
+
+function kernel_sparse_disable {
+    # Checks out the full tree in sparse checkout of BUILD_DIR - missing
+    # blobs are fetched on demand from the partial clone's remote
+    # Returns 1 if BUILD_DIR is not a sparse checkout or it failed
+    # Uses: BUILD_DIR
+    if [ "$(git -C "$BUILD_DIR" config --get core.sparseCheckout)" != "true" ]; then
+        return 1
+    fi
+    echo "Disabling sparse checkout - checking out full kernel source"
+    git -C "$BUILD_DIR" sparse-checkout disable
+}
+
+function get_kernel_source_git_mirror() {
+    # $1: URL
+    # Updates persistent bare repository under KERNEL_CACHE_DIR with an
+    # incremental git fetch - only objects that are not already in the
+    # repository are transferred - and creates BUILD_DIR as a
+    # git worktree of it
+    # All git kernel URLs (linux-next, torvalds ...) share one repository,
+    # each URL is a remote with its own ref, since they share most objects
+    # If git_sparse_enabled, fetch is a partial fetch
+    # (--filter=blob:none) and BUILD_DIR is a sparse checkout (see
+    # get_sparse_patterns) - only blobs that are checked out are fetched.
+    # apply_patches adds files patched (kernel_sparse_add) and
+    # build_kernel checks out the full tree (kernel_sparse_disable) if
+    # the build fails - their blobs are fetched on demand
+    # Returns 1 if repository could not be used - BUILD_DIR is not created
+    # Uses:
+    #   KERNEL_GIT_MIRROR
+    #   KERNEL_GIT_MIRROR_DEPTH
+    #   KERNEL_GIT_SPARSE
+    #   KERNEL_BUILD_TARGET
+    #   BUILD_DIR
+    if [ "$KERNEL_GIT_MIRROR" = "no" ]; then
+        return 1
+    fi
+    local mirror_dir="$(get_kernel_cache_dir)/git/linux.git"
+    local remote=$(echo "$1" | sed -e 's|^[a-z+]*://||' -e 's|[^A-Za-z0-9._-]|_|g')
+    local ref="refs/kernel_build/$remote"
+    local depth_opt="--depth ${KERNEL_GIT_MIRROR_DEPTH:-1}"
+    if [ "$KERNEL_GIT_MIRROR_DEPTH" = "0" ]; then
+        depth_opt=""
+    fi
+    local filter_opt=""
+    local checkout_opt=""
+    if git_sparse_enabled; then
+        filter_opt="--filter=blob:none"
+        checkout_opt="--no-checkout"
+    fi
+    mkdir -p "$mirror_dir" || return 1
+    # Lock - concurrent builds must not update repository at the same time
+    (
+        flock 9 || exit 1
+        if [ ! -f "$mirror_dir/HEAD" ]; then
+            git init -q --bare "$mirror_dir" || exit 1
+        fi
+        # Partial fetch needs a named (promisor) remote
+        git --git-dir="$mirror_dir" remote add "$remote" "$1" 2>/dev/null || \
+            git --git-dir="$mirror_dir" remote set-url "$remote" "$1" || exit 1
+        echo "Updating git mirror $mirror_dir from $1"
+        git --git-dir="$mirror_dir" fetch -q $depth_opt $filter_opt --no-tags "$remote" "+HEAD:$ref" || exit 1
+        # Worktrees from earlier builds were deleted by create_dirs
+        git --git-dir="$mirror_dir" worktree prune
+        git --git-dir="$mirror_dir" worktree add -q $checkout_opt --detach "$BUILD_DIR" "$ref" || exit 1
+        if git_sparse_enabled; then
+            echo "Sparse checkout for arch $(get_kernel_arch)"
+            get_sparse_patterns | git -C "$BUILD_DIR" sparse-checkout set --no-cone --stdin || exit 1
+            git -C "$BUILD_DIR" checkout -q --detach "$ref" || exit 1
+        fi
+    ) 9>"${mirror_dir}.lock"
+}
+
 function get_kernel_source_git() {
     # $1: URL
     # Will extract under BUILD_DIR_PARENT to BUILD_DIR
     # Assumes that $1 has already been verified to be a git URL
+    # Uses persistent git mirror (get_kernel_source_git_mirror) unless
+    # KERNEL_GIT_MIRROR=no or it fails, GIT_CLONE_COMMAND otherwise
     oldpwd=$(pwd)
     cd $BUILD_DIR_PARENT || return 1
     show_timing_msg "${START_END_TIME_FILEPATH}" "Retrieve kernel source start" "yestee"
     SECONDS=0
-    $GIT_CLONE_COMMAND "$1" linux || return 1
+    get_kernel_source_git_mirror "$1"
+    if [ $? -ne 0 ]; then
+        \rm -rf "$BUILD_DIR"
+        $GIT_CLONE_COMMAND "$1" linux || return 1
+    fi
     show_timing_msg "${START_END_TIME_FILEPATH}" "Retrieve kernel source finished" "yestee" "$(get_hms)"
     cd $oldpwd
 }
@@ -781,10 +1821,80 @@ function can_build_metapackage_first() {
 
 }
 
+function kill_process_tree {
+    # $1: PID - kills $1 and all its descendants
+    # Stops $1 first, so that it cannot start new children
+    kill -STOP "$1" 2>/dev/null || return 0
+    local child
+    for child in $(pgrep -P "$1")
+    do
+        kill_process_tree "$child"
+    done
+    kill -TERM "$1" 2>/dev/null
+    kill -CONT "$1" 2>/dev/null
+}
+
+function get_kernel_source_overlapped {
+    # $1: required disk space in bytes
+    # Used when KERNEL_BUILD_PIPELINE=overlap
+    # Runs get_kernel_source in the background (output goes to
+    # SOURCE_OUT_FILEPATH and is shown when it finishes) while
+    # check_avail_disk_space, CHECK_REQD_PKGS_SCRIPT and (if
+    # can_build_metapackage_first) build_metapackages - which may prompt
+    # for passphrase - run in the foreground
+    # If any step fails, the background download is killed
+    # Returns: 0 if source was retrieved and all steps succeeded
+    # Uses:
+    #   KB_TOP_DIR
+    #   BUILD_DIR
+    #   SOURCE_OUT_FILEPATH
+    local meta_first=no
+    can_build_metapackage_first && meta_first=yes
+
+    show_timing_msg "${START_END_TIME_FILEPATH}" "Background kernel source start" "yestee"
+    get_kernel_source 1>"$SOURCE_OUT_FILEPATH" 2>&1 &
+    local src_pid=$!
+    trap "kill_process_tree $src_pid; exit 1" INT TERM
+
+    local failed=0
+    check_avail_disk_space $1 $KB_TOP_DIR || failed=1
+    if [ $failed -eq 0 ]; then
+        $CHECK_REQD_PKGS_SCRIPT || failed=1
+    fi
+    # build_metapackages calls exit on failure
+    if [ $failed -eq 0 -a $meta_first = "yes" ]; then
+        ( build_metapackages ) || failed=1
+    fi
+    if [ $failed -ne 0 ]; then
+        kill_process_tree $src_pid
+    fi
+    wait $src_pid
+    local src_ret=$?
+    trap - INT TERM
+    echo ""
+    echo "--------- Kernel source (background) ----------"
+    cat "$SOURCE_OUT_FILEPATH"
+    echo ""
+    if [ $failed -ne 0 ]; then
+        return 1
+    fi
+    if [ $src_ret -ne 0 ]; then
+        return $src_ret
+    fi
+    if [ $meta_first = "no" ]; then
+        KERN_VER=$(kernel_version $BUILD_DIR) || return 1
+        build_metapackages || return 1
+    fi
+}
+
 function get_kernel_source {
     # Uses:
     #   START_END_TIME_FILEPATH
-    #   KERNEL_SOURCE_SCRIPT
+    #   MANIFEST_URL (set by load_build_manifest)
+    #   MANIFEST_ORIGIN_URL (set by load_build_manifest)
+    #   MANIFEST_SIG_URL (set by load_build_manifest)
+    #   MANIFEST_SHA256 (set by load_build_manifest)
+    #   BUILD_MANIFEST_FILEPATH
     #   BUILD_PARENT_DIR
     #   BUILD_DIR
 
@@ -795,19 +1905,13 @@ function get_kernel_source {
             $SHOW_CONFIG_VER_SCRIPT
         fi
     else
-        if [ ! -x "${KERNEL_SOURCE_SCRIPT}" ]; then
-            echo "Kernel source script not found: ${KERNEL_SOURCE_SCRIPT}"
-            return 1
-        fi
-        local kurl=$(${KERNEL_SOURCE_SCRIPT})
+        local kurl=$MANIFEST_URL
         if [ -z "${kurl}" ]; then
-            echo "Could not get kernel source URL from ${KERNEL_SOURCE_SCRIPT}"
+            echo "Could not get kernel source URL from build manifest: ${BUILD_MANIFEST_FILEPATH}"
             return 1
         fi
         # Show available kernels and kernel version of available config
-        if [ -x "${SHOW_AVAIL_KERNELS_SCRIPT}" ]; then
-            $SHOW_AVAIL_KERNELS_SCRIPT
-        fi
+        "${RESOLVE_KERNEL_SCRIPT}" show "$BUILD_MANIFEST_FILEPATH"
     fi
 
     # First check if it is a git repo
@@ -822,14 +1926,52 @@ function get_kernel_source {
         fi
     # Is it ending in a tar suffix that we know?
     elif [[ $kurl == *.tar ]] || [[ $kurl == *.tar.gz ]] || [[ $kurl == *.tar.bz2 ]] || [[ $kurl == *.tar.xz ]] ; then
-        is_valid_url "$kurl"
-        if [ $? -eq 0 ]; then
-            get_kernel_source_tar "$kurl"
+        # No network requests before pristine tree and tarball cache are
+        # checked - get_kernel_source_tar checks URL only if it downloads
+        local sig_url=""
+        local sha256=""
+        if [ -z "$KERNEL_SOURCE_URL" ]; then
+            sig_url=$MANIFEST_SIG_URL
+            sha256=$MANIFEST_SHA256
+        fi
+        local pruned=""
+        if tar_prune_enabled; then
+            pruned=pruned
+        fi
+        # Source must be verified if there is something to verify it with
+        local verify=yes
+        if [ "$KERNEL_VERIFY_SOURCE" = "no" ] || [ -z "$sig_url" -a -z "$sha256" ]; then
+            verify=no
+        fi
+        pristine_tree_checkout "$kurl" "$verify" && return 0
+        local cached=""
+        if [ -x "$TARBALL_CACHE_SCRIPT" ]; then
+            local sha256_opt=""
+            if [ -n "$sha256" -a "$KERNEL_VERIFY_SOURCE" != "no" ]; then
+                sha256_opt="--sha256 $sha256"
+            fi
+            cached=$("$TARBALL_CACHE_SCRIPT" path $sha256_opt "$kurl")
+        fi
+        # Trees updated with incremental patches are never pruned
+        if [ -z "$cached" ] && get_kernel_source_incr "$kurl" "$sig_url" "$sha256"; then
+            pristine_tree_save "$kurl" "" "$verify"
             return $?
-        else
-            echo "Not a git URL: $kurl"
-            return 1
         fi
+        if get_kernel_source_tar "$kurl" "$sig_url" "$sha256"; then
+            pristine_tree_save "$kurl" "$pruned" "$verify"
+            return $?
+        fi
+        # Fastest mirror failed - fall back to URL before mirror selection
+        rm -rf "${BUILD_DIR_PARENT:?}"/*
+        if [ -z "$KERNEL_SOURCE_URL" -a -n "$MANIFEST_ORIGIN_URL" -a "$MANIFEST_ORIGIN_URL" != "$kurl" ]; then
+            echo "Retrying from $MANIFEST_ORIGIN_URL"
+            if get_kernel_source_tar "$MANIFEST_ORIGIN_URL" "$sig_url" "$sha256"; then
+                pristine_tree_save "$kurl" "$pruned" "$verify"
+                return $?
+            fi
+            rm -rf "${BUILD_DIR_PARENT:?}"/*
+        fi
+        return 1
     else
         # Didn't match known patterns - cannot handle it as a TAR URL
         # since we already checked the endings we support
@@ -875,6 +2017,12 @@ function apply_patches {
         echo "Not applying any patches"
         return
     fi
+    # Sparse checkout (KERNEL_GIT_SPARSE) may have left out files that
+    # patches change - add them (with --- and +++ paths, -p1)
+    kernel_sparse_add $(sed -n \
+        -e 's|^--- [^/[:space:]]*/\([^[:space:]]*\).*|\1|p' \
+        -e 's|^+++ [^/[:space:]]*/\([^[:space:]]*\).*|\1|p' \
+        "$PATCH_DIR_PATH"/* | grep -vx 'dev/null' | sort -u)
     local oldpwd=$(pwd)
     cd "${BUILD_DIR}"
 
@@ -903,15 +2051,72 @@ function apply_patches {
     cd $oldpwd
 }
 
+function get_kbuild_output {
+    # Echoes persistent out-of-tree kernel object dir (make O=) for kernel
+    # in BUILD_DIR - one per (version, arch): KB_OBJS_DIR/<version>-<arch>/obj
+    # make bindeb-pkg writes debs to its parent dir
+    # Echoes nothing if KERNEL_INCREMENTAL_BUILD is not 'yes'
+    # Returns 1 if kernel version could not be determined
+    if [ "$KERNEL_INCREMENTAL_BUILD" != "yes" ]; then
+        return 0
+    fi
+    local kver=$(KBUILD_OUTPUT= kernel_version "$BUILD_DIR")
+    if [ -z "$kver" ]; then
+        return 1
+    fi
+    echo "${KB_OBJS_DIR}/${kver}-$(get_kernel_arch)/obj"
+}
+
+function set_kbuild_output {
+    # Exports KBUILD_OUTPUT (see get_kbuild_output) if
+    # KERNEL_INCREMENTAL_BUILD=yes - make in BUILD_DIR then builds in
+    # the persistent object dir, so that only objects affected by
+    # changed sources (patches) or config symbols are rebuilt
+    # Deletes least recently used object dirs, keeping KB_OBJS_KEEP
+    # Returns 1 if object dir could not be created
+    # Uses:
+    #   KERNEL_INCREMENTAL_BUILD
+    #   KB_OBJS_DIR
+    #   BUILD_DIR
+    if [ "$KERNEL_INCREMENTAL_BUILD" != "yes" ]; then
+        return 0
+    fi
+    local d
+    d=$(get_kbuild_output)
+    if [ $? -ne 0 -o -z "$d" ]; then
+        echo "Could not get kernel version for incremental build: $BUILD_DIR"
+        return 1
+    fi
+    mkdir -p "$d" || return 1
+    touch "$(dirname "$d")"
+    local old
+    ls -1td "$KB_OBJS_DIR"/*/ 2>/dev/null | tail -n +$((KB_OBJS_KEEP + 1)) | while read old
+    do
+        echo "Deleting kernel object dir $old"
+        \rm -rf "$old"
+    done
+    KBUILD_OUTPUT=$d
+    export KBUILD_OUTPUT
+}
+
 function restore_kernel_config {
     #
     # Uses:
     #   BUILD_DIR
     #   CONFIG_FILE_PATH
+    #   KERNEL_INCREMENTAL_BUILD
     #
+    # With KERNEL_INCREMENTAL_BUILD=yes, .config is in the persistent
+    # object dir (KBUILD_OUTPUT) and is ALWAYS restored - make oldconfig
+    # (syncconfig) only updates include/config/ for symbols that changed
+    # since the last build, so only the config delta is rebuilt
 
+    set_kbuild_output || return 1
     local oldpwd=$(pwd)
-    cd "$BUILD_DIR"
+    cd "${KBUILD_OUTPUT:-$BUILD_DIR}"
+    if [ -n "$KBUILD_OUTPUT" ]; then
+        \rm -f .config
+    fi
     if [ ! -f .config ]; then
         if [ -f "${CONFIG_FILE_PATH}" ]; then
             cp "${CONFIG_FILE_PATH}" .config
@@ -962,8 +2167,8 @@ function run_make_oldconfig {
         echo "BUILD_DIR is not a directory: $BUILD_DIR"
         return 1
     fi
-    if [ ! -f "${BUILD_DIR}/.config" ]; then
-        echo ".config not found: ${BUILD_DIR}/.config"
+    if [ ! -f "${KBUILD_OUTPUT:-$BUILD_DIR}/.config" ]; then
+        echo ".config not found: ${KBUILD_OUTPUT:-$BUILD_DIR}/.config"
         return 1
     fi
     if [ -z "$UPDATE_CONFIG_SCRIPT" ]; then
@@ -985,6 +2190,75 @@ function run_make_oldconfig {
 }
 
 
+function ccache_enabled {
+    # Returns 0 if compiles should use ccache
+    # Uses: KERNEL_CCACHE
+    if [ "$KERNEL_CCACHE" = "no" ]; then
+        return 1
+    fi
+    which ccache 1>/dev/null 2>&1
+}
+
+function setup_ccache {
+    # Exports ccache environment - persistent cache dir with size cap
+    # Uses:
+    #   KERNEL_CCACHE_DIR
+    #   KERNEL_CCACHE_MAXSIZE
+    #   KB_TOP_DIR
+    local d=${KERNEL_CCACHE_DIR:-$(get_kernel_cache_dir)/ccache}
+    CCACHE_DIR=$(readlink -m "${d/#\~/$HOME}")
+    CCACHE_MAXSIZE=${KERNEL_CCACHE_MAXSIZE:-20G}
+    # Paths under KB_TOP_DIR are hashed relative to current dir, so that
+    # builds in different KERNEL_BUILD_DIRs share cache entries
+    CCACHE_BASEDIR=$KB_TOP_DIR
+    export CCACHE_DIR CCACHE_MAXSIZE CCACHE_BASEDIR
+    mkdir -p "$CCACHE_DIR"
+}
+
+function show_ccache_stats {
+    # Shows ccache hits, misses and cache size since stats were zeroed
+    # (ccache -z) and appends them to START_END_TIME_FILEPATH
+    # Uses: START_END_TIME_FILEPATH
+    local stats hits misses size
+    stats=$(ccache --print-stats 2>/dev/null)
+    if [ $? -eq 0 ]; then
+        # ccache >= 4
+        hits=$(echo "$stats" | awk '$1 == "direct_cache_hit" || $1 == "preprocessed_cache_hit" {s += $2} END {print s + 0}')
+        misses=$(echo "$stats" | awk '$1 == "cache_miss" {print $2 + 0}')
+        size=$(echo "$stats" | awk '$1 == "cache_size_kibibyte" {printf "%.1f GB", $2 / 1048576}')
+    else
+        stats=$(ccache -s 2>/dev/null)
+        hits=$(echo "$stats" | awk '/^cache hit \(/ {s += $NF} END {print s + 0}')
+        misses=$(echo "$stats" | awk '/^cache miss/ {print $NF + 0}')
+        size=$(echo "$stats" | awk '/^cache size/ {print $(NF-1), $NF}')
+    fi
+    hits=${hits:-0}
+    misses=${misses:-0}
+    local rate=0
+    if [ $((hits + misses)) -gt 0 ]; then
+        rate=$((hits * 100 / (hits + misses)))
+    fi
+    {
+        printf "%-39s: %s\n" "ccache hits" "$hits"
+        printf "%-39s: %s\n" "ccache misses" "$misses"
+        printf "%-39s: %s%%\n" "ccache hit rate" "$rate"
+        printf "%-39s: %s (max %s)\n" "ccache size" "${size:-unknown}" "$CCACHE_MAXSIZE"
+    } | tee -a "${START_END_TIME_FILEPATH:-/dev/null}"
+}
+
+function show_threads_reason {
+    # Uses:
+    #   MAKE_THREADED
+    #   THREADS_REASON
+    #   START_END_TIME_FILEPATH
+    {
+        printf "%-39s: %s\n" "Make command" "$MAKE_THREADED"
+        if [ -n "$THREADS_REASON" ]; then
+            echo "$THREADS_REASON" | sed -e "s/^/${INDENT}/"
+        fi
+    } | tee -a "${START_END_TIME_FILEPATH:-/dev/null}"
+}
+
 function build_kernel {
     #
     # Uses:
@@ -995,15 +2269,27 @@ function build_kernel {
     #   START_END_TIME_FILEPATH
     #   DEB_DIR
     #   OLDCONFIG_OUT_FILEPATH
+    #   KERNEL_CCACHE
+    #   KERNEL_INCREMENTAL_BUILD
+    #   THREADS_REASON
+    #   BUILD_DIR
     #
 
+    set_kbuild_output || return 1
     local oldpwd="$(pwd)"
     cd $BUILD_DIR
     SECONDS=0
     \cp -f /dev/null "${COMPILE_OUT_FILEPATH}"
     local elapsed=''
+    local cc_args=()
+    if ccache_enabled; then
+        setup_ccache
+        ccache -z 1>/dev/null
+        cc_args=("CC=ccache gcc")
+    fi
 
     show_timing_msg "${START_END_TIME_FILEPATH}" "Kernel build start" "yestee" ""
+    show_threads_reason
     run_make_oldconfig
     [ $? -ne 0 ] && (tail -20 "${COMPILE_OUT_FILEPATH}"; echo ""; echo "See ${COMPILE_OUT_FILEPATH}") && cd "$oldpwd" && return 1
 
@@ -1016,14 +2302,27 @@ function build_kernel {
     # Directly build ${KERNEL_BUILD_TARGET} (bindeb-pkg or deb-pkg) instead of
     # first building bzImage, modules ... faster
     show_timing_msg "${START_END_TIME_FILEPATH}" "Kernel deb build start" "yestee" ""; SECONDS=0
-    $MAKE_THREADED ${KERNEL_BUILD_TARGET} 1>>"${COMPILE_OUT_FILEPATH}" 2>&1
-    [ $? -ne 0 ] && (tail -20 "${COMPILE_OUT_FILEPATH}"; echo ""; echo "See ${COMPILE_OUT_FILEPATH}") && cd "$oldpwd" && return 1
+    $MAKE_THREADED "${cc_args[@]}" ${KERNEL_BUILD_TARGET} 1>>"${COMPILE_OUT_FILEPATH}" 2>&1
+    local ret=$?
+    # Build may need files left out of sparse checkout (KERNEL_GIT_SPARSE)
+    if [ $ret -ne 0 ] && kernel_sparse_disable; then
+        echo "Kernel build failed with sparse checkout - retrying with full source"
+        $MAKE_THREADED "${cc_args[@]}" ${KERNEL_BUILD_TARGET} 1>>"${COMPILE_OUT_FILEPATH}" 2>&1
+        ret=$?
+    fi
+    [ $ret -ne 0 ] && (tail -20 "${COMPILE_OUT_FILEPATH}"; echo ""; echo "See ${COMPILE_OUT_FILEPATH}") && cd "$oldpwd" && return 1
 
     show_timing_msg "${START_END_TIME_FILEPATH}" "Kernel deb build finished" "yestee" "$(get_hms)"
+    if ccache_enabled; then
+        show_ccache_stats
+    fi
     show_timing_msg "${START_END_TIME_FILEPATH}" "Kernel build finished" "notee" ""
 
     cd  "${BUILD_DIR_PARENT}"
     find . -maxdepth 1 -type f -exec mv {} ${DEB_DIR}/ \;
+    if [ -n "$KBUILD_OUTPUT" ]; then
+        find "$(dirname "$KBUILD_OUTPUT")" -maxdepth 1 -type f -exec mv {} ${DEB_DIR}/ \;
+    fi
     rm -f "${OLDCONFIG_OUT_FILEPATH}"
 
     echo "-------------------------- Kernel compile time -------------------------------"
@@ -1041,69 +2340,102 @@ function build_kernel {
     cd "$oldpwd"
 }
 
-function build_zfs() {
+function get_zfs_build_dir() {
+    # $1: ZFS_BUILD_DIR - echoes __zfs_build dir within ZFS_BUILD_DIR
+    echo "$(readlink -m "$1")"/__zfs_build
+}
+
+function build_zfs_fetch() {
     # $1: ZFS_BUILD_DIR - must exist - will create / empty __zfs_build dir within ZFS_BUILD_DIR
-    # $2: ZFS_LINUX_DIR - must exist (and contain linux kernel source)
+    # Clones latest ZFS release and runs autogen.sh - does not need
+    # kernel source
+    # Output goes to ZFS_OUT_FILEPATH if set, else COMPILE_OUT_FILEPATH
     if [ "$KERNEL_BUILD_ZFS" != "yes" ]; then
-        echo "Not building ZFS because KERNEL_BUILD_ZFS not set to 'yes' (${KERNEL_BIULD_ZFS:-not set})"
         return 0
     fi
-    if [ -z "$2" ]; then
-        echo "Usage: rebuild_zfs <ZFS_BUILD_DIR> <ZFS_LINUX_DIR> - both must be existing dirs"
+    if [ -z "$1" ]; then
+        echo "Usage: build_zfs_fetch <ZFS_BUILD_DIR> - must be existing dir"
         return 1
     fi
-
+    if [ ! -d "$1" ]; then
+        echo "Not a directory: $1"
+        return 2
+    fi
+    local zfs_out="${ZFS_OUT_FILEPATH:-$COMPILE_OUT_FILEPATH}"
     local zfs_github_url='https://github.com/openzfs/zfs.git'
     local latest_tag=$(git ls-remote --tags --quiet --refs $zfs_github_url | tail -1 | cut -d/ -f3)
+    local ZFS_BUILD_DIR=$(get_zfs_build_dir "$1")
+
+    echo "Cleaning up"
+    \rm -rf "$ZFS_BUILD_DIR"
+    mkdir -p "$ZFS_BUILD_DIR" "$ZFS_BUILD_DIR"/zfs_kernel_debs "$ZFS_BUILD_DIR"/zfs_userspace_debs "$ZFS_BUILD_DIR"/debug
+
+    cd "${ZFS_BUILD_DIR}"
+    echo "Cloning ZFS $latest_tag from github"
+    git clone --depth 1 --branch "$latest_tag" "$zfs_github_url" zfs 1>>"$zfs_out" 2>&1 || return 4
+
+    cd "${ZFS_BUILD_DIR}/zfs"
+    echo "Running autogen.sh"
+    sh autogen.sh 1>>"$zfs_out" 2>&1 || return 5
+}
+
+function build_zfs_compile() {
+    # $1: ZFS_BUILD_DIR - __zfs_build dir within it must have been
+    #     created by build_zfs_fetch
+    # $2: ZFS_LINUX_DIR - must exist (and contain built linux kernel source)
+    # Output goes to ZFS_OUT_FILEPATH if set, else COMPILE_OUT_FILEPATH
+    if [ "$KERNEL_BUILD_ZFS" != "yes" ]; then
+        return 0
+    fi
+    if [ -z "$2" ]; then
+        echo "Usage: build_zfs_compile <ZFS_BUILD_DIR> <ZFS_LINUX_DIR> - both must be existing dirs"
+        return 1
+    fi
+
+    local zfs_out="${ZFS_OUT_FILEPATH:-$COMPILE_OUT_FILEPATH}"
     local MAKE_TARGETS="deb-dkms deb-utils"
     local kernel_deb_list='zfs-dkms*.deb'
     local userspace_deb_list='libnvpair*.deb libuutil*.deb libzfs*.deb libzpool*.deb zfs_*.deb zfs-initramfs*'
 
-    local ZFS_BUILD_DIR=$1
-    local ZFS_LINUX_DIR=$2
-
-    ZFS_BUILD_DIR=$(readlink -m "$ZFS_BUILD_DIR")
-    ZFS_LINUX_DIR=$(readlink -m "$ZFS_LINUX_DIR")
-    if [ ! -d "$ZFS_BUILD_DIR" ]; then
-        echo "Not a directory: $ZFS_BUILD_DIR"
+    local ZFS_BUILD_DIR=$(get_zfs_build_dir "$1")
+    local ZFS_LINUX_DIR=$(readlink -m "$2")
+    set_kbuild_output || return 1
+    local ZFS_LINUX_OBJ=${KBUILD_OUTPUT:-$ZFS_LINUX_DIR}
+    if [ ! -d "$ZFS_BUILD_DIR/zfs" ]; then
+        echo "Not a directory: $ZFS_BUILD_DIR/zfs"
         return 2
     fi
     if [ ! -d "$ZFS_LINUX_DIR" ]; then
         echo "Not a directory: $ZFS_LINUX_DIR"
         return 3
     fi
-    ZFS_BUILD_DIR="$ZFS_BUILD_DIR"/__zfs_build
     local ZFS_KERNEL_DEB_DIR="$ZFS_BUILD_DIR"/zfs_kernel_debs
     local ZFS_USERSPACE_DEB_DIR="$ZFS_BUILD_DIR"/zfs_userspace_debs
-    local ZFS_DEBUG_DIR="$ZFS_BUILD_DIR"/debug
-    for v in MAKE_TARGETS ZFS_BUILD_DIR ZFS_LINUX_DIR ZFS_KERNEL_DEB_DIR ZFS_USERSPACE_DEB_DIR 
+    for v in MAKE_TARGETS ZFS_BUILD_DIR ZFS_LINUX_DIR ZFS_LINUX_OBJ ZFS_KERNEL_DEB_DIR ZFS_USERSPACE_DEB_DIR 
     do
         printf "%-24s %s\n" "$v" "${!v}"
     done
     echo ""
 
-    echo "Cleaning up"
-    \rm -rf "$ZFS_BUILD_DIR"
-    mkdir -p "$ZFS_BUILD_DIR" "$ZFS_KERNEL_DEB_DIR" "$ZFS_USERSPACE_DEB_DIR" "$ZFS_DEBUG_DIR"
-
     local fn_ret=0
 
-    cd "${ZFS_BUILD_DIR}"
-    echo "Cloning ZFS $latest_tag from github"
-    git clone --depth 1 --branch "$latest_tag" "$zfs_github_url" zfs 1>>"$COMPILE_OUT_FILEPATH" 2>&1 || return 4
-
     cd "${ZFS_BUILD_DIR}/zfs"
-    echo "Running autogen.sh"
-    sh autogen.sh 1>>"$COMPILE_OUT_FILEPATH" 2>&1 || return 5
+    local latest_tag=$(git describe --tags 2>/dev/null)
+    # configure records CC for make
+    local cc_env=()
+    if ccache_enabled; then
+        setup_ccache
+        cc_env=("CC=ccache gcc")
+    fi
     echo "Running configure"
     if [ -n "$ZFS_LINUX_DIR" -a -d "$ZFS_LINUX_DIR" ]; then
-        ./configure --enable-systemd --with-linux="${ZFS_LINUX_DIR}" --with-linux-obj="${ZFS_LINUX_DIR}" 1>>"$COMPILE_OUT_FILEPATH" 2>&1 || return 6
+        env "${cc_env[@]}" ./configure --enable-systemd --with-linux="${ZFS_LINUX_DIR}" --with-linux-obj="${ZFS_LINUX_OBJ}" 1>>"$zfs_out" 2>&1 || return 6
     else
-        ./configure --enable-systemd 1>>"$COMPILE_OUT_FILEPATH" 2>&1 || return 7
+        env "${cc_env[@]}" ./configure --enable-systemd 1>>"$zfs_out" 2>&1 || return 7
     fi
 
     echo "make $MAKE_TARGETS"
-    make -j$(nproc) $MAKE_TARGETS 1>>"$COMPILE_OUT_FILEPATH" 2>&1 || return 8
+    $MAKE_THREADED $MAKE_TARGETS 1>>"$zfs_out" 2>&1 || return 8
 
     \mv -f $kernel_deb_list "$ZFS_KERNEL_DEB_DIR"/ 2>/dev/null
     \mv -f $userspace_deb_list "$ZFS_USERSPACE_DEB_DIR"/ 2>/dev/null
@@ -1141,6 +2473,25 @@ function build_zfs() {
     return $fn_ret
 }
 
+function build_zfs() {
+    # $1: ZFS_BUILD_DIR - must exist - will create / empty __zfs_build dir within ZFS_BUILD_DIR
+    # $2: ZFS_LINUX_DIR - must exist (and contain linux kernel source)
+    if [ "$KERNEL_BUILD_ZFS" != "yes" ]; then
+        echo "Not building ZFS because KERNEL_BUILD_ZFS not set to 'yes' (${KERNEL_BIULD_ZFS:-not set})"
+        return 0
+    fi
+    if [ -z "$2" ]; then
+        echo "Usage: rebuild_zfs <ZFS_BUILD_DIR> <ZFS_LINUX_DIR> - both must be existing dirs"
+        return 1
+    fi
+    if [ ! -d "$2" ]; then
+        echo "Not a directory: $(readlink -m "$2")"
+        return 3
+    fi
+    build_zfs_fetch "$1" || return $?
+    build_zfs_compile "$1" "$2"
+}
+
 function old_unused_build_kernel {
     #
     # Uses:
@@ -1160,6 +2511,7 @@ function old_unused_build_kernel {
     local elapsed=''
 
     show_timing_msg "${START_END_TIME_FILEPATH}" "Kernel build start" "yestee" ""
+    show_threads_reason
     run_make_oldconfig
     [ $? -ne 0 ] && (tail -20 "${COMPILE_OUT_FILEPATH}"; echo ""; echo "See ${COMPILE_OUT_FILEPATH}") && cd "$oldpwd" && return 1
     $MAKE_THREADED $KERNEL_IMAGE_NAME 1>>"${COMPILE_OUT_FILEPATH}" 2>&1
@@ -1232,6 +2584,303 @@ function build_metapackages() {
     fi
 }
 
+#-------------------------------------------------------------------------
+# DAG step scheduler - used by patch_and_build_kernel.sh when
+# KERNEL_BUILD_PIPELINE=dag
+#-------------------------------------------------------------------------
+
+function dag_init {
+    # $1: dir for per-step logs (<step>.log)
+    DAG_LOG_DIR=$1
+    DAG_STEPS=""
+    declare -gA DAG_DEPS DAG_CMD DAG_TTY DAG_STATE DAG_PID DAG_START DAG_END
+    DAG_DEPS=(); DAG_CMD=(); DAG_TTY=(); DAG_STATE=()
+    DAG_PID=(); DAG_START=(); DAG_END=()
+    mkdir -p "$DAG_LOG_DIR"
+}
+
+function dag_step {
+    # $1: step name
+    # $2: space-separated names of steps that must succeed first
+    # $3: 'tty' if step needs the terminal (e.g. passphrase prompt) - its
+    #     output is also shown. Only one tty step runs at a time
+    # Remaining args: command (usually a function) to run
+    local name=$1
+    DAG_STEPS="$DAG_STEPS $name"
+    DAG_DEPS[$name]=$2
+    DAG_TTY[$name]=$3
+    shift 3
+    DAG_CMD[$name]=$(printf '%q ' "$@")
+    DAG_STATE[$name]=pending
+}
+
+function dag_start_step {
+    # $1: step name - runs step in background, output to its log
+    # Step writes its end time to <step>.end - dag_run polls
+    local name=$1
+    local log="$DAG_LOG_DIR/${name}.log"
+    local end_file="$DAG_LOG_DIR/${name}.end"
+    rm -f "$end_file"
+    DAG_START[$name]=$(date +%s)
+    DAG_STATE[$name]=running
+    echo "Step started  : $name"
+    if [ "${DAG_TTY[$name]}" = "tty" ]; then
+        # Asynchronous commands get /dev/null as stdin unless redirected
+        (
+            eval "${DAG_CMD[$name]}" 2>&1 | tee "$log"
+            ret=${PIPESTATUS[0]}
+            date +%s > "$end_file"
+            exit $ret
+        ) 0<&0 &
+    else
+        (
+            ( eval "${DAG_CMD[$name]}" ) 0</dev/null 1>"$log" 2>&1
+            ret=$?
+            date +%s > "$end_file"
+            exit $ret
+        ) &
+    fi
+    DAG_PID[$name]=$!
+}
+
+function dag_kill {
+    # Kills all running steps
+    local name
+    for name in $DAG_STEPS
+    do
+        if [ "${DAG_STATE[$name]}" = "running" ]; then
+            kill_process_tree ${DAG_PID[$name]}
+        fi
+    done
+}
+
+function dag_run {
+    # Runs steps declared with dag_step - each step starts as soon as all
+    # steps it depends on have succeeded. Steps that depend (directly or
+    # indirectly) on a failed step are skipped - other steps still run
+    # Returns: 0 if all steps succeeded, 1 otherwise
+    local name dep ret state startable
+    local running=0
+    local tty_busy=no
+    DAG_T0=$(date +%s)
+    trap "dag_kill; exit 1" INT TERM
+    while :
+    do
+        # Reap finished steps
+        for name in $DAG_STEPS
+        do
+            if [ "${DAG_STATE[$name]}" != "running" ]; then
+                continue
+            fi
+            if kill -0 ${DAG_PID[$name]} 2>/dev/null; then
+                continue
+            fi
+            wait ${DAG_PID[$name]}
+            ret=$?
+            DAG_END[$name]=$(cat "$DAG_LOG_DIR/${name}.end" 2>/dev/null || date +%s)
+            running=$((running - 1))
+            if [ "${DAG_TTY[$name]}" = "tty" ]; then
+                tty_busy=no
+            fi
+            local elapsed=$(date -u -d @$((DAG_END[$name] - DAG_START[$name])) +%T)
+            if [ $ret -eq 0 ]; then
+                DAG_STATE[$name]=ok
+                echo "Step finished : $name ($elapsed)"
+            else
+                DAG_STATE[$name]=failed
+                echo "Step FAILED   : $name ($elapsed) - return code $ret"
+                tail -20 "$DAG_LOG_DIR/${name}.log" | sed -e "s/^/${INDENT}/"
+                echo "${INDENT}See $DAG_LOG_DIR/${name}.log"
+            fi
+        done
+        # Start (or skip) pending steps
+        startable=0
+        for name in $DAG_STEPS
+        do
+            if [ "${DAG_STATE[$name]}" != "pending" ]; then
+                continue
+            fi
+            state=ready
+            for dep in ${DAG_DEPS[$name]}
+            do
+                case "${DAG_STATE[$dep]}" in
+                    ok)
+                        ;;
+                    failed|skipped)
+                        state=skip
+                        ;;
+                    "")
+                        echo "Step $name: unknown step $dep"
+                        state=skip
+                        ;;
+                    *)
+                        if [ $state = ready ]; then
+                            state=wait
+                        fi
+                        ;;
+                esac
+            done
+            if [ $state = skip ]; then
+                DAG_STATE[$name]=skipped
+                echo "Step skipped  : $name"
+            elif [ $state = ready ]; then
+                if [ "${DAG_TTY[$name]}" = "tty" ]; then
+                    if [ $tty_busy = yes ]; then
+                        continue
+                    fi
+                    tty_busy=yes
+                fi
+                dag_start_step $name
+                running=$((running + 1))
+                startable=$((startable + 1))
+            fi
+        done
+        if [ $running -eq 0 -a $startable -eq 0 ]; then
+            break
+        fi
+        sleep 1
+    done
+    trap - INT TERM
+    # Steps still pending have circular dependencies
+    ret=0
+    for name in $DAG_STEPS
+    do
+        case "${DAG_STATE[$name]}" in
+            ok)
+                ;;
+            pending)
+                echo "Step $name not run - circular dependency"
+                DAG_STATE[$name]=skipped
+                ret=1
+                ;;
+            *)
+                ret=1
+                ;;
+        esac
+    done
+    return $ret
+}
+
+function dag_critical_path {
+    # Echoes names of steps on critical path (last step first) - starting
+    # from step that finished last, follows the dependency that finished
+    # last (and so allowed the step to start)
+    local name dep
+    local cur=""
+    local latest=-1
+    for name in $DAG_STEPS
+    do
+        if [ -n "${DAG_END[$name]}" ] && [ ${DAG_END[$name]} -gt $latest ]; then
+            latest=${DAG_END[$name]}
+            cur=$name
+        fi
+    done
+    while [ -n "$cur" ]
+    do
+        echo "$cur"
+        local next=""
+        latest=-1
+        for dep in ${DAG_DEPS[$cur]}
+        do
+            if [ -n "${DAG_END[$dep]}" ] && [ ${DAG_END[$dep]} -gt $latest ]; then
+                latest=${DAG_END[$dep]}
+                next=$dep
+            fi
+        done
+        cur=$next
+    done
+}
+
+function dag_report {
+    # Shows status, start offset and duration of each step, marking
+    # steps on the critical path with '*'. Also appended to
+    # START_END_TIME_FILEPATH
+    local critical=" $(echo $(dag_critical_path)) "
+    local name start duration mark
+    local total=$(($(date +%s) - DAG_T0))
+    local busy=0
+    {
+        echo "-------------------------- Build steps ---------------------------------------"
+        printf "%-16s %-8s %-10s %-10s %s\n" "Step" "Status" "Start" "Duration" "Critical"
+        for name in $DAG_STEPS
+        do
+            start="-"
+            duration="-"
+            mark=""
+            if [ -n "${DAG_START[$name]}" ]; then
+                start=$(date -u -d @$((DAG_START[$name] - DAG_T0)) +%T)
+            fi
+            if [ -n "${DAG_END[$name]}" ]; then
+                duration=$((DAG_END[$name] - DAG_START[$name]))
+                busy=$((busy + duration))
+                duration=$(date -u -d @$duration +%T)
+            fi
+            if [ "${critical/ $name /}" != "$critical" ]; then
+                mark="*"
+            fi
+            printf "%-16s %-8s %-10s %-10s %s\n" "$name" "${DAG_STATE[$name]}" "$start" "$duration" "$mark"
+        done
+        echo ""
+        printf "%-39s: %s\n" "Critical path" "$(dag_critical_path | tac | paste -sd ' ')"
+        printf "%-39s: %s\n" "Elapsed" "$(date -u -d @$total +%T)"
+        printf "%-39s: %s\n" "Sum of step durations" "$(date -u -d @$busy +%T)"
+        echo "------------------------------------------------------------------------------"
+    } | tee -a "${START_END_TIME_FILEPATH:-/dev/null}"
+}
+
+function set_kern_ver_from_source {
+    # Sets KERN_VER from BUILD_DIR if not already set
+    if [ -z "$KERN_VER" ]; then
+        KERN_VER=$(kernel_version $BUILD_DIR) || return 1
+    fi
+}
+
+function build_metapackages_step {
+    # build_metapackages for DAG pipeline - runs after get_kernel_source
+    # if kernel version was not known earlier
+    set_kern_ver_from_source || return 1
+    build_metapackages
+}
+
+function do_local_upload_step {
+    # do_local_upload for DAG pipeline
+    set_kern_ver_from_source || return 1
+    do_local_upload
+}
+
+function build_pipeline_dag {
+    # $1: required disk space in bytes
+    # Runs patch_and_build_kernel.sh steps with DAG step scheduler -
+    # independent steps run concurrently, e.g.:
+    #   - metapackages build while kernel source is retrieved
+    #   - ZFS clone and autogen.sh run while kernel compiles
+    # Per-step output is in DEBUG_DIR/steps/<step>.log
+    # ZFS build output goes to DEBUG_DIR/zfs_build.out, since ZFS steps
+    # run while build_kernel writes COMPILE_OUT_FILEPATH
+    # Returns: 0 if all steps succeeded
+    local ZFS_OUT_FILEPATH="${DEBUG_DIR}/zfs_build.out"
+    local meta_deps="source"
+    if can_build_metapackage_first; then
+        meta_deps=""
+    fi
+    dag_init "${DEBUG_DIR}/steps"
+    #        step          dependencies                  tty command
+    dag_step disk_space   ""                             ""  check_avail_disk_space $1 $KB_TOP_DIR
+    dag_step reqd_pkgs    ""                             ""  $CHECK_REQD_PKGS_SCRIPT
+    dag_step source       ""                             ""  get_kernel_source
+    dag_step metapackages "$meta_deps"                   tty build_metapackages_step
+    dag_step patches      "source"                       ""  apply_patches
+    dag_step config       "patches"                      ""  restore_kernel_config
+    dag_step kernel       "config disk_space reqd_pkgs"  ""  build_kernel
+    dag_step zfs_fetch    "disk_space reqd_pkgs"         ""  build_zfs_fetch "$KERNEL_BUILD_DIR"
+    dag_step zfs_compile  "zfs_fetch kernel"             ""  build_zfs_compile "$KERNEL_BUILD_DIR" "$BUILD_DIR"
+    dag_step upload       "kernel zfs_compile metapackages" "" do_local_upload_step
+    dag_run
+    local ret=$?
+    dag_report
+    return $ret
+}
+
 function do_local_upload() {
     # Uses:
     #   KERNEL__DO_LOCAL_UPLOAD
@@ -1716,4 +3365,9 @@ fi
 set_vars
 show_vars
 echo ""
-$CHECK_REQD_PKGS_SCRIPT || exit 1
+# With KERNEL_BUILD_PIPELINE=overlap or dag, patch_and_build_kernel.sh
+# runs the check while the kernel source downloads
+# (get_kernel_source_overlapped, build_pipeline_dag)
+if [ "$KERNEL_BUILD_PIPELINE" != "overlap" -a "$KERNEL_BUILD_PIPELINE" != "dag" -o "$KB_DEFER_REQD_PKGS_CHECK" != "yes" ]; then
+    $CHECK_REQD_PKGS_SCRIPT || exit 1
+fi
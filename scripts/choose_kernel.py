@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 import os
 import re
-from kernel_url import get_kernel_urls, filter_kernel_urls
+import time
+import json
+from kernel_url import get_kernel_urls, filter_kernel_urls, KernelCatalog
+from kernel_url import MirrorRanker, VersionIndex, normalize_kver
+from tarball_cache import TarballCache
+from pyutils import write_file_atomic
 
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -35,11 +40,14 @@ def get_config_version(verbose=False):
     if kver:
         if verbose:
             print('Available config is from kernel %s' % (kver,))
+    return kver
 
 
-def get_chosen_kernel_url(verbose=False):
+def get_chosen_kernel_url(verbose=False, catalog=None):
     '''
     verbose-->boolean: If True, user-centric output is printed to stdout
+    catalog-->kernel_url.KernelCatalog or None
+        If None, built from get_kernel_urls()
     Returns-->kernel_url.KernelURL namedtuple or None
     '''
     global script_dir, config_file, override_config_file
@@ -54,13 +62,9 @@ def get_chosen_kernel_url(verbose=False):
                     override_config_file,))
 
     override_ktype = os.environ.get('KERNEL_TYPE', None)
-    override_kver = os.environ.get('KERNEL_VERSION', None)
     # If KERNEL_VERSION has 3 components AND LAST component
     # ends in '.0', strip trailing '.0'
-    if override_kver:
-        override_kver_comps = override_kver.split('.', 2)
-        if len(override_kver_comps) > 2 and override_kver_comps[2] == '0':
-            override_kver = '.'.join(override_kver_comps[:2])
+    override_kver = normalize_kver(os.environ.get('KERNEL_VERSION', None))
 
     if (override_ktype or override_kver):
         if override_ktype is not None and override_ktype not in [
@@ -78,7 +82,9 @@ def get_chosen_kernel_url(verbose=False):
                 ))
             override_ktype = None
 
-    l = get_kernel_urls()
+    l = catalog
+    if l is None:
+        l = KernelCatalog(get_kernel_urls())
     if verbose:
         fmt = '    %-16s %-10s %-10s'
         print('Available kernels:')
@@ -149,3 +155,115 @@ def get_chosen_kernel_url(verbose=False):
                 kver, ktype
             ))
     return kurl
+
+
+def chosen_kernel_version(kurl, catalog=None):
+    '''
+    kurl-->kernel_url.KernelURL namedtuple
+    catalog-->kernel_url.KernelCatalog or None: If set, uses version
+        already parsed by catalog
+    Returns-->str: kernel version as used for kernel and metapackages
+    .0 versions show up on kernel.org JSON API without .0 subversion
+    This breaks matapackage --> kernel package dependency - since
+    we create metapackages BEFORE downloading kernel
+    '''
+    kver = kurl.kver
+    if catalog is not None:
+        vt = catalog.version_tuple(kurl)
+        if vt is not None and vt[3]:
+            return '%d.%d.%d' % vt[:3]
+    if len(kver.split('.')) < 3:
+        kver += '.0'
+    return kver
+
+
+def expected_sha256(kurl):
+    '''
+    kurl-->kernel_url.KernelURL namedtuple
+    Returns-->str (hex digest) or None: sha256 of download_url from
+        kernel.org sha256sums.asc (see kernel_url.VersionIndex)
+    '''
+    try:
+        v = VersionIndex(show_exception=False).lookup(kurl.kver)
+    except:
+        return None
+    if not v or not v.get('sha256', None):
+        return None
+    # Index has sha256 only for .tar.xz
+    if os.path.basename(v['tarball']) != os.path.basename(kurl.download_url):
+        return None
+    return v['sha256']
+
+
+def resolve(manifest):
+    '''
+    manifest-->str: path of JSON build manifest to (over)write
+    Returns-->dict: contents of manifest or None if no kernel was chosen
+
+    Fetches releases.json and reads config ONCE and records everything
+    later build steps need, so that they do not have to resolve again
+    '''
+    l = KernelCatalog(get_kernel_urls())
+    kurl = get_chosen_kernel_url(verbose=False, catalog=l)
+    if not kurl:
+        return None
+    d = kurl._asdict()
+    d['kern_ver'] = chosen_kernel_version(kurl, catalog=l)
+    d['config_file'] = os.path.realpath(config_file)
+    d['config_version'] = get_config_version(verbose=False)
+    # download_url is on fastest reachable mirror, origin_url as chosen
+    # If tarball is already cached, no need to probe mirrors
+    d['origin_url'] = kurl.download_url
+    try:
+        cached = TarballCache().lookup(kurl.download_url)
+    except:
+        cached = None
+    if cached:
+        (d['download_url'], ranked) = (kurl.download_url, [])
+    else:
+        (d['download_url'], ranked) = MirrorRanker(
+            show_exception=False).fastest_url(kurl.download_url)
+    d['mirror'] = '/'.join(d['download_url'].split('/')[:3])
+    d['sha256'] = expected_sha256(kurl)
+    d['mirror_rankings'] = [x._asdict() for x in ranked]
+    d['kernels'] = [u._asdict() for u in l]
+    d['resolved'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    write_file_atomic(manifest, json.dumps(d, indent=4) + '\n')
+    return d
+
+
+def read_manifest(manifest):
+    '''
+    manifest-->str: path of JSON build manifest written by resolve()
+    Returns-->dict
+    '''
+    with open(manifest, 'r') as f:
+        return json.load(f)
+
+
+def show_manifest(d):
+    '''
+    d-->dict: as returned by resolve() or read_manifest()
+    Prints available kernels and chosen kernel - same as
+    get_chosen_kernel_url(verbose=True), without resolving again
+    '''
+    if d.get('config_version', None):
+        print('Available config is from kernel %s' % (d['config_version'],))
+    fmt = '    %-16s %-10s %-10s'
+    print('Available kernels:')
+    print(fmt % ('Type', 'Version', 'Rel. Date'))
+    for u in d.get('kernels', []):
+        print(fmt % (
+            u['ktype'], u['kver'],
+            u['release_date'] or ''
+        ))
+    if d.get('mirror_rankings', None):
+        fmt = '    %-52s %8s %12s'
+        print('Mirrors:')
+        print(fmt % ('Mirror', 'TTFB', 'Est. time'))
+        for x in d['mirror_rankings']:
+            print(fmt % (
+                x['base'], '%.3fs' % (x['ttfb'],), '%.1fs' % (x['est_time'],)
+            ))
+    print('Chosen kernel: %s (%s) from %s' % (
+        d['kver'], d['ktype'], d['mirror']))
@@ -9,6 +9,7 @@ import time
 from collections import namedtuple
 import subprocess
 from textwrap import wrap
+from oldconfig_prompts import answer_prompts
 from pyutils import (
     DEFAULT_ENCODING,
     format_exc,
@@ -1124,54 +1125,43 @@ class OldConfig(object):
         pat_new = '\(NEW\)'
         pat = '^%s %s %s %s' % (pat_desc, pat_key, pat_opts, pat_new)
 
-        question_patterns = [
-            pexpect.EOF,
-            pexpect.TIMEOUT,
-            pat,
-            '^\s*choice.*$',
-        ]
-
         non_def_ans_dict = OrderedDict()
 
+        def answer(m):
+            '''
+            m-->match of pat
+            Returns-->(key, ans)
+            '''
+            gd = m.groupdict()
+            opts = gd['OPTS']
+
+            # Default option (only) will be in UPPER CASE
+            def_ans = [x for x in opts if x in 'YNM']
+            if def_ans:
+                def_ans = def_ans[0]
+            else:
+                def_ans = None
+            if 'm' in opts.lower():
+                ans = [x for x in opts if x in 'mM'][0]
+            else:     # Press RETURN, accept default
+                ans = ''
+
+            if ans != '':
+                debug_choice = '%s=%s' % (gd[GD_KEY], ans)
+                debug('    %-54s  default(%s)  opts(%s)' % (
+                    debug_choice, str(def_ans), str(opts),
+                ))
+                non_def_ans_dict[gd[GD_KEY]] = ans.lower()
+            return (gd[GD_KEY], ans)
+
         debug('')
         debug('Starting answer_questions')
-        while not c.eof():
-            ind = c.expect(question_patterns, timeout=ANSWER_QUESTIONS_TIMEOUT)
-            if ind == 0:      # EOF
-                break
-            elif ind == 1:      # TIMEOUT
-                c.sendline('')
-                continue
-            elif ind == 2:        # options to choose
-                ans = ''
-                if c.match:
-                    gd = c.match.groupdict()
-                    opts = gd['OPTS']
-
-                    # Default option (only) will be in UPPER CASE
-                    def_ans = [x for x in opts if x in 'YNM']
-                    if def_ans:
-                        def_ans = def_ans[0]
-                    else:
-                        def_ans = None
-                    if 'm' in opts.lower():
-                        ans = [x for x in opts if x in 'mM'][0]
-                    else:     # Press RETURN, accept default
-                        ans = ''
-
-                    # desc = gd['DESC'].splitlines()[-1].strip('\r\n')
-                    if ans != '':
-                        debug_choice = '%s=%s' % (gd[GD_KEY], ans)
-                        debug('    %-54s  default(%s)  opts(%s)' % (
-                            debug_choice, str(def_ans), str(opts),
-                        ))
-                        non_def_ans_dict[gd[GD_KEY]] = ans.lower()
-                    c.sendline(ans)
-                else:
-                    debug('Unexpected error: index == 1, but c.match is None')
-            elif ind == 3:          # choice
-                # debug('--- CHOICE --- %s\n' % (c.after.splitlines()[-1],))
-                c.sendline('')
+        # Answers as soon as a question is asked - see oldconfig_prompts.py
+        answer_prompts(
+            c, pat, answer,
+            max_timeout=ANSWER_QUESTIONS_TIMEOUT,
+            debug=debug,
+        )
 
         debug('Completed answer_questions (%.1f seconds)' % (
             time.time() - start_time
@@ -0,0 +1,1637 @@
+#!/usr/bin/env python3
+'''
+Usage: kconfig_engine.py <kernel_source_dir> <.config>
+    Prints the questions 'make oldconfig' would ask (accepting defaults)
+    and the symbols whose value in .config would change
+
+Kconfig parser and evaluator - computes in-process what 'make oldconfig'
+does with a .config. Follows scripts/kconfig in the kernel tree
+(parser.y, menu.c, symbol.c, expr.c, preprocess.c, confdata.c):
+
+    Parsing:
+        config, menuconfig, choice / endchoice, menu / endmenu,
+        if / endif, comment, mainmenu, source, rsource, osource, orsource
+        bool, tristate, string, int, hex, def_bool, def_tristate,
+        prompt, default, depends on, select, imply, range, visible if,
+        optional, modules, option (env, modules), help
+        Macros: VAR = / := / += , $(VAR), $(fn,args), $(1) ...,
+        $(shell,...), $(info,...), $(warning-if,...), $(error-if,...),
+        $(filename), $(lineno) - and $VAR in source (kernels < 4.18)
+
+    Dependencies of enclosing menu / if / choice blocks are added to each
+    entry ('m' in dependencies means 'm && MODULES'). 'visible if' of
+    enclosing menus is added to prompts only. select and imply become
+    reverse dependencies of the target symbol.
+
+    Evaluation (tristate: n=0, m=1, y=2, && = min, || = max, ! = 2 - x):
+        visibility  : OR of prompt conditions
+        bool / tristate value:
+            user value (.config) if visible: min(user, visibility)
+            else first default whose condition is not n, OR implied
+            (limited by dependencies) - then OR selects (reverse deps)
+            m becomes y for bool (and tristate if MODULES=n)
+        string / int / hex:
+            user value if visible and valid, else first default -
+            int / hex clamped to range
+        choice: user choice if visible, else first visible default,
+            else first visible member
+
+Symbols are evaluated lazily and cached. A dependency graph (symbol -->
+symbols whose value depends on it) is used to invalidate only affected
+symbols when a value is set
+'''
+import os
+import re
+import sys
+import glob
+import subprocess
+from collections import OrderedDict
+
+
+TRI_N = 0
+TRI_M = 1
+TRI_Y = 2
+TRI_2_STR = ['n', 'm', 'y']
+STR_2_TRI = {'n': TRI_N, 'm': TRI_M, 'y': TRI_Y}
+
+BOOL_TYPES = ['bool', 'tristate']
+STR_TYPES = ['string', 'int', 'hex']
+DEF_TYPES = {'def_bool': 'bool', 'def_tristate': 'tristate'}
+SOURCE_KWS = ['source', 'rsource', 'osource', 'orsource']
+
+# Expression nodes are tuples:
+#   (E_SYM, name)           - symbol or unquoted word (e.g. 0x10)
+#   (E_CONST, str)          - quoted string
+#   (E_MOD,)                - 'm' in dependencies: m && MODULES
+#   (E_NOT, e)
+#   (E_AND, (e1, e2, ...)) / (E_OR, (e1, e2, ...))
+#   (E_CMP, op, e1, e2)     - op: = != < > <= >=
+E_SYM = 'sym'
+E_CONST = 'const'
+E_MOD = 'mod'
+E_NOT = 'not'
+E_AND = 'and'
+E_OR = 'or'
+E_CMP = 'cmp'
+CMP_OPS = ['=', '!=', '<', '>', '<=', '>=']
+
+# Kind of value returned by expr_parse_string
+K_STRING = 0
+K_SIGNED = 1
+K_UNSIGNED = 2
+
+CONFIG_PREFIX = 'CONFIG_'
+SET_LINE_PAT = re.compile('^%s(?P<k>[A-Za-z0-9_]+)=(?P<v>.*)$' % (CONFIG_PREFIX,))
+UNSET_LINE_PAT = re.compile('^# %s(?P<k>[A-Za-z0-9_]+) is not set$' % (CONFIG_PREFIX,))
+HELP_LINE_PAT = re.compile('^\s*(help|---help---)\s*$')
+ASSIGN_LINE_PAT = re.compile('^(?P<k>[A-Za-z0-9_-]+)\s*(?P<op>:=|\+=|=)\s*(?P<v>.*?)\s*$')
+OLD_VAR_PAT = re.compile('\$(?P<k>[A-Za-z0-9_]+)')
+OPTION_ENV_PAT = re.compile('^env=(?P<k>\S+)$')
+
+# Top-level Makefile: SUBARCH from 'uname -m'
+SUBARCH_MAP = [
+    ('i.86', 'x86'), ('x86_64', 'x86'), ('sun4u', 'sparc64'),
+    ('arm.*', 'arm'), ('sa110', 'arm'), ('s390x', 's390'),
+    ('parisc64', 'parisc'), ('ppc.*', 'powerpc'), ('mips.*', 'mips'),
+    ('sh[234].*', 'sh'), ('aarch64.*', 'arm64'), ('riscv.*', 'riscv'),
+    ('loongarch.*', 'loongarch'),
+]
+# Top-level Makefile: SRCARCH from ARCH
+SRCARCH_MAP = {
+    'i386': 'x86', 'x86_64': 'x86', 'sparc32': 'sparc',
+    'sparc64': 'sparc', 'parisc64': 'parisc',
+}
+
+
+class KconfigError(Exception):
+    pass
+
+
+class Symbol(object):
+    '''
+    One config symbol (or choice) - collected from all its definitions
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.type = None
+        self.is_choice = False
+        self.optional = False       # choice only
+        self.members = []           # choice only: names of choice values
+        self.choice = None          # choice value: name of choice
+        self.env = None             # option env=
+        self.prompts = []           # (text, cond)
+        self.defaults = []          # (expr, cond)
+        self.ranges = []            # (lo, hi, cond)
+        self.dir_deps = []          # dependencies of each definition
+        self.rev = []               # (selector name, cond) - select
+        self.implied = []           # (implying name, cond) - imply
+        self.locations = []         # (file, line)
+
+    def __repr__(self):
+        return 'Symbol(%s, %s)' % (self.name, self.type)
+
+
+class Entry(object):
+    '''
+    One config / menuconfig / choice / menu / comment while it is parsed
+    '''
+    def __init__(self, kind, sym, parentdep, visibility):
+        self.kind = kind
+        self.sym = sym
+        self.parentdep = parentdep
+        self.visibility = visibility    # 'visible if' of enclosing menus
+        self.prompts = []
+        self.defaults = []
+        self.selects = []
+        self.implies = []
+        self.ranges = []
+        self.deps = []
+        self.menu_vis = []
+        self.basedep = None
+
+
+def skip_macro(s, i):
+    '''
+    s-->str
+    i-->int: index of '$' of '$('
+    Returns-->int: index after matching ')'
+    '''
+    depth = 0
+    j = i + 1
+    while j < len(s):
+        if s[j] == '(':
+            depth += 1
+        elif s[j] == ')':
+            depth -= 1
+            if depth == 0:
+                return j + 1
+        j += 1
+    return len(s)
+
+
+def split_args(s):
+    '''
+    s-->str: contents of $(...)
+    Returns-->list of str: split at top-level commas
+    '''
+    ret = []
+    depth = 0
+    prev = 0
+    for (i, c) in enumerate(s):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            ret.append(s[prev:i])
+            prev = i + 1
+    ret.append(s[prev:])
+    return ret
+
+
+def tokenize(line):
+    '''
+    line-->str: one logical line (continuation lines joined)
+    Returns-->list of (kind, text): kind is 'word', 'str' or 'op'
+        Comments are dropped. $(...) is NOT expanded
+    '''
+    ret = []
+    i = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c in ' \t\r\n':
+            i += 1
+            continue
+        if c == '#':
+            break
+        if c in '"\'':
+            buf = []
+            j = i + 1
+            while j < n and line[j] != c:
+                if line[j] == '$' and line[j + 1:j + 2] == '(':
+                    k = skip_macro(line, j)
+                    buf.append(line[j:k])
+                    j = k
+                    continue
+                if line[j] == '\\' and j + 1 < n:
+                    j += 1
+                buf.append(line[j])
+                j += 1
+            ret.append(('str', ''.join(buf)))
+            i = j + 1
+            continue
+        if line[i:i + 2] in ['&&', '||', '!=', '<=', '>=']:
+            ret.append(('op', line[i:i + 2]))
+            i += 2
+            continue
+        if c in '=<>!()':
+            ret.append(('op', c))
+            i += 1
+            continue
+        j = i
+        while j < n:
+            if line[j] == '$' and line[j + 1:j + 2] == '(':
+                j = skip_macro(line, j)
+                continue
+            if line[j] in ' \t\r\n"\'#=<>!()&|':
+                break
+            j += 1
+        if j == i:
+            j = i + 1
+        ret.append(('word', line[i:j]))
+        i = j
+    return ret
+
+
+def strtoll(s, base):
+    '''
+    s-->str
+    base-->int: 10 or 16 (0 for auto like C strtoll)
+    Returns-->(val, rest):
+        val-->int: value of longest valid prefix (0 if none)
+        rest-->str or None: unparsed rest - None if no digits
+    '''
+    s = s.lstrip()
+    sign = 1
+    i = 0
+    if s[:1] in ['-', '+']:
+        sign = (s[0] == '-') and -1 or 1
+        i = 1
+    if base in [0, 16] and s[i:i + 2].lower() == '0x' and \
+            s[i + 2:i + 3] and s[i + 2] in '0123456789abcdefABCDEF':
+        i += 2
+        base = 16
+    elif base == 0:
+        base = (s[i:i + 1] == '0' and len(s) > i + 1) and 8 or 10
+    digits = '0123456789abcdef'[:base]
+    j = i
+    while j < len(s) and s[j].lower() in digits:
+        j += 1
+    if j == i:
+        return (0, None)
+    return (sign * int(s[i:j], base), s[j:])
+
+
+def parse_string(s, t):
+    '''
+    s-->str: value
+    t-->str or None: symbol type
+    Returns-->(kind, val): same as expr_parse_string in expr.c
+    '''
+    if t in BOOL_TYPES:
+        return (K_SIGNED, {'n': 0, 'm': 1, 'y': 2}.get(s, -1))
+    if t == 'int':
+        (val, rest) = strtoll(s, 10)
+        kind = K_SIGNED
+    elif t == 'hex':
+        (val, rest) = strtoll(s, 16)
+        kind = K_UNSIGNED
+    else:
+        (val, rest) = strtoll(s, 0)
+        kind = K_SIGNED
+    if rest is None or rest != '' or s[-1:].lower() not in '0123456789abcdef':
+        return (K_STRING, None)
+    return (kind, val)
+
+
+def expr_and(*l):
+    '''
+    Returns-->expression node: AND of non-None nodes in l - None if all None
+    '''
+    l = [x for x in l if x is not None]
+    if not l:
+        return None
+    if len(l) == 1:
+        return l[0]
+    return (E_AND, tuple(l))
+
+
+def expr_or(*l):
+    '''
+    Returns-->expression node: OR of non-None nodes in l - None if all None
+        Same as expr_alloc_or: OR of None and X is X
+    '''
+    l = [x for x in l if x is not None]
+    if not l:
+        return None
+    if len(l) == 1:
+        return l[0]
+    return (E_OR, tuple(l))
+
+
+def rewrite_m(e):
+    '''
+    e-->expression node or None
+    Returns-->expression node: 'm' replaced by (E_MOD,) - used for
+        dependencies (menu.c rewrite_m)
+    '''
+    if e is None:
+        return e
+    t = e[0]
+    if t == E_SYM:
+        if e[1] == 'm':
+            return (E_MOD,)
+        return e
+    if t == E_NOT:
+        return (E_NOT, rewrite_m(e[1]))
+    if t in [E_AND, E_OR]:
+        return (t, tuple([rewrite_m(x) for x in e[1]]))
+    return e
+
+
+def expr_syms(e, ret=None):
+    '''
+    e-->expression node or None
+    Returns-->set of str: names of symbols referenced in e
+    '''
+    if ret is None:
+        ret = set()
+    if e is None:
+        return ret
+    t = e[0]
+    if t == E_SYM:
+        if e[1] not in STR_2_TRI:
+            ret.add(e[1])
+    elif t == E_NOT:
+        expr_syms(e[1], ret)
+    elif t in [E_AND, E_OR]:
+        for x in e[1]:
+            expr_syms(x, ret)
+    elif t == E_CMP:
+        expr_syms(e[2], ret)
+        expr_syms(e[3], ret)
+    return ret
+
+
+class ExprParser(object):
+    '''
+    Recursive descent parser for Kconfig expressions. Precedence (lowest
+    first): ||, &&, !, comparison
+    '''
+    def __init__(self, toks):
+        '''
+        toks-->list of (kind, text) from tokenize (expanded)
+        '''
+        self.toks = toks
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.toks):
+            return self.toks[self.pos]
+        return (None, None)
+
+    def next(self):
+        ret = self.peek()
+        self.pos += 1
+        return ret
+
+    def parse(self):
+        '''
+        Returns-->expression node
+        Raises KconfigError on syntax error
+        '''
+        return self.parse_or()
+
+    def parse_or(self):
+        l = [self.parse_and()]
+        while self.peek() == ('op', '||'):
+            self.next()
+            l.append(self.parse_and())
+        return expr_or(*l)
+
+    def parse_and(self):
+        l = [self.parse_not()]
+        while self.peek() == ('op', '&&'):
+            self.next()
+            l.append(self.parse_not())
+        return expr_and(*l)
+
+    def parse_not(self):
+        if self.peek() == ('op', '!'):
+            self.next()
+            return (E_NOT, self.parse_not())
+        return self.parse_cmp()
+
+    def parse_cmp(self):
+        if self.peek() == ('op', '('):
+            self.next()
+            ret = self.parse_or()
+            if self.next() != ('op', ')'):
+                raise KconfigError('Missing )')
+            return ret
+        e1 = self.parse_symbol()
+        (kind, text) = self.peek()
+        if kind == 'op' and text in CMP_OPS:
+            self.next()
+            return (E_CMP, text, e1, self.parse_symbol())
+        return e1
+
+    def parse_symbol(self):
+        (kind, text) = self.next()
+        if kind == 'word':
+            return (E_SYM, text)
+        if kind == 'str':
+            return (E_CONST, text)
+        raise KconfigError('Expected symbol, got %s' % (str(text),))
+
+
+class KconfigEngine(object):
+    '''
+    See module docstring
+    '''
+    def __init__(self, srctree, objtree=None, env=None, kconfig='Kconfig'):
+        '''
+        srctree-->str: kernel source dir
+        objtree-->str: kernel object dir (make O=) - defaults to srctree
+            $(shell,...) runs in objtree
+        env-->dict: environment for macros and option env= - defaults to
+            environment that kernel Makefile passes to scripts/kconfig
+        kconfig-->str: top-level Kconfig file relative to srctree
+        '''
+        self.srctree = os.path.realpath(srctree)
+        self.objtree = objtree or self.srctree
+        self.env = env
+        if self.env is None:
+            self.env = self.make_env()
+        self.syms = OrderedDict()
+        # Names of config / menuconfig / choice entries in menu order
+        self.entries = []
+        self.entry_set = set()
+        self.modules_name = None
+        self.variables = {}
+        self.shell_cache = {}
+        self.warnings = []
+        self.files = []
+        self.cur_file = None
+        self.cur_line = 0
+        self.choice_count = 0
+
+        # Lazily computed - see invalidate
+        self.values = {}
+        self.vis = {}
+        self.selection = {}
+        self.in_progress = set()
+
+        # User values - tri for bool / tristate, str for others
+        self.user = {}
+        # choice name --> name of choice value set to y in user values
+        self.choice_user = {}
+
+        if sys.getrecursionlimit() < 20000:
+            sys.setrecursionlimit(20000)
+        self.parse(kconfig)
+        self.dependents = self.__dependency_graph()
+
+    # ---------- Environment and macros ----------------------------------
+
+    def make_env(self):
+        '''
+        Returns-->dict: os.environ with variables that kernel Makefile
+            exports for scripts/kconfig
+        '''
+        env = dict(os.environ)
+        subarch = os.uname().machine
+        for (pat, arch) in SUBARCH_MAP:
+            if re.match('^%s$' % (pat,), subarch):
+                subarch = arch
+                break
+        arch = env.get('ARCH', None) or subarch
+        env['ARCH'] = arch
+        env['SUBARCH'] = subarch
+        env['SRCARCH'] = SRCARCH_MAP.get(arch, arch)
+        env['srctree'] = self.srctree
+        env['objtree'] = self.objtree
+        cross = env.get('CROSS_COMPILE', '')
+        for (k, v) in [
+            ('CC', cross + 'gcc'), ('LD', cross + 'ld'),
+            ('HOSTCC', 'gcc'), ('HOSTCXX', 'g++'),
+        ]:
+            env[k] = v
+        if 'CC_VERSION_TEXT' not in env:
+            try:
+                out = subprocess.check_output(
+                    env['CC'] + ' --version', shell=True,
+                    stderr=subprocess.DEVNULL,
+                ).decode('utf-8', 'replace')
+                env['CC_VERSION_TEXT'] = out.splitlines()[0]
+            except:
+                env['CC_VERSION_TEXT'] = ''
+        try:
+            from kconfig_index import kernel_version
+            env['KERNELVERSION'] = kernel_version(self.srctree)
+        except:
+            pass
+        return env
+
+    def expand(self, s, args=None):
+        '''
+        s-->str
+        args-->list of str or None: arguments of user-defined function
+        Returns-->str: s with $(...) expanded
+        '''
+        if '$(' not in s:
+            return s
+        out = []
+        i = 0
+        while True:
+            j = s.find('$(', i)
+            if j < 0:
+                out.append(s[i:])
+                break
+            out.append(s[i:j])
+            k = skip_macro(s, j)
+            out.append(self.__call(s[j + 2:k - 1], args))
+            i = k
+        return ''.join(out)
+
+    def __call(self, inner, args):
+        '''
+        inner-->str: contents of $(...)
+        args-->list of str or None
+        Returns-->str
+        '''
+        parts = [self.expand(x, args) for x in split_args(inner)]
+        (name, fargs) = (parts[0], parts[1:])
+        if args is not None and name.isdigit() and not fargs:
+            i = int(name)
+            if 0 < i <= len(args):
+                return args[i - 1]
+            return ''
+        if name == 'shell':
+            return self.__shell(','.join(fargs))
+        if name == 'info':
+            return ''
+        if name in ['warning-if', 'error-if']:
+            if fargs and fargs[0] == 'y':
+                self.warn('%s: %s' % (name, ','.join(fargs[1:])))
+            return ''
+        if name == 'filename':
+            return self.cur_file or ''
+        if name == 'lineno':
+            return str(self.cur_line)
+        if name in self.variables:
+            (flavor, value) = self.variables[name]
+            if flavor == 'simple' and not fargs:
+                return value
+            return self.expand(value, fargs)
+        if not fargs:
+            return self.env.get(name, '')
+        return ''
+
+    def __shell(self, cmd):
+        '''
+        cmd-->str
+        Returns-->str: output of cmd, newlines replaced with spaces
+        '''
+        if cmd in self.shell_cache:
+            return self.shell_cache[cmd]
+        try:
+            out = subprocess.run(
+                cmd, shell=True, cwd=self.objtree, env=self.env,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            ).stdout.decode('utf-8', 'replace')
+        except:
+            out = ''
+        ret = out.rstrip('\n').replace('\n', ' ')
+        self.shell_cache[cmd] = ret
+        return ret
+
+    def __assign(self, k, op, v):
+        if op == ':=':
+            self.variables[k] = ('simple', self.expand(v))
+        elif op == '=':
+            self.variables[k] = ('recursive', v)
+        else:
+            (flavor, old) = self.variables.get(k, ('recursive', ''))
+            if flavor == 'simple':
+                v = self.expand(v)
+            self.variables[k] = (flavor, (old and (old + ' ') or '') + v)
+
+    def warn(self, s):
+        self.warnings.append('%s:%d: %s' % (self.cur_file, self.cur_line, s))
+
+    # ---------- Parsing --------------------------------------------------
+
+    def sym(self, name):
+        '''
+        name-->str
+        Returns-->Symbol: created if required
+        '''
+        ret = self.syms.get(name, None)
+        if ret is None:
+            ret = Symbol(name)
+            self.syms[name] = ret
+        return ret
+
+    def parse(self, kconfig):
+        '''
+        kconfig-->str: top-level Kconfig relative to srctree
+        '''
+        # Stack of (kind, dep, entry) - dep applies to entries inside
+        self.stack = [('top', None, None)]
+        self.cur = None
+        self.__parse_file(os.path.join(self.srctree, kconfig))
+        self.__finish()
+        for (kind, dep, entry) in self.stack[1:]:
+            self.warn('Unterminated %s' % (kind,))
+        if self.modules_name is None and 'MODULES' in self.syms:
+            self.modules_name = 'MODULES'
+
+    def __parse_file(self, path):
+        '''
+        path-->str: absolute path of Kconfig file
+        '''
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.read().splitlines()
+        except Exception as e:
+            self.warn('Cannot read %s: %s' % (path, str(e)))
+            return
+        self.files.append(path)
+        (saved_file, saved_line) = (self.cur_file, self.cur_line)
+        self.cur_file = os.path.relpath(path, self.srctree)
+
+        i = 0
+        while i < len(lines):
+            raw = lines[i]
+            self.cur_line = i + 1
+            i += 1
+            while raw.endswith('\\') and i < len(lines):
+                raw = raw[:-1] + lines[i]
+                i += 1
+            if not raw.strip() or raw.lstrip().startswith('#'):
+                continue
+            if re.match(HELP_LINE_PAT, raw):
+                i = self.__skip_help(lines, i)
+                continue
+            m = re.match(ASSIGN_LINE_PAT, raw.strip())
+            if m:
+                self.__assign(m.group('k'), m.group('op'), m.group('v'))
+                continue
+            toks = []
+            for (kind, text) in tokenize(raw):
+                if kind != 'op':
+                    text = self.expand(text)
+                    if kind == 'word' and not text:
+                        continue
+                toks.append((kind, text))
+            if not toks:
+                continue
+            try:
+                self.__statement(toks, path)
+            except KconfigError as e:
+                self.warn(str(e))
+
+        (self.cur_file, self.cur_line) = (saved_file, saved_line)
+
+    def __skip_help(self, lines, i):
+        '''
+        lines-->list of str
+        i-->int: index of line after 'help'
+        Returns-->int: index of first line after help text
+        '''
+        indent = None
+        while i < len(lines):
+            l = lines[i].expandtabs(8)
+            if not l.strip():
+                i += 1
+                continue
+            n = len(l) - len(l.lstrip())
+            if indent is None:
+                if n == 0:
+                    break
+                indent = n
+            elif n < indent:
+                break
+            i += 1
+        return i
+
+    def __parentdep(self):
+        return self.stack[-1][1]
+
+    def __visibility(self):
+        return [e.menu_vis_expr for (k, d, e) in self.stack
+                if k == 'menu' and e.menu_vis_expr is not None]
+
+    def __expr(self, toks):
+        '''
+        toks-->list of tokens
+        Returns-->(expr, cond): expr and optional 'if' condition
+        '''
+        if_pos = None
+        depth = 0
+        for (i, t) in enumerate(toks):
+            if t == ('op', '('):
+                depth += 1
+            elif t == ('op', ')'):
+                depth -= 1
+            elif t == ('word', 'if') and depth == 0:
+                if_pos = i
+        cond = None
+        if if_pos is not None:
+            cond = ExprParser(toks[if_pos + 1:]).parse()
+            toks = toks[:if_pos]
+        expr = None
+        if toks:
+            p = ExprParser(toks)
+            expr = p.parse()
+            if p.pos != len(toks):
+                raise KconfigError('Invalid expression')
+        return (expr, cond)
+
+    def __statement(self, toks, path):
+        (kind, kw) = toks[0]
+        args = toks[1:]
+        if kind != 'word':
+            raise KconfigError('Unexpected %s' % (kw,))
+
+        if kw in ['config', 'menuconfig']:
+            self.__finish()
+            s = self.sym(args[0][1])
+            s.locations.append((self.cur_file, self.cur_line))
+            self.cur = Entry('config', s, self.__parentdep(), self.__visibility())
+            if s.name not in self.entry_set:
+                self.entry_set.add(s.name)
+                self.entries.append(s.name)
+            cs = self.__enclosing_choice()
+            if cs is not None:
+                s.choice = cs.name
+                if s.name not in cs.members:
+                    cs.members.append(s.name)
+            return
+        if kw == 'choice':
+            self.__finish()
+            if args:
+                name = args[0][1]
+            else:
+                self.choice_count += 1
+                name = '<choice %d>' % (self.choice_count,)
+            s = self.sym(name)
+            s.is_choice = True
+            s.locations.append((self.cur_file, self.cur_line))
+            self.cur = Entry('choice', s, self.__parentdep(), self.__visibility())
+            self.entry_set.add(s.name)
+            self.entries.append(s.name)
+            self.stack.append(('choice', (E_SYM, s.name), self.cur))
+            return
+        if kw == 'endchoice':
+            self.__finish()
+            self.__pop('choice')
+            return
+        if kw == 'menu':
+            self.__finish()
+            self.cur = Entry('menu', None, self.__parentdep(), self.__visibility())
+            self.cur.menu_vis_expr = None
+            self.stack.append(('menu', None, self.cur))
+            return
+        if kw == 'endmenu':
+            self.__finish()
+            self.__pop('menu')
+            return
+        if kw == 'if':
+            self.__finish()
+            (e, _) = self.__expr(args)
+            self.stack.append(('if', expr_and(self.__parentdep(), rewrite_m(e)), None))
+            return
+        if kw == 'endif':
+            self.__finish()
+            self.__pop('if')
+            return
+        if kw == 'comment':
+            self.__finish()
+            self.cur = Entry('comment', None, self.__parentdep(), self.__visibility())
+            return
+        if kw == 'mainmenu':
+            return
+        if kw in SOURCE_KWS:
+            self.__finish()
+            self.__source(kw, args, path)
+            return
+
+        # Attributes of current entry
+        e = self.cur
+        if e is None:
+            raise KconfigError('%s outside of an entry' % (kw,))
+        s = e.sym
+        if kw in BOOL_TYPES + STR_TYPES or kw in DEF_TYPES:
+            t = DEF_TYPES.get(kw, kw)
+            if s is not None:
+                if s.type and s.type != t:
+                    self.warn('%s: type changed from %s to %s' % (s.name, s.type, t))
+                s.type = t
+            if kw in DEF_TYPES:
+                e.defaults.append(self.__expr(args))
+            elif args:
+                self.__prompt(e, args)
+        elif kw == 'prompt':
+            self.__prompt(e, args)
+        elif kw == 'default':
+            e.defaults.append(self.__expr(args))
+        elif kw == 'depends':
+            if args and args[0] == ('word', 'on'):
+                args = args[1:]
+            (dep, _) = self.__expr(args)
+            e.deps.append(dep)
+        elif kw == 'select':
+            e.selects.append((args[0][1], self.__expr(args[1:])[1]))
+        elif kw == 'imply':
+            e.implies.append((args[0][1], self.__expr(args[1:])[1]))
+        elif kw == 'range':
+            (_, cond) = self.__expr(args[2:])
+            e.ranges.append(((E_SYM, args[0][1]), (E_SYM, args[1][1]), cond))
+        elif kw == 'visible':
+            if args and args[0] == ('word', 'if'):
+                args = args[1:]
+            (vis, _) = self.__expr(args)
+            e.menu_vis.append(vis)
+        elif kw == 'optional':
+            if s is not None:
+                s.optional = True
+        elif kw == 'modules':
+            if s is not None:
+                self.modules_name = s.name
+        elif kw == 'option':
+            opt = ''.join([x[1] for x in args])
+            m = re.match(OPTION_ENV_PAT, opt)
+            if m and s is not None:
+                s.env = m.group('k')
+            elif opt == 'modules' and s is not None:
+                self.modules_name = s.name
+        elif kw in ['transitional']:
+            pass
+        else:
+            raise KconfigError('Unknown keyword: %s' % (kw,))
+
+    def __prompt(self, e, args):
+        (_, cond) = self.__expr(args[1:])
+        e.prompts.append((args[0][1], cond))
+
+    def __enclosing_choice(self):
+        '''
+        Returns-->Symbol or None: choice of innermost choice block - if
+            blocks inside a choice do not end it
+        '''
+        for (k, d, e) in reversed(self.stack):
+            if k == 'choice':
+                return e.sym
+            if k != 'if':
+                return None
+        return None
+
+    def __pop(self, kind):
+        if self.stack[-1][0] != kind:
+            raise KconfigError('end%s without %s' % (kind, kind))
+        self.stack.pop()
+
+    def __source(self, kw, args, path):
+        if not args:
+            raise KconfigError('%s without file' % (kw,))
+        f = args[0][1]
+        # kernels < 4.18: source "arch/$SRCARCH/Kconfig"
+        f = re.sub(OLD_VAR_PAT, lambda m: self.__old_var(m.group('k')), f)
+        if kw.startswith('r') or kw.startswith('or'):
+            f = os.path.join(os.path.dirname(path), f)
+        else:
+            f = os.path.join(self.srctree, f)
+        files = sorted(glob.glob(f))
+        if not files and not kw.startswith('o'):
+            self.warn('%s not found' % (f,))
+        for x in files:
+            self.__parse_file(x)
+
+    def __old_var(self, k):
+        s = self.syms.get(k, None)
+        if s is not None and s.env:
+            return self.env.get(s.env, '')
+        return self.env.get(k, '')
+
+    def __finish(self):
+        '''
+        Completes current entry - dependencies are known only at the end
+        '''
+        e = self.cur
+        self.cur = None
+        if e is None:
+            return
+        basedep = expr_and(e.parentdep, *[rewrite_m(x) for x in e.deps])
+        e.basedep = basedep
+        if e.kind == 'menu':
+            e.menu_vis_expr = expr_and(*[rewrite_m(x) for x in e.menu_vis])
+            # Replace placeholder pushed by 'menu'
+            for (i, (k, d, x)) in enumerate(self.stack):
+                if x is e:
+                    self.stack[i] = (k, basedep, e)
+            return
+        if e.kind == 'comment':
+            return
+        s = e.sym
+        for (text, cond) in e.prompts:
+            s.prompts.append((text, expr_and(basedep, rewrite_m(cond), *e.visibility)))
+        for (expr, cond) in e.defaults:
+            s.defaults.append((expr, expr_and(basedep, rewrite_m(cond))))
+        for (target, cond) in e.selects:
+            self.sym(target).rev.append((s.name, expr_and(basedep, rewrite_m(cond))))
+        for (target, cond) in e.implies:
+            self.sym(target).implied.append((s.name, expr_and(basedep, rewrite_m(cond))))
+        for (lo, hi, cond) in e.ranges:
+            s.ranges.append((lo, hi, expr_and(basedep, rewrite_m(cond))))
+        s.dir_deps.append(basedep)
+        self.__finish_choices()
+
+    def __finish_choices(self):
+        '''
+        Choice without a type gets the type of its first typed member -
+        members without a type get the type of the choice
+        '''
+        for (k, d, e) in self.stack:
+            if k != 'choice':
+                continue
+            cs = e.sym
+            if cs.type is None:
+                for m in cs.members:
+                    if self.syms[m].type:
+                        cs.type = self.syms[m].type
+                        break
+            if cs.type:
+                for m in cs.members:
+                    if self.syms[m].type is None:
+                        self.syms[m].type = cs.type
+
+    def __dependency_graph(self):
+        '''
+        Returns-->dict: name --> set of names of symbols whose value or
+            visibility depends on it
+        '''
+        ret = {}
+
+        def add(src_names, dst):
+            for x in src_names:
+                ret.setdefault(x, set()).add(dst)
+
+        modules = self.modules_name
+        for s in self.syms.values():
+            refs = set()
+            for (text, cond) in s.prompts:
+                expr_syms(cond, refs)
+            for (expr, cond) in s.defaults:
+                expr_syms(expr, refs)
+                expr_syms(cond, refs)
+            for (lo, hi, cond) in s.ranges:
+                expr_syms(lo, refs)
+                expr_syms(hi, refs)
+                expr_syms(cond, refs)
+            for d in s.dir_deps:
+                expr_syms(d, refs)
+            for (name, cond) in s.rev + s.implied:
+                refs.add(name)
+                expr_syms(cond, refs)
+            if s.choice:
+                refs.add(s.choice)
+            if s.is_choice:
+                refs.update(s.members)
+            if modules and s.type == 'tristate':
+                refs.add(modules)
+            if modules:
+                # (E_MOD,) nodes
+                refs.add(modules)
+            refs.discard(s.name)
+            add(refs, s.name)
+        return ret
+
+    # ---------- User values ----------------------------------------------
+
+    def load_config(self, f):
+        '''
+        f-->str: path of .config
+        Sets user values - same as conf_read
+        '''
+        (self.cur_file, self.cur_line) = (f, 0)
+        with open(f, 'r', encoding='utf-8', errors='replace') as fd:
+            for l in fd.read().splitlines():
+                self.cur_line += 1
+                m = re.match(SET_LINE_PAT, l)
+                if m:
+                    self.__set_user(m.group('k'), m.group('v'))
+                    continue
+                m = re.match(UNSET_LINE_PAT, l)
+                if m:
+                    self.__set_user(m.group('k'), None)
+        self.invalidate()
+
+    def set_user_value(self, k, v):
+        '''
+        k-->str: symbol name (without CONFIG_)
+        v-->str or None: value as in .config - None for 'is not set'
+            Strings are quoted
+        '''
+        (self.cur_file, self.cur_line) = ('set_user_value', 0)
+        self.__set_user(k, v)
+        self.invalidate(k)
+
+    def __set_user(self, k, v):
+        '''
+        Same as conf_set_sym_val - invalid values are ignored
+        '''
+        s = self.syms.get(k, None)
+        if s is None or s.type is None or s.is_choice:
+            return
+        if s.type in BOOL_TYPES:
+            if v is None:
+                tri = TRI_N
+            elif v[:1] == 'm' and s.type == 'tristate':
+                tri = TRI_M
+            elif v[:1] in ['y', 'n']:
+                tri = STR_2_TRI[v[:1]]
+            else:
+                self.warn('symbol value %s invalid for %s' % (v, k))
+                return
+            self.user[k] = tri
+            if s.choice:
+                cs = self.syms[s.choice]
+                if tri == TRI_Y:
+                    self.choice_user[cs.name] = k
+                elif self.choice_user.get(cs.name, None) == k:
+                    del self.choice_user[cs.name]
+                self.user[cs.name] = max(
+                    [self.user.get(x, TRI_N) for x in cs.members]
+                )
+            return
+        if v is None:
+            return
+        if v[:1] == '"':
+            buf = []
+            i = 1
+            while i < len(v) and v[i] != '"':
+                if v[i] == '\\' and i + 1 < len(v):
+                    i += 1
+                buf.append(v[i])
+                i += 1
+            v = ''.join(buf)
+        self.user[k] = v
+
+    def invalidate(self, k=None):
+        '''
+        k-->str or None: symbol whose user value changed. If None, all
+            computed values are discarded
+        Discards computed values of k and every symbol depending on it
+        '''
+        if k is None:
+            self.values = {}
+            self.vis = {}
+            self.selection = {}
+            return
+        todo = [k]
+        seen = set(todo)
+        while todo:
+            x = todo.pop()
+            self.values.pop(x, None)
+            self.vis.pop(x, None)
+            self.selection.pop(x, None)
+            for y in self.dependents.get(x, ()):
+                if y not in seen:
+                    seen.add(y)
+                    todo.append(y)
+
+    # ---------- Evaluation -----------------------------------------------
+
+    def modules(self):
+        '''
+        Returns-->int: tri value of MODULES (option modules)
+        '''
+        if not self.modules_name:
+            return TRI_N
+        return self.sym_tri(self.modules_name)
+
+    def sym_tri(self, name):
+        '''
+        name-->str
+        Returns-->int: tri value of symbol (n for undefined symbols)
+        '''
+        if name in STR_2_TRI:
+            return STR_2_TRI[name]
+        s = self.syms.get(name, None)
+        if s is None or s.type is None:
+            return TRI_N
+        return self.calc(s)[0]
+
+    def eval(self, e):
+        '''
+        e-->expression node or None (None is y)
+        Returns-->int: tri value
+        '''
+        if e is None:
+            return TRI_Y
+        t = e[0]
+        if t == E_SYM:
+            return self.sym_tri(e[1])
+        if t == E_AND:
+            ret = TRI_Y
+            for x in e[1]:
+                ret = min(ret, self.eval(x))
+                if ret == TRI_N:
+                    break
+            return ret
+        if t == E_OR:
+            ret = TRI_N
+            for x in e[1]:
+                ret = max(ret, self.eval(x))
+                if ret == TRI_Y:
+                    break
+            return ret
+        if t == E_NOT:
+            return TRI_Y - self.eval(e[1])
+        if t == E_MOD:
+            return min(TRI_M, self.modules())
+        if t == E_CONST:
+            return STR_2_TRI.get(e[1], TRI_N)
+        if t == E_CMP:
+            return self.__compare(e[1], e[2], e[3])
+        return TRI_N
+
+    def node_str(self, e):
+        '''
+        e-->E_SYM or E_CONST node
+        Returns-->str: string value (sym_get_string_value)
+        '''
+        if e[0] == E_CONST:
+            return e[1]
+        name = e[1]
+        if name in STR_2_TRI:
+            return name
+        s = self.syms.get(name, None)
+        if s is None or s.type is None:
+            return name
+        return self.calc(s)[1]
+
+    def node_type(self, e):
+        if e[0] == E_CONST:
+            return e[1] in STR_2_TRI and 'tristate' or None
+        if e[1] in STR_2_TRI:
+            return 'tristate'
+        s = self.syms.get(e[1], None)
+        if s is None:
+            return None
+        return s.type
+
+    def __compare(self, op, e1, e2):
+        '''
+        Same as E_EQUAL ... E_GTH in expr_calc_value
+        '''
+        (s1, s2) = (self.node_str(e1), self.node_str(e2))
+        (t1, t2) = (self.node_type(e1), self.node_type(e2))
+        (k1, v1, k2, v2) = (K_STRING, None, K_STRING, None)
+        if t1 != 'string' or t2 != 'string':
+            (k1, v1) = parse_string(s1, t1)
+            (k2, v2) = parse_string(s2, t2)
+        if k1 == K_STRING or k2 == K_STRING:
+            res = (s1 > s2) - (s1 < s2)
+        else:
+            res = (v1 > v2) - (v1 < v2)
+        ok = {
+            '=': res == 0, '!=': res != 0,
+            '<': res < 0, '>': res > 0,
+            '<=': res <= 0, '>=': res >= 0,
+        }[op]
+        return ok and TRI_Y or TRI_N
+
+    def eff_type(self, s):
+        '''
+        Returns-->str: type - tristate is bool if MODULES=n or symbol is a
+            visible choice value (sym_get_type)
+        '''
+        if s.type == 'tristate':
+            if s.choice and self.visibility(s) == TRI_Y:
+                return 'bool'
+            if self.modules() == TRI_N:
+                return 'bool'
+        return s.type
+
+    def visibility(self, s):
+        '''
+        Returns-->int: OR of prompt conditions (sym_calc_visibility)
+        '''
+        ret = self.vis.get(s.name, None)
+        if ret is not None:
+            return ret
+        ret = TRI_N
+        for (text, cond) in s.prompts:
+            ret = max(ret, self.eval(cond))
+        if ret == TRI_M and (s.type != 'tristate' or self.modules() == TRI_N):
+            ret = TRI_Y
+        self.vis[s.name] = ret
+        return ret
+
+    def __rev_tri(self, s, l):
+        ret = TRI_N
+        for (name, cond) in l:
+            ret = max(ret, min(self.sym_tri(name), self.eval(cond)))
+            if ret == TRI_Y:
+                break
+        if ret == TRI_M and s.type == 'bool':
+            ret = TRI_Y
+        return ret
+
+    def rev_dep(self, s):
+        '''
+        Returns-->int: OR of selects (for non-optional choice: also
+            prompt visibility && m)
+        '''
+        ret = self.__rev_tri(s, s.rev)
+        if s.is_choice and not s.optional and s.prompts:
+            ret = max(ret, min(self.eval(s.prompts[0][1]), TRI_M))
+        if ret == TRI_M and self.eff_type(s) == 'bool':
+            ret = TRI_Y
+        return ret
+
+    def implied(self, s):
+        ret = self.__rev_tri(s, s.implied)
+        if ret == TRI_M and self.eff_type(s) == 'bool':
+            ret = TRI_Y
+        return ret
+
+    def dir_dep(self, s):
+        deps = [x for x in s.dir_deps if x is not None]
+        if not deps:
+            return TRI_Y
+        ret = self.eval(expr_or(*deps))
+        if ret == TRI_M and self.eff_type(s) == 'bool':
+            ret = TRI_Y
+        return ret
+
+    def calc(self, s):
+        '''
+        s-->Symbol
+        Returns-->(tri, str, write):
+            tri-->int: tri value (n for string / int / hex)
+            str-->str: string value
+            write-->bool: symbol is written to .config
+        '''
+        ret = self.values.get(s.name, None)
+        if ret is not None:
+            return ret
+        if s.name in self.in_progress:
+            # Recursive dependency - scripts/kconfig warns and uses n too
+            return (TRI_N, s.type in STR_TYPES and '' or 'n', False)
+        self.in_progress.add(s.name)
+        try:
+            if s.type in BOOL_TYPES:
+                ret = self.__calc_tri(s)
+            elif s.type in STR_TYPES:
+                ret = self.__calc_str(s)
+            else:
+                ret = (TRI_N, s.name, False)
+        finally:
+            self.in_progress.discard(s.name)
+        self.values[s.name] = ret
+        return ret
+
+    def __calc_tri(self, s):
+        vis = self.visibility(s)
+        rev = self.rev_dep(s)
+        imp = self.implied(s)
+        write = vis != TRI_N
+        user = self.user.get(s.name, None)
+        if s.choice and vis == TRI_Y:
+            sel = self.choice_selection(self.syms[s.choice])
+            tri = (sel == s.name) and TRI_Y or TRI_N
+        else:
+            if vis != TRI_N and user is not None:
+                tri = min(user, vis)
+            else:
+                tri = TRI_N
+                if rev != TRI_N:
+                    write = True
+                if not s.is_choice:
+                    for (expr, cond) in s.defaults:
+                        c = self.eval(cond)
+                        if c == TRI_N:
+                            continue
+                        tri = min(self.eval(expr), c)
+                        if tri != TRI_N:
+                            write = True
+                        break
+                    if s.env:
+                        tri = STR_2_TRI.get(self.env.get(s.env, ''), TRI_N)
+                    if imp != TRI_N:
+                        write = True
+                        tri = min(max(tri, imp), self.dir_dep(s))
+            tri = max(tri, rev)
+        if tri == TRI_M and (self.eff_type(s) == 'bool' or imp == TRI_Y):
+            tri = TRI_Y
+        return (tri, TRI_2_STR[tri], write and not s.is_choice)
+
+    def __calc_str(self, s):
+        vis = self.visibility(s)
+        write = vis != TRI_N
+        user = self.user_str(s)
+        if vis != TRI_N and user is not None:
+            return (TRI_N, user, write)
+        val = ''
+        if s.env:
+            val = self.env.get(s.env, '')
+            write = True
+        else:
+            for (expr, cond) in s.defaults:
+                if self.eval(cond) == TRI_N:
+                    continue
+                if expr is not None and expr[0] in [E_SYM, E_CONST]:
+                    write = True
+                    val = self.node_str(expr)
+                break
+        return (TRI_N, self.__clamp(s, val), write)
+
+    def __range(self, s):
+        '''
+        Returns-->(lo, hi) or None: first range whose condition is not n
+        '''
+        if s.type not in ['int', 'hex']:
+            return None
+        base = (s.type == 'hex') and 16 or 10
+        for (lo, hi, cond) in s.ranges:
+            if self.eval(cond) == TRI_N:
+                continue
+            return (self.__range_val(lo, base), self.__range_val(hi, base))
+        return None
+
+    def __range_val(self, e, base):
+        t = self.node_type(e)
+        if t == 'int':
+            base = 10
+        elif t == 'hex':
+            base = 16
+        return strtoll(self.node_str(e), base)[0]
+
+    def __clamp(self, s, val):
+        '''
+        Same as sym_validate_range
+        '''
+        r = self.__range(s)
+        if r is None:
+            return val
+        base = (s.type == 'hex') and 16 or 10
+        v = strtoll(val, base)[0]
+        if r[0] <= v <= r[1]:
+            return val
+        v = (v < r[0]) and r[0] or r[1]
+        if s.type == 'hex':
+            return '0x%x' % (v,)
+        return '%d' % (v,)
+
+    def user_str(self, s):
+        '''
+        Returns-->str or None: user value of string / int / hex symbol if
+            it is valid and within range (sym_string_within_range)
+        '''
+        v = self.user.get(s.name, None)
+        if v is None or s.type == 'string':
+            return v
+        if s.type == 'int':
+            if not re.match('^-?(0|[1-9][0-9]*)$', v):
+                return None
+        elif not re.match('^(0[xX])?[0-9a-fA-F]+$', v):
+            return None
+        r = self.__range(s)
+        if r is not None:
+            val = strtoll(v, (s.type == 'hex') and 16 or 10)[0]
+            if not r[0] <= val <= r[1]:
+                return None
+        return v
+
+    def choice_selection(self, cs):
+        '''
+        cs-->Symbol: choice
+        Returns-->str or None: name of selected choice value - None if
+            choice is not y (sym_calc_choice)
+        '''
+        if cs.name in self.selection:
+            return self.selection[cs.name]
+        ret = None
+        if self.calc(cs)[0] == TRI_Y:
+            visible = [
+                x for x in cs.members
+                if self.visibility(self.syms[x]) != TRI_N
+            ]
+            user = self.choice_user.get(cs.name, None)
+            if user in visible:
+                ret = user
+            else:
+                for (expr, cond) in cs.defaults:
+                    if self.eval(cond) == TRI_N:
+                        continue
+                    if expr is not None and expr[0] == E_SYM and expr[1] in visible:
+                        ret = expr[1]
+                        break
+                if ret is None and visible:
+                    ret = visible[0]
+        self.selection[cs.name] = ret
+        return ret
+
+    # ---------- oldconfig ------------------------------------------------
+
+    def has_value(self, s):
+        '''
+        Returns-->bool: symbol has a (valid) user value - symbols without
+            one are NEW in 'make oldconfig'
+        '''
+        if s.is_choice:
+            for x in s.members:
+                m = self.syms[x]
+                if self.visibility(m) != TRI_N and m.name not in self.user:
+                    return False
+            return True
+        if s.type in BOOL_TYPES:
+            return s.name in self.user
+        return self.user_str(s) is not None
+
+    def is_changeable(self, s):
+        return self.visibility(s) > self.rev_dep(s)
+
+    def tri_within_range(self, s, tri):
+        '''
+        Same as sym_tristate_within_range
+        '''
+        vis = self.visibility(s)
+        rev = self.rev_dep(s)
+        if vis == TRI_N or s.type not in BOOL_TYPES:
+            return False
+        if self.eff_type(s) == 'bool' and tri == TRI_M:
+            return False
+        if vis <= rev:
+            return False
+        if s.choice and vis == TRI_Y:
+            return tri == TRI_Y
+        return rev <= tri <= vis
+
+    def value_str(self, s):
+        '''
+        Returns-->str or None: value as written in .config - None for n
+        '''
+        (tri, val, write) = self.calc(s)
+        if s.type in BOOL_TYPES:
+            return tri != TRI_N and TRI_2_STR[tri] or None
+        if s.type == 'string':
+            return '"%s"' % (val.replace('\\', '\\\\').replace('"', '\\"'),)
+        return val
+
+    def oldconfig(self, answer=None):
+        '''
+        answer-->callable or None: answer(name, type, cur, opts):
+                name-->str: symbol
+                type-->str: bool, tristate, string, int or hex
+                cur-->str or None: current (default) value as in .config
+                opts-->list of str: allowed values (bool / tristate only)
+            Returns str (value as in .config) or None to accept default
+        Asks every NEW question 'make oldconfig' asks (check_conf in
+        conf.c) and sets the answer as user value
+        Returns-->OrderedDict: name --> value set
+        '''
+        ret = OrderedDict()
+        changed = True
+        while changed:
+            changed = False
+            for name in self.entries:
+                s = self.syms[name]
+                if s.type is None or self.has_value(s):
+                    continue
+                if s.is_choice:
+                    if self.calc(s)[0] != TRI_Y:
+                        continue
+                    sel = self.choice_selection(s)
+                    for x in s.members:
+                        if self.visibility(self.syms[x]) != TRI_N:
+                            self.__set_user(x, (x == sel) and 'y' or 'n')
+                    self.invalidate(name)
+                    ret[name] = sel
+                    changed = True
+                    continue
+                if not self.is_changeable(s):
+                    continue
+                cur = self.value_str(s)
+                opts = []
+                if s.type in BOOL_TYPES:
+                    tri = self.calc(s)[0]
+                    opts = [
+                        TRI_2_STR[x] for x in [TRI_N, TRI_M, TRI_Y]
+                        if x == tri or self.tri_within_range(s, x)
+                    ]
+                v = None
+                if answer is not None:
+                    v = answer(name, s.type, cur, opts)
+                if v is None:
+                    v = cur
+                    if s.type in BOOL_TYPES and v is None:
+                        v = 'n'
+                self.set_user_value(name, v)
+                ret[name] = v
+                changed = True
+        return ret
+
+    def config_dict(self):
+        '''
+        Returns-->OrderedDict: symbols written to .config (SYMBOL_WRITE)
+            key-->str: name without CONFIG_
+            val-->str or None: value as in .config - None for 'is not set'
+            Same format as LinuxDotConfig.prefs_dict
+        '''
+        ret = OrderedDict()
+        for s in self.syms.values():
+            if s.type is None or s.is_choice:
+                continue
+            if not self.calc(s)[2]:
+                continue
+            v = self.value_str(s)
+            if v == '' and s.type in ['int', 'hex']:
+                continue
+            ret[s.name] = v
+        return ret
+
+    # ---------- Explanations ---------------------------------------------
+
+    def expr_str(self, e):
+        '''
+        e-->expression node or None
+        Returns-->str: e with current values - e.g. PCI [=y] && !EXPERT [=n]
+        '''
+        if e is None:
+            return 'y'
+        t = e[0]
+        if t == E_SYM:
+            if e[1] in STR_2_TRI or e[1] not in self.syms:
+                return e[1]
+            return '%s [=%s]' % (e[1], self.node_str(e))
+        if t == E_CONST:
+            return '"%s"' % (e[1],)
+        if t == E_MOD:
+            return 'm'
+        if t == E_NOT:
+            return '!%s' % (self.__expr_str_paren(e[1]),)
+        if t in [E_AND, E_OR]:
+            sep = (t == E_AND) and ' && ' or ' || '
+            return sep.join([self.__expr_str_paren(x, t) for x in e[1]])
+        if t == E_CMP:
+            return '%s %s %s' % (self.expr_str(e[2]), e[1], self.expr_str(e[3]))
+        return '?'
+
+    def __expr_str_paren(self, e, parent=None):
+        s = self.expr_str(e)
+        if e is not None and e[0] in [E_AND, E_OR] and e[0] != parent:
+            return '(%s)' % (s,)
+        if e is not None and e[0] == E_CMP and parent is None:
+            return '(%s)' % (s,)
+        return s
+
+    def explain(self, name, want=None):
+        '''
+        name-->str: symbol
+        want-->str or None: value wanted - as in .config
+        Returns-->list of str: reasons why symbol has its value
+        '''
+        s = self.syms.get(name, None)
+        if s is None or s.type is None:
+            return ['%s is not defined in any Kconfig' % (name,)]
+        ret = []
+        vis = self.visibility(s)
+        if not s.prompts:
+            ret.append('%s has no prompt - value is set by defaults / select only' % (name,))
+        elif vis != TRI_Y:
+            cond = expr_or(*[x[1] for x in s.prompts])
+            ret.append('visible only as %s: depends on %s' % (
+                TRI_2_STR[vis], self.expr_str(cond),
+            ))
+        rev = [x for (x, c) in s.rev if min(self.sym_tri(x), self.eval(c)) != TRI_N]
+        if rev:
+            ret.append('selected by %s' % (', '.join([
+                '%s [=%s]' % (x, TRI_2_STR[self.sym_tri(x)]) for x in rev
+            ]),))
+        if want == 'm' and self.eff_type(s) == 'bool':
+            ret.append('%s does not allow m' % (
+                (s.type == 'bool') and 'bool' or 'tristate with MODULES=n',
+            ))
+        if s.choice:
+            cs = self.syms[s.choice]
+            ret.append('choice value - selected: %s' % (
+                str(self.choice_selection(cs)),
+            ))
+        if s.type in ['int', 'hex']:
+            r = self.__range(s)
+            if r is not None:
+                ret.append('range %s %s' % (r[0], r[1]))
+        return ret
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        exit(1)
+    eng = KconfigEngine(sys.argv[1])
+    eng.load_config(sys.argv[2])
+    before = eng.config_dict()
+    for (k, v) in eng.oldconfig().items():
+        print('NEW: %s=%s' % (k, v))
+    after = eng.config_dict()
+    for k in after:
+        if before.get(k, None) != after[k]:
+            print('CHANGED: %s: %s --> %s' % (k, before.get(k, None), after[k]))
+    for w in eng.warnings:
+        print('Warning: %s' % (w,))
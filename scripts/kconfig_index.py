@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+'''
+Persistent index of Kconfig symbols - under KERNEL_CACHE_DIR
+(default ~/.cache/kernel_build), NOT under KERNEL_BUILD_DIR:
+    kconfig/index.sqlite3
+
+    trees   - one row per indexed Kconfig tree:
+                kver, tree_hash, fmt, nfiles, created, used
+    defs    - one row per definition (config / menuconfig section) of a
+              symbol - fields of CfgVarNT in update_kernel_config.py:
+                f, t, k, default, p, default_str, sec
+    symbols - one row per symbol - resolved type and default
+              (KConfigsReader.get_type, KConfigsReader.get_default)
+
+    A tree is identified by kernel version (from top-level Makefile) and
+    sha256 of paths and contents of all Kconfig files, so patches that
+    change a Kconfig file get a new tree. fmt is KCONFIG_INDEX_FORMAT -
+    trees stored with another format are never returned.
+    Only KCONFIG_INDEX_KEEP trees (most recently used) are kept
+'''
+import os
+import re
+import time
+import hashlib
+from collections.abc import Mapping
+# sqlite3 is optional - some minimal python builds do not have it
+try:
+    import sqlite3
+except:
+    sqlite3 = None
+from pyutils import get_cache_dir
+
+
+KCONFIG_INDEX_SUBDIR = 'kconfig'
+KCONFIG_INDEX_FILENAME = 'index.sqlite3'
+# Change when what KConfigsReader stores changes
+KCONFIG_INDEX_FORMAT = 1
+KCONFIG_INDEX_KEEP = 8
+# Seconds to wait for another build writing the index
+KCONFIG_INDEX_TIMEOUT = 120
+
+MAKEFILE_VER_PAT = re.compile(
+    '^(?P<k>VERSION|PATCHLEVEL|SUBLEVEL|EXTRAVERSION)\s*=\s*(?P<v>\S*)\s*$',
+    re.MULTILINE
+)
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS trees (
+        id INTEGER PRIMARY KEY,
+        kver TEXT NOT NULL,
+        tree_hash TEXT NOT NULL,
+        fmt INTEGER NOT NULL,
+        nfiles INTEGER NOT NULL,
+        created REAL NOT NULL,
+        used REAL NOT NULL,
+        UNIQUE (kver, tree_hash, fmt)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS defs (
+        tree_id INTEGER NOT NULL,
+        k TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        f TEXT,
+        t TEXT,
+        def_val TEXT,
+        p TEXT,
+        def_str TEXT,
+        sec TEXT
+    )''',
+    '''CREATE INDEX IF NOT EXISTS defs_tree_k ON defs (tree_id, k)''',
+    '''CREATE TABLE IF NOT EXISTS symbols (
+        tree_id INTEGER NOT NULL,
+        k TEXT NOT NULL,
+        t TEXT,
+        def_val TEXT,
+        PRIMARY KEY (tree_id, k)
+    )''',
+]
+
+
+def kernel_version(build_dir):
+    '''
+    build_dir-->str: kernel source dir
+    Returns-->str: e.g. 5.10.17 or 5.11.0-rc1 - from top-level Makefile
+        Same as 'make kernelversion', without running make
+    '''
+    with open(os.path.join(build_dir, 'Makefile'), 'r') as f:
+        s = f.read(4096)
+    d = {}
+    for m in re.finditer(MAKEFILE_VER_PAT, s):
+        d.setdefault(m.group('k'), m.group('v'))
+    return '%s.%s.%s%s' % (
+        d.get('VERSION', ''), d.get('PATCHLEVEL', ''),
+        d.get('SUBLEVEL', ''), d.get('EXTRAVERSION', ''),
+    )
+
+
+def kconfig_tree_hash(build_dir, files):
+    '''
+    build_dir-->str: kernel source dir
+    files-->list of str: Kconfig file paths relative to build_dir
+    Returns-->str: sha256 hex digest of paths and contents of files
+    '''
+    h = hashlib.sha256()
+    for f in sorted(files):
+        h.update(f.encode('utf-8', 'surrogateescape') + b'\0')
+        with open(os.path.join(build_dir, f), 'rb') as fd:
+            h.update(fd.read())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class KconfigIndex(object):
+    '''
+    See module docstring for layout
+    '''
+    def __init__(self, path=None):
+        '''
+        path-->str: index file - defaults to
+            get_cache_dir(KCONFIG_INDEX_SUBDIR)/KCONFIG_INDEX_FILENAME
+        Raises ValueError if sqlite3 is not available or cache dir
+        cannot be created
+        '''
+        if sqlite3 is None:
+            raise ValueError('sqlite3 module not available')
+        if not path:
+            d = get_cache_dir(KCONFIG_INDEX_SUBDIR)
+            if not d:
+                raise ValueError('Could not create cache directory')
+            path = os.path.join(d, KCONFIG_INDEX_FILENAME)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=KCONFIG_INDEX_TIMEOUT)
+        # Readers are not blocked while another build stores a tree
+        try:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+        except:
+            pass
+        with self.conn:
+            for s in SCHEMA:
+                self.conn.execute(s)
+
+    def close(self):
+        try:
+            self.conn.close()
+        except:
+            pass
+
+    def lookup(self, kver, tree_hash):
+        '''
+        kver-->str: kernel version
+        tree_hash-->str: from kconfig_tree_hash
+        Returns-->(tree_id, nfiles) or (None, 0) if not indexed
+        '''
+        row = self.conn.execute(
+            'SELECT id, nfiles FROM trees WHERE kver=? AND tree_hash=? AND fmt=?',
+            (kver, tree_hash, KCONFIG_INDEX_FORMAT)
+        ).fetchone()
+        if row is None:
+            return (None, 0)
+        with self.conn:
+            self.conn.execute(
+                'UPDATE trees SET used=? WHERE id=?', (time.time(), row[0])
+            )
+        return (row[0], row[1])
+
+    def store(self, kver, tree_hash, nfiles, ntd, get_type, get_default):
+        '''
+        kver-->str: kernel version
+        tree_hash-->str: from kconfig_tree_hash
+        nfiles-->int: number of Kconfig files parsed
+        ntd-->OrderedDict: KConfigsReader.ntd for ALL symbols
+            key-->str: CFG_KEY
+            val-->list of CfgVarNT
+        get_type-->callable: CFG_KEY-->str or None
+        get_default-->callable: CFG_KEY-->str or None
+        Returns-->int: tree_id
+        Replaces tree with same kver and tree_hash if present
+        '''
+        now = time.time()
+        with self.conn:
+            self.__delete(self.conn.execute(
+                'SELECT id FROM trees WHERE kver=? AND tree_hash=? AND fmt=?',
+                (kver, tree_hash, KCONFIG_INDEX_FORMAT)
+            ).fetchall())
+            tree_id = self.conn.execute(
+                'INSERT INTO trees (kver, tree_hash, fmt, nfiles, created, used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (kver, tree_hash, KCONFIG_INDEX_FORMAT, nfiles, now, now)
+            ).lastrowid
+            self.conn.executemany(
+                'INSERT INTO defs (tree_id, k, seq, f, t, def_val, p, def_str, sec) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (tree_id, k, seq, nt.f, nt.t, nt.default, nt.p, nt.default_str, nt.sec)
+                    for (k, ntl) in ntd.items()
+                    for (seq, nt) in enumerate(ntl)
+                )
+            )
+            # symbols rowid order == ntd order
+            self.conn.executemany(
+                'INSERT INTO symbols (tree_id, k, t, def_val) VALUES (?, ?, ?, ?)',
+                ((tree_id, k, get_type(k), get_default(k)) for k in ntd.keys())
+            )
+        return tree_id
+
+    def __delete(self, rows):
+        '''
+        rows-->list of (tree_id,)
+        Must be called within a transaction
+        '''
+        for (tree_id,) in rows:
+            for table in ['defs', 'symbols']:
+                self.conn.execute(
+                    'DELETE FROM %s WHERE tree_id=?' % (table,), (tree_id,)
+                )
+            self.conn.execute('DELETE FROM trees WHERE id=?', (tree_id,))
+
+    def prune(self, keep=KCONFIG_INDEX_KEEP):
+        '''
+        keep-->int: number of most recently used trees to keep
+        '''
+        with self.conn:
+            self.__delete(self.conn.execute(
+                'SELECT id FROM trees ORDER BY used DESC LIMIT -1 OFFSET ?',
+                (keep,)
+            ).fetchall())
+
+    def tree(self, tree_id, nt_class, syms=[]):
+        '''
+        tree_id-->int: from lookup or store
+        nt_class-->namedtuple class with fields of CfgVarNT
+        syms-->list of str: CFG_KEYS. If syms is empty, ALL CFG_KEYs are considered
+        Returns-->KconfigTree
+        '''
+        return KconfigTree(self, tree_id, nt_class, syms)
+
+
+class KconfigTree(Mapping):
+    '''
+    Read-only view of one indexed tree - can be used in place of
+    KConfigsReader.ntd:
+        key-->str: CFG_KEY
+        val-->list of nt_class (CfgVarNT)
+    Definitions are read from the index when a key is looked up
+    '''
+    def __init__(self, index, tree_id, nt_class, syms=[]):
+        self.index = index
+        self.tree_id = tree_id
+        self.nt_class = nt_class
+        self.syms = dict.fromkeys(syms)
+        self.cache = {}
+
+    def __symbol(self, k):
+        '''
+        Returns-->(t, def_val) or None
+        '''
+        if self.syms and k not in self.syms:
+            return None
+        return self.index.conn.execute(
+            'SELECT t, def_val FROM symbols WHERE tree_id=? AND k=?',
+            (self.tree_id, k)
+        ).fetchone()
+
+    def __contains__(self, k):
+        if k in self.cache:
+            return True
+        return self.__symbol(k) is not None
+
+    def __getitem__(self, k):
+        if k in self.cache:
+            return self.cache[k]
+        if self.syms and k not in self.syms:
+            raise KeyError(k)
+        ret = [
+            self.nt_class(
+                f=f, t=t, k=k, default=def_val, p=p,
+                default_str=def_str, sec=sec
+            )
+            for (f, t, def_val, p, def_str, sec) in self.index.conn.execute(
+                'SELECT f, t, def_val, p, def_str, sec FROM defs '
+                'WHERE tree_id=? AND k=? ORDER BY seq',
+                (self.tree_id, k)
+            )
+        ]
+        if not ret:
+            raise KeyError(k)
+        self.cache[k] = ret
+        return ret
+
+    def __iter__(self):
+        for (k,) in self.index.conn.execute(
+            'SELECT k FROM symbols WHERE tree_id=? ORDER BY rowid',
+            (self.tree_id,)
+        ).fetchall():
+            if self.syms and k not in self.syms:
+                continue
+            yield k
+
+    def __len__(self):
+        if self.syms:
+            return len([x for x in self])
+        return self.index.conn.execute(
+            'SELECT COUNT(*) FROM symbols WHERE tree_id=?', (self.tree_id,)
+        ).fetchone()[0]
+
+    def get_type(self, k):
+        '''
+        k-->str: CFG_KEY
+        Returns-->str or None
+        '''
+        row = self.__symbol(k)
+        if row is None:
+            return None
+        return row[0]
+
+    def get_default(self, k):
+        '''
+        k-->str: CFG_KEY
+        Returns-->str or None
+        '''
+        row = self.__symbol(k)
+        if row is None:
+            return None
+        return row[1]
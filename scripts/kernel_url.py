@@ -3,11 +3,17 @@ New version that uses the JSON API at www.kernel.org
 '''
 import os
 import sys
-import subprocess
+import re
+import time
 import json
+import bisect
+import threading
+import concurrent.futures
+import http.client
+from urllib.parse import urlsplit, urljoin
 from collections import namedtuple
-import httplib2
 import traceback
+from pyutils import Singleton, get_cache_dir, write_file_atomic
 
 
 KernelURL = namedtuple('KernelURL', [
@@ -20,6 +26,244 @@ KernelURL = namedtuple('KernelURL', [
 ])
 KERNEL_ORG_JSON_URL = 'https://www.kernel.org/releases.json'
 
+# Seconds for which cached releases.json is used without revalidation
+# Can be overridden by KERNEL_RELEASES_CACHE_TTL environment variable
+RELEASES_CACHE_TTL = 900
+RELEASES_CACHE_SUBDIR = 'releases'
+
+# Index of ALL released versions, built from directory listings
+# of KERNEL_ORG_CDN_BASE - e.g. https://cdn.kernel.org/pub/linux/kernel/v5.x/
+KERNEL_ORG_CDN_BASE = 'https://cdn.kernel.org/pub/linux/kernel/'
+VERSION_INDEX_SUBDIR = 'versions'
+# Seconds for which a cached directory listing is used without revalidation
+# A version missing from the cached listing always triggers revalidation
+VERSION_INDEX_TTL = 86400
+
+# Mirrors of KERNEL_ORG_CDN_BASE - each must have the same layout
+# under the base URL. Can be overridden by KERNEL_MIRRORS environment
+# variable (space-separated base URLs). KERNEL_MIRRORS=none disables probing
+KERNEL_MIRRORS = [
+    KERNEL_ORG_CDN_BASE,
+    'https://mirrors.edge.kernel.org/pub/linux/kernel/',
+]
+MIRRORS_CACHE_SUBDIR = 'mirrors'
+# Seconds for which cached mirror rankings are used without probing again
+MIRROR_RANK_TTL = 3600
+MIRROR_PROBE_BYTES = 65536      # size of range request used to probe
+MIRROR_PROBE_TIMEOUT = 5        # seconds - connect and each read
+
+# HTTP client settings - each can be overridden by environment variable
+# KERNEL_HTTP_<NAME> - e.g. KERNEL_HTTP_CONNECT_TIMEOUT
+HTTP_CONNECT_TIMEOUT = 10       # seconds
+HTTP_READ_TIMEOUT = 30          # seconds - for each socket read
+HTTP_RETRIES = 3                # retries after first attempt
+HTTP_BACKOFF = 1.0              # seconds - doubled after each retry
+HTTP_MAX_REDIRECTS = 5
+# If KERNEL_URL_FIXTURE_SERVER is set (e.g. http://127.0.0.1:8000), ALL
+# requests go to that server - scheme and host of each URL are replaced,
+# path and query are kept. Intended for tests with a local fixture server
+HTTP_FIXTURE_SERVER_VAR = 'KERNEL_URL_FIXTURE_SERVER'
+HTTP_REDIRECT_CODES = [301, 302, 303, 307, 308]
+
+
+HttpResponse = namedtuple('HttpResponse', [
+    'status',
+    'headers',      # dict with lower-case keys
+    'body',         # bytes
+    'url',          # final URL (after redirects)
+])
+
+
+def _env_number(name, default, conv=float):
+    '''
+    name-->str: environment variable name
+    default-->int or float
+    conv-->callable: int or float
+    Returns-->int or float
+    '''
+    try:
+        return conv(os.environ.get(name, default))
+    except:
+        return default
+
+
+class HttpClient(Singleton):
+    '''
+    Single shared HTTP(S) client for all kernel.org requests
+        - Keeps idle connections per (scheme, host) and reuses them, so
+          repeated requests to one host reuse one TCP / TLS session
+        - Explicit connect and read timeouts - a hung server cannot
+          stall the build forever
+        - Retries connection errors and 5xx responses with exponential
+          backoff
+        - Follows redirects
+    Safe to use from multiple threads - each request checks out its own
+    connection
+    '''
+    def __init__(self):
+        self.connect_timeout = _env_number(
+            'KERNEL_HTTP_CONNECT_TIMEOUT', HTTP_CONNECT_TIMEOUT)
+        self.read_timeout = _env_number(
+            'KERNEL_HTTP_READ_TIMEOUT', HTTP_READ_TIMEOUT)
+        self.retries = _env_number('KERNEL_HTTP_RETRIES', HTTP_RETRIES, int)
+        self.backoff = _env_number('KERNEL_HTTP_BACKOFF', HTTP_BACKOFF)
+        self.fixture_server = os.environ.get(HTTP_FIXTURE_SERVER_VAR, None)
+        self.__idle = {}
+        self.__lock = threading.Lock()
+
+    def rewrite_url(self, url):
+        '''
+        url-->str
+        Returns-->str: url pointing at fixture server if it is set
+        '''
+        if not self.fixture_server:
+            return url
+        u = urlsplit(url)
+        f = urlsplit(self.fixture_server)
+        return u._replace(scheme=f.scheme, netloc=f.netloc).geturl()
+
+    def checkout(self, scheme, netloc):
+        '''
+        scheme-->str: http or https
+        netloc-->str: host[:port]
+        Returns-->http.client.HTTPConnection: idle or new connection
+        '''
+        with self.__lock:
+            l = self.__idle.get((scheme, netloc), [])
+            if l:
+                return l.pop()
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(
+                netloc, timeout=self.connect_timeout)
+        elif scheme == 'http':
+            conn = http.client.HTTPConnection(
+                netloc, timeout=self.connect_timeout)
+        else:
+            raise ValueError('Unsupported URL scheme: %s' % (scheme,))
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def checkin(self, scheme, netloc, conn):
+        '''
+        Returns conn to pool of idle connections for reuse
+        Response on conn must have been read completely
+        '''
+        with self.__lock:
+            self.__idle.setdefault((scheme, netloc), []).append(conn)
+
+    def close(self):
+        '''Closes all idle connections'''
+        with self.__lock:
+            for l in self.__idle.values():
+                for conn in l:
+                    try:
+                        conn.close()
+                    except:
+                        pass
+            self.__idle = {}
+
+    def __request_once(self, url, method, headers):
+        '''
+        Returns-->HttpResponse - redirects are NOT followed
+        Raises exception on connection errors and timeouts
+        '''
+        u = urlsplit(url)
+        path = u.path or '/'
+        if u.query:
+            path += '?' + u.query
+        conn = self.checkout(u.scheme, u.netloc)
+        try:
+            conn.request(method, path, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self.checkin(u.scheme, u.netloc, conn)
+        return HttpResponse(
+            status=resp.status,
+            headers=dict((k.lower(), v) for (k, v) in resp.getheaders()),
+            body=body,
+            url=url,
+        )
+
+    def request(self, url, method='GET', headers=None):
+        '''
+        url-->str
+        method-->str
+        headers-->dict or None
+        Returns-->HttpResponse
+        Raises exception if all retries fail
+        '''
+        headers = dict(headers or {})
+        url = self.rewrite_url(url)
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            attempt = 0
+            while True:
+                try:
+                    r = self.__request_once(url, method, headers)
+                    if r.status < 500 or attempt >= self.retries:
+                        break
+                except (OSError, http.client.HTTPException):
+                    if attempt >= self.retries:
+                        raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+            location = r.headers.get('location', None)
+            if r.status not in HTTP_REDIRECT_CODES or not location:
+                return r
+            url = self.rewrite_url(urljoin(url, location))
+            if r.status == 303:
+                method = 'GET'
+        raise ValueError('Too many redirects: %s' % (url,))
+
+    def open(self, url, headers=None):
+        '''
+        url-->str
+        headers-->dict or None
+        Returns-->(http.client.HTTPResponse, str): response with body NOT
+            read yet, and final URL (after redirects)
+        For large downloads that must not be held in memory. Caller must
+        read and close the response. Its connection is NOT returned to
+        the pool. Connection errors and 5xx responses are retried like
+        request()
+        '''
+        headers = dict(headers or {})
+        url = self.rewrite_url(url)
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            u = urlsplit(url)
+            path = u.path or '/'
+            if u.query:
+                path += '?' + u.query
+            attempt = 0
+            while True:
+                conn = None
+                try:
+                    conn = self.checkout(u.scheme, u.netloc)
+                    conn.request('GET', path, headers=headers)
+                    resp = conn.getresponse()
+                    if resp.status < 500 or attempt >= self.retries:
+                        break
+                    conn.close()
+                except (OSError, http.client.HTTPException):
+                    if conn is not None:
+                        conn.close()
+                    if attempt >= self.retries:
+                        raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+            location = resp.getheader('Location', None)
+            if resp.status not in HTTP_REDIRECT_CODES or not location:
+                return (resp, url)
+            resp.read()
+            conn.close()
+            url = self.rewrite_url(urljoin(url, location))
+        raise ValueError('Too many redirects: %s' % (url,))
+
 
 def url_is_valid(u):
     '''
@@ -27,95 +271,656 @@ def url_is_valid(u):
     Returns-->boolean
     '''
     try:
-        h = httplib2.Http()
-        r = h.request(u, 'HEAD')
-        code = r[0]['status']
+        r = HttpClient().request(u, 'HEAD')
     except:
         return False
-    return (code == '200')
+    return (r.status == 200)
 
 
-def get_kernel_urls(show_exception=True):
+class ReleasesCache(object):
     '''
-    Returns-->LIST of KernelURL namedtuples
+    On-disk cache of KERNEL_ORG_JSON_URL under
+    get_cache_dir(RELEASES_CACHE_SUBDIR):
+        releases.json       - raw JSON as last downloaded
+        meta.json           - ETag, Last-Modified, time of last validation
+        kernel_urls.json    - parsed KernelURL list (without KERNEL_VERSION
+                              override)
+
+    Within RELEASES_CACHE_TTL seconds of last validation the parsed list
+    is served from disk without any network access. After that the
+    cached copy is revalidated using If-None-Match / If-Modified-Since.
+    If kernel.org cannot be reached, the last good copy is used
     '''
-    ret = []
-    try:
-        CMD = "curl -s '%s'" % (KERNEL_ORG_JSON_URL,)
-        j = subprocess.check_output(CMD, shell=True)
-        d = json.loads(j.decode('utf8'))
-        latest_version = d['latest_stable']['version']
-        latest_kurl = None
-        for rel in d['releases']:
-            # Ignore releases without 'moniker' set
-            ktype = rel.get('moniker', None)
-            if not ktype:
-                continue
-            # Ignore linux-next
-            if ktype == 'linux-next':
-                continue
-            # Ignore releases that don't have required fields
+    def __init__(self, show_exception=True):
+        self.show_exception = show_exception
+        self.ttl = RELEASES_CACHE_TTL
+        try:
+            self.ttl = int(os.environ.get(
+                'KERNEL_RELEASES_CACHE_TTL', RELEASES_CACHE_TTL))
+        except:
+            pass
+        self.cache_dir = get_cache_dir(RELEASES_CACHE_SUBDIR)
+        self.meta = {}
+        self.kernel_urls = None
+        if self.cache_dir:
+            self.meta = self.__read_json('meta.json') or {}
+            l = self.__read_json('kernel_urls.json')
+            if l is not None:
+                try:
+                    self.kernel_urls = [KernelURL(**d) for d in l]
+                except:
+                    self.kernel_urls = None
+
+    def __path(self, f):
+        return os.path.join(self.cache_dir, f)
+
+    def __read_json(self, f):
+        '''
+        f-->str: file name under self.cache_dir
+        Returns-->object or None
+        '''
+        try:
+            with open(self.__path(f), 'r') as fd:
+                return json.load(fd)
+        except:
+            return None
+
+    def __write(self, j, headers):
+        '''
+        j-->bytes: raw releases.json
+        headers-->dict: response headers (lower-case keys)
+        Errors writing cache are ignored - cache is only an optimization
+        '''
+        if not self.cache_dir:
+            return
+        self.meta = {
+            'etag': headers.get('etag', None),
+            'last_modified': headers.get('last-modified', None),
+            'validated': time.time(),
+        }
+        try:
+            write_file_atomic(self.__path('releases.json'), j)
+            write_file_atomic(
+                self.__path('kernel_urls.json'),
+                json.dumps([u._asdict() for u in self.kernel_urls], indent=1)
+            )
+            write_file_atomic(self.__path('meta.json'), json.dumps(self.meta))
+        except:
+            if self.show_exception:
+                sys.stderr.write(traceback.format_exc())
+
+    def __touch(self):
+        '''Records successful revalidation (304)'''
+        self.meta['validated'] = time.time()
+        try:
+            write_file_atomic(self.__path('meta.json'), json.dumps(self.meta))
+        except:
+            pass
+
+    def is_fresh(self):
+        '''Returns-->bool'''
+        if self.kernel_urls is None:
+            return False
+        validated = self.meta.get('validated', 0) or 0
+        return (time.time() - validated) < self.ttl
+
+    def get(self):
+        '''
+        Returns-->LIST of KernelURL namedtuples
+        Raises exception if kernel.org cannot be reached AND there is no
+        cached copy
+        '''
+        if self.is_fresh():
+            return self.kernel_urls
+
+        headers = {}
+        if self.kernel_urls is not None:
+            if self.meta.get('etag', None):
+                headers['If-None-Match'] = self.meta['etag']
+            if self.meta.get('last_modified', None):
+                headers['If-Modified-Since'] = self.meta['last_modified']
+        try:
+            r = HttpClient().request(KERNEL_ORG_JSON_URL, headers=headers)
+            if r.status == 304 and self.kernel_urls is not None:
+                self.__touch()
+                return self.kernel_urls
+            if r.status != 200:
+                raise ValueError('%s: HTTP status %d' % (
+                    KERNEL_ORG_JSON_URL, r.status))
+            self.kernel_urls = parse_releases_json(
+                r.body, show_exception=self.show_exception)
+            self.__write(r.body, r.headers)
+            return self.kernel_urls
+        except:
+            if self.kernel_urls is None:
+                raise
+            validated = self.meta.get('validated', 0) or 0
+            sys.stderr.write(
+                'Could not fetch %s - using cached copy from %s\n' % (
+                    KERNEL_ORG_JSON_URL, time.ctime(validated)))
+            return self.kernel_urls
+
+
+LISTING_TARBALL_PAT = re.compile(
+    'href="linux-(?P<KVER>[0-9][0-9.]*[0-9])\\.tar\\.(?P<EXT>xz|gz)"'
+    '(?:[^\\n]*?(?P<DATE>[0-9]{2}-[A-Z][a-z]{2}-[0-9]{4}))?'
+)
+SHA256SUMS_PAT = re.compile(
+    '^(?P<SUM>[0-9a-f]{64})\\s+linux-(?P<KVER>[0-9][0-9.]*[0-9])\\.tar\\.xz$',
+    re.MULTILINE
+)
+
+
+def kernel_org_dir(kver):
+    '''
+    kver-->str: e.g. 5.10.17
+    Returns-->str: directory under KERNEL_ORG_CDN_BASE - e.g. v5.x
+        or None if kver is not a release version
+    '''
+    vt = kver_tuple(kver)
+    if vt is None or not vt[3]:
+        return None
+    if vt[0] < 3:
+        return 'v%d.%d' % vt[:2]
+    return 'v%d.x' % (vt[0],)
+
+
+class VersionIndex(object):
+    '''
+    On-disk index of every released kernel version, built from directory
+    listings of KERNEL_ORG_CDN_BASE (e.g. v5.x/) and sha256sums.asc in
+    each directory. One JSON file per directory under
+    get_cache_dir(VERSION_INDEX_SUBDIR) - e.g. v5.x.json:
+        etag, last_modified             - of directory listing
+        sums_etag, sums_last_modified   - of sha256sums.asc
+        validated                       - time of last validation
+        versions                        - kver --> dict:
+            tarball, sig, sha256, date
+
+    Only directories that are looked up are fetched. Refresh is
+    incremental - conditional GET (If-None-Match / If-Modified-Since)
+    per directory, so an unchanged directory costs one 304
+    Static tarballs on cdn.kernel.org are much faster to download than
+    snapshots that git.kernel.org generates on the fly
+    '''
+    def __init__(self, show_exception=True):
+        self.show_exception = show_exception
+        self.cache_dir = get_cache_dir(VERSION_INDEX_SUBDIR)
+        self.dirs = {}
+
+    def __path(self, d):
+        return os.path.join(self.cache_dir, d + '.json')
+
+    def __read(self, d):
+        '''
+        d-->str: directory - e.g. v5.x
+        Returns-->dict
+        '''
+        if d in self.dirs:
+            return self.dirs[d]
+        ret = {}
+        if self.cache_dir:
             try:
-                kver = rel['version']
-                dl_url = rel['source']
-                sig_url = rel['pgp']
+                with open(self.__path(d), 'r') as f:
+                    ret = json.load(f)
             except:
-                if show_exception:
-                    sys.stderr.write(traceback.format_exc())
-                continue
+                ret = {}
+        self.dirs[d] = ret
+        return ret
+
+    def __get(self, url, etag, last_modified):
+        '''
+        Returns-->HttpResponse
+        '''
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        r = HttpClient().request(url, headers=headers)
+        if r.status not in (200, 304):
+            raise ValueError('%s: HTTP status %d' % (url, r.status))
+        return r
 
-            # changelog_url and release_date are optional
-            cl_url = rel.get('changelog', None)
+    def refresh(self, d):
+        '''
+        d-->str: directory - e.g. v5.x
+        Returns-->dict: versions in directory
+        Revalidates directory listing and sha256sums.asc - parses only
+        what changed. On network errors cached copy is kept
+        '''
+        meta = self.__read(d)
+        versions = meta.get('versions', {})
+        base = KERNEL_ORG_CDN_BASE + d + '/'
+        try:
+            r = self.__get(
+                base, meta.get('etag', None), meta.get('last_modified', None))
+            if r.status == 200:
+                versions = parse_listing(
+                    r.body, base, old_versions=versions)
+                meta['etag'] = r.headers.get('etag', None)
+                meta['last_modified'] = r.headers.get('last-modified', None)
+                # New listing --> sha256sums.asc must be re-read
+                meta['sums_etag'] = None
+                meta['sums_last_modified'] = None
             try:
-                rel_date = rel['released']['isodate']
+                r = self.__get(
+                    base + 'sha256sums.asc',
+                    meta.get('sums_etag', None),
+                    meta.get('sums_last_modified', None),
+                )
+                if r.status == 200:
+                    body = r.body.decode('utf8', errors='replace')
+                    for m in re.finditer(SHA256SUMS_PAT, body):
+                        v = versions.get(m.groupdict()['KVER'], None)
+                        if v is not None and v['tarball'].endswith('.xz'):
+                            v['sha256'] = m.groupdict()['SUM']
+                    meta['sums_etag'] = r.headers.get('etag', None)
+                    meta['sums_last_modified'] = r.headers.get(
+                        'last-modified', None)
             except:
-                rel_date = None
-
-            # Set ktype for latest kernel version
-            if kver == latest_version:
-                ktype = 'latest'
-            kurl = KernelURL(
-                ktype=ktype,
-                kver=kver,
-                download_url=dl_url,
-                sig_url=sig_url,
-                changelog_url=cl_url,
-                release_date=rel_date,
-            )
-            # Keep the latest one aside to insert as first element later
-            if ktype == 'latest':
-                latest_kurl = kurl
-            else:
-                ret.append(kurl)
+                # Checksums are optional
+                if self.show_exception:
+                    sys.stderr.write(traceback.format_exc())
+            meta['versions'] = versions
+            meta['validated'] = time.time()
+        except:
+            if self.show_exception:
+                sys.stderr.write(traceback.format_exc())
+            return versions
+        self.dirs[d] = meta
+        if self.cache_dir:
+            try:
+                write_file_atomic(self.__path(d), json.dumps(meta, indent=1))
+            except:
+                if self.show_exception:
+                    sys.stderr.write(traceback.format_exc())
+        return versions
 
-        # Add latest one as first element
-        if latest_kurl:
-            ret.insert(0, latest_kurl)
+    def lookup(self, kver):
+        '''
+        kver-->str: e.g. 4.19.100
+        Returns-->dict (tarball, sig, sha256, date) or None
+        No network access if kver is in a listing validated within
+        VERSION_INDEX_TTL seconds
+        '''
+        d = kernel_org_dir(kver)
+        if d is None:
+            return None
+        meta = self.__read(d)
+        v = meta.get('versions', {}).get(kver, None)
+        validated = meta.get('validated', 0) or 0
+        if v is not None and (time.time() - validated) < VERSION_INDEX_TTL:
+            return v
+        return self.refresh(d).get(kver, None)
 
-        # Add linux-next and torvalds kernels
-        kurl = KernelURL(
-            ktype='linux-next',
-            kver='unknown',
-            download_url='git://git.kernel.org/pub/scm/linux/kernel/git/next/linux-next.git',   # noqa: E501
-            sig_url='',
+    def kernel_url(self, kver):
+        '''
+        kver-->str
+        Returns-->KernelURL namedtuple (ktype='unsupported') or None
+        '''
+        v = self.lookup(kver)
+        if v is None:
+            return None
+        return KernelURL(
+            ktype='unsupported',
+            kver=kver,
+            download_url=v['tarball'],
+            sig_url=v['sig'],
             changelog_url='',
-            release_date='from_git',
+            release_date=v['date'],
         )
-        ret.append(kurl)
+
+
+def parse_listing(html, base, old_versions=None):
+    '''
+    html-->bytes or str: directory listing of KERNEL_ORG_CDN_BASE + d
+    base-->str: URL of directory, ending in /
+    old_versions-->dict or None: previous result - sha256 is kept for
+        versions whose tarball did not change
+    Returns-->dict: kver --> dict(tarball, sig, sha256, date)
+        .tar.xz is preferred over .tar.gz
+    '''
+    if isinstance(html, bytes):
+        html = html.decode('utf8', errors='replace')
+    old_versions = old_versions or {}
+    ret = {}
+    for m in re.finditer(LISTING_TARBALL_PAT, html):
+        kver = m.groupdict()['KVER']
+        ext = m.groupdict()['EXT']
+        if kver in ret and ext != 'xz':
+            continue
+        tarball = '%slinux-%s.tar.%s' % (base, kver, ext)
+        date = m.groupdict()['DATE']
+        if date:
+            try:
+                date = time.strftime(
+                    '%Y-%m-%d', time.strptime(date, '%d-%b-%Y'))
+            except:
+                pass
+        old = old_versions.get(kver, {})
+        ret[kver] = {
+            'tarball': tarball,
+            'sig': '%slinux-%s.tar.sign' % (base, kver),
+            'sha256': (
+                old.get('sha256', None)
+                if old.get('tarball', None) == tarball else None
+            ),
+            'date': date or '',
+        }
+    return ret
+
+
+MirrorProbe = namedtuple('MirrorProbe', [
+    'base',         # mirror base URL
+    'url',          # URL probed
+    'ttfb',         # seconds to first byte (response headers)
+    'throughput',   # bytes / second reading the probe range
+    'est_time',     # seconds - estimated time to download complete file
+])
+
+
+def get_mirrors():
+    '''
+    Returns-->LIST of str: mirror base URLs (ending in /)
+        Empty list if KERNEL_MIRRORS=none
+    '''
+    v = os.environ.get('KERNEL_MIRRORS', None)
+    if v is None or not v.strip():
+        l = list(KERNEL_MIRRORS)
+    elif v.strip().lower() == 'none':
+        l = []
+    else:
+        l = v.split()
+    return [x if x.endswith('/') else x + '/' for x in l]
+
+
+def probe_mirror(base, path, nbytes=MIRROR_PROBE_BYTES):
+    '''
+    base-->str: mirror base URL
+    path-->str: path of file relative to base
+    nbytes-->int: number of bytes to request (Range)
+    Returns-->MirrorProbe namedtuple or None if unreachable / file missing
+    Uses a separate short-lived connection with MIRROR_PROBE_TIMEOUT, so
+    that a slow mirror cannot hold up a connection in HttpClient pool
+    '''
+    url = base + path
+    u = urlsplit(HttpClient().rewrite_url(url))
+    if u.scheme == 'https':
+        cls = http.client.HTTPSConnection
+    elif u.scheme == 'http':
+        cls = http.client.HTTPConnection
+    else:
+        return None
+    conn = cls(u.netloc, timeout=MIRROR_PROBE_TIMEOUT)
+    try:
+        t0 = time.time()
+        conn.request('GET', u.path or '/', headers={
+            'Range': 'bytes=0-%d' % (nbytes - 1,)})
+        resp = conn.getresponse()
+        ttfb = time.time() - t0
+        if resp.status not in (200, 206):
+            return None
+        # Do not read the whole file if mirror ignores Range
+        body = resp.read(nbytes)
+        elapsed = max(time.time() - t0 - ttfb, 1e-6)
+    except:
+        return None
+    finally:
+        conn.close()
+    if not body:
+        return None
+    throughput = len(body) / elapsed
+    total = len(body)
+    try:
+        if resp.status == 206:
+            total = int(resp.getheader('Content-Range').split('/')[-1])
+        else:
+            total = int(resp.getheader('Content-Length'))
+    except:
+        pass
+    return MirrorProbe(
+        base=base,
+        url=url,
+        ttfb=ttfb,
+        throughput=throughput,
+        est_time=ttfb + (total / throughput),
+    )
+
+
+def mirror_has_file(url):
+    '''
+    url-->str: URL of file on a mirror
+    Returns-->bool: True if HEAD request for url returns 200
+    Uses a separate short-lived connection with MIRROR_PROBE_TIMEOUT (as
+    probe_mirror)
+    '''
+    u = urlsplit(HttpClient().rewrite_url(url))
+    if u.scheme == 'https':
+        cls = http.client.HTTPSConnection
+    elif u.scheme == 'http':
+        cls = http.client.HTTPConnection
+    else:
+        return False
+    conn = cls(u.netloc, timeout=MIRROR_PROBE_TIMEOUT)
+    try:
+        conn.request('HEAD', u.path or '/')
+        return conn.getresponse().status == 200
+    except:
+        return False
+    finally:
+        conn.close()
+
+
+class MirrorRanker(object):
+    '''
+    Probes all mirrors from get_mirrors() concurrently and ranks them by
+    estimated time to download a file (time-to-first-byte plus size /
+    throughput measured on a MIRROR_PROBE_BYTES range request)
+
+    Rankings are cached under get_cache_dir(MIRRORS_CACHE_SUBDIR) in
+    rankings.json for MIRROR_RANK_TTL seconds, for the same set of mirrors
+    Rankings are per mirror, not per file - a mirror from cached rankings
+    is used only if it has the file (HEAD), since mirrors may not have
+    synced a new release yet
+    '''
+    def __init__(self, show_exception=True):
+        self.show_exception = show_exception
+        self.mirrors = get_mirrors()
+        self.cache_dir = get_cache_dir(MIRRORS_CACHE_SUBDIR)
+
+    def __path(self):
+        return os.path.join(self.cache_dir, 'rankings.json')
+
+    def relative_path(self, url):
+        '''
+        url-->str
+        Returns-->str: path of url relative to any known mirror base
+            or None if url is not under any mirror
+        '''
+        for base in self.mirrors + [KERNEL_ORG_CDN_BASE]:
+            if url.startswith(base):
+                return url[len(base):]
+        return None
+
+    def cached(self):
+        '''
+        Returns-->LIST of MirrorProbe namedtuples or None if
+            not cached or stale
+        '''
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.__path(), 'r') as f:
+                d = json.load(f)
+            if sorted(d['mirrors']) != sorted(self.mirrors):
+                return None
+            if (time.time() - d['probed']) >= MIRROR_RANK_TTL:
+                return None
+            return [MirrorProbe(**x) for x in d['ranked']]
+        except:
+            return None
+
+    def probe(self, path):
+        '''
+        path-->str: path of file relative to mirror base
+        Returns-->LIST of MirrorProbe namedtuples - reachable mirrors
+            only, fastest first
+        '''
+        if not self.mirrors:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.mirrors)
+        ) as ex:
+            l = list(ex.map(lambda b: probe_mirror(b, path), self.mirrors))
+        ret = sorted([x for x in l if x is not None], key=lambda x: x.est_time)
+        if self.cache_dir and ret:
+            try:
+                write_file_atomic(self.__path(), json.dumps({
+                    'mirrors': self.mirrors,
+                    'probed': time.time(),
+                    'ranked': [x._asdict() for x in ret],
+                }, indent=1))
+            except:
+                if self.show_exception:
+                    sys.stderr.write(traceback.format_exc())
+        return ret
+
+    def fastest_url(self, url):
+        '''
+        url-->str: download URL (e.g. from releases.json)
+        Returns-->(str, LIST of MirrorProbe): URL on fastest reachable
+            mirror and rankings used. Returns (url, []) if url is not
+            under a mirror base or no mirror is reachable
+        '''
+        path = self.relative_path(url)
+        if path is None:
+            return (url, [])
+        ranked = self.cached()
+        if ranked:
+            for x in ranked:
+                if mirror_has_file(x.base + path):
+                    return (x.base + path, ranked)
+        # probe only ranks mirrors that have the file
+        ranked = self.probe(path)
+        if not ranked:
+            return (url, [])
+        return (ranked[0].base + path, ranked)
+
+
+def parse_releases_json(j, show_exception=True):
+    '''
+    j-->bytes or str: contents of KERNEL_ORG_JSON_URL
+    Returns-->LIST of KernelURL namedtuples
+        Does NOT include entry for KERNEL_VERSION override
+    '''
+    ret = []
+    if isinstance(j, bytes):
+        j = j.decode('utf8')
+    d = json.loads(j)
+    latest_version = d['latest_stable']['version']
+    latest_kurl = None
+    for rel in d['releases']:
+        # Ignore releases without 'moniker' set
+        ktype = rel.get('moniker', None)
+        if not ktype:
+            continue
+        # Ignore linux-next
+        if ktype == 'linux-next':
+            continue
+        # Ignore releases that don't have required fields
+        try:
+            kver = rel['version']
+            dl_url = rel['source']
+            sig_url = rel['pgp']
+        except:
+            if show_exception:
+                sys.stderr.write(traceback.format_exc())
+            continue
+
+        # changelog_url and release_date are optional
+        cl_url = rel.get('changelog', None)
+        try:
+            rel_date = rel['released']['isodate']
+        except:
+            rel_date = None
+
+        # Set ktype for latest kernel version
+        if kver == latest_version:
+            ktype = 'latest'
         kurl = KernelURL(
-            ktype='torvalds',
-            kver='unknown',
-            download_url='git://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux.git',   # noqa: E501
-            sig_url='',
-            changelog_url='',
-            release_date='from_git',
+            ktype=ktype,
+            kver=kver,
+            download_url=dl_url,
+            sig_url=sig_url,
+            changelog_url=cl_url,
+            release_date=rel_date,
         )
-        ret.append(kurl)
+        # Keep the latest one aside to insert as first element later
+        if ktype == 'latest':
+            latest_kurl = kurl
+        else:
+            ret.append(kurl)
+
+    # Add latest one as first element
+    if latest_kurl:
+        ret.insert(0, latest_kurl)
+
+    # Add linux-next and torvalds kernels
+    kurl = KernelURL(
+        ktype='linux-next',
+        kver='unknown',
+        download_url='git://git.kernel.org/pub/scm/linux/kernel/git/next/linux-next.git',   # noqa: E501
+        sig_url='',
+        changelog_url='',
+        release_date='from_git',
+    )
+    ret.append(kurl)
+    kurl = KernelURL(
+        ktype='torvalds',
+        kver='unknown',
+        download_url='git://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux.git',   # noqa: E501
+        sig_url='',
+        changelog_url='',
+        release_date='from_git',
+    )
+    ret.append(kurl)
+    return ret
+
+
+def normalize_kver(kver):
+    '''
+    kver-->str or None: e.g. KERNEL_VERSION
+    Returns-->str or None: If kver has 3 components AND LAST component
+        is '0', trailing '.0' is stripped (5.10.0 --> 5.10), since
+        kernel.org names x.y.0 releases x.y
+    '''
+    if kver:
+        comps = kver.split('.', 2)
+        if len(comps) > 2 and comps[2] == '0':
+            kver = '.'.join(comps[:2])
+    return kver
+
+
+def get_kernel_urls(show_exception=True):
+    '''
+    Returns-->LIST of KernelURL namedtuples
+    '''
+    ret = []
+    try:
+        # Copy - cached list must not include KERNEL_VERSION override
+        ret = list(ReleasesCache(show_exception=show_exception).get())
 
         # If KERNEL_VERSION is set and not present in kernel.org JSON,
         # add as separate entry pointing at specific download URL
-        override_kver = os.environ.get('KERNEL_VERSION', None)
+        # Static tarball from VersionIndex is preferred over git snapshot
+        override_kver = normalize_kver(os.environ.get('KERNEL_VERSION', None))
         if override_kver and not kernel_version_found(ret, override_kver):
+            kurl = VersionIndex(show_exception=show_exception).kernel_url(
+                override_kver)
+            if kurl is not None:
+                ret.append(kurl)
+                return ret
             fmt_stable = 'https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux.git/snapshot/linux-%s.tar.gz'   # noqa: E501
             u = fmt_stable % (override_kver,)
             ktype = 'unsupported'
@@ -152,9 +957,183 @@ def kernel_version_found(l, kver):
     return False
 
 
+KVER_PAT = re.compile(
+    '^(?P<NUMS>[0-9]+(\\.[0-9]+)*)(-rc(?P<RC>[0-9]+))?$'
+)
+
+
+def kver_tuple(kver):
+    '''
+    kver-->str: e.g. 5.10, 5.10.17, 5.12-rc8
+    Returns-->tuple of 5 ints or None if kver is not a release version
+        (major, minor, patch, is_release, rc)
+        Missing components are 0, so that 5.10 == 5.10.0
+        Release candidates sort BEFORE the release: 5.12-rc8 < 5.12
+    '''
+    m = re.match(KVER_PAT, kver or '')
+    if not m:
+        return None
+    nums = [int(x) for x in m.groupdict()['NUMS'].split('.')][:3]
+    nums += [0] * (3 - len(nums))
+    rc = m.groupdict()['RC']
+    if rc is None:
+        return tuple(nums + [1, 0])
+    return tuple(nums + [0, int(rc)])
+
+
+class KernelCatalog(object):
+    '''
+    Index of KernelURL namedtuples built ONCE from get_kernel_urls()
+    Version strings are parsed ONCE (kver_tuple). Indexed by:
+        kver                - exact version string
+        ktype               - latest|mainline|stable|longterm|...
+        (major, minor)      - series, e.g. (5, 10)
+    Each index holds positions in the original list (which is in
+    descending order of preference), and each ktype / series /
+    (series, ktype) - and the whole catalog - also has a list sorted by
+    version for newest / range queries
+    '''
+    def __init__(self, kernel_urls):
+        '''
+        kernel_urls-->LIST of KernelURL namedtuples - as returned by
+            get_kernel_urls()
+        '''
+        self.kernel_urls = list(kernel_urls)
+        self.vtuples = [kver_tuple(u.kver) for u in self.kernel_urls]
+        self.by_kver = {}
+        self.by_ktype = {}
+        self.by_series = {}
+        self.sorted_by_ktype = {}
+        self.sorted_by_series = {}
+        self.sorted_by_series_ktype = {}
+        self.sorted_all = []
+        # KernelURL --> first position
+        self.pos_by_kurl = {}
+        for (pos, u) in enumerate(self.kernel_urls):
+            vt = self.vtuples[pos]
+            self.pos_by_kurl.setdefault(u, pos)
+            self.by_kver.setdefault(u.kver, []).append(pos)
+            self.by_ktype.setdefault(u.ktype, []).append(pos)
+            if vt is None:
+                continue
+            if vt[3]:
+                # Only releases match a series in find()
+                self.by_series.setdefault(vt[:2], []).append(pos)
+            self.sorted_by_ktype.setdefault(u.ktype, []).append((vt, pos))
+            self.sorted_by_series.setdefault(vt[:2], []).append((vt, pos))
+            self.sorted_by_series_ktype.setdefault(
+                (vt[:2], u.ktype), []).append((vt, pos))
+            self.sorted_all.append((vt, pos))
+        for d in (
+            self.sorted_by_ktype, self.sorted_by_series,
+            self.sorted_by_series_ktype,
+        ):
+            for l in d.values():
+                l.sort()
+        self.sorted_all.sort()
+
+    def __len__(self):
+        return len(self.kernel_urls)
+
+    def __iter__(self):
+        return iter(self.kernel_urls)
+
+    def find(self, ktype=None, kver=None):
+        '''
+        ktype-->str or None: If None, any type of kernel is allowed
+        kver-->str or None: If str:
+            If kver has 2 components (e.g. 4.14), kernel versions in that
+                series match
+            Otherwise only kernel versions that match exactly match
+        Returns-->KernelURL namedtuple or None - first matching in
+            original order (latest, mainline, stable, longterm ...)
+        '''
+        if kver:
+            if len(kver.split('.')) == 2:
+                vt = kver_tuple(kver)
+                if vt is None:
+                    return None
+                candidates = self.by_series.get(vt[:2], [])
+            else:
+                candidates = self.by_kver.get(kver, [])
+            if ktype:
+                candidates = [
+                    p for p in candidates
+                    if self.kernel_urls[p].ktype == ktype
+                ]
+        elif ktype:
+            candidates = self.by_ktype.get(ktype, [])
+        else:
+            candidates = range(len(self.kernel_urls))
+        for p in candidates:
+            return self.kernel_urls[p]
+        return None
+
+    def newest(self, series=None, ktype=None):
+        '''
+        series-->str (e.g. 5.10) or tuple (5, 10) or None
+        ktype-->str or None
+        Returns-->KernelURL namedtuple or None: highest version in series
+            (and of ktype, if set). If series is None, highest version
+        '''
+        if series is None:
+            if ktype:
+                l = self.sorted_by_ktype.get(ktype, [])
+            else:
+                l = self.sorted_all
+        else:
+            if isinstance(series, str):
+                series = (kver_tuple(series) or (None, None))[:2]
+            if ktype:
+                l = self.sorted_by_series_ktype.get((tuple(series), ktype), [])
+            else:
+                l = self.sorted_by_series.get(tuple(series), [])
+        if not l:
+            return None
+        return self.kernel_urls[l[-1][1]]
+
+    def since(self, ktype, kver):
+        '''
+        ktype-->str
+        kver-->str: minimum version (inclusive) - e.g. 5.4
+        Returns-->LIST of KernelURL namedtuples of ktype with version
+            >= kver, in ascending order of version
+        '''
+        vt = kver_tuple(kver)
+        if vt is None:
+            return []
+        # Lowest possible tuple for that version - includes its rcs
+        lo = (vt[:3] + (0, 0), -1)
+        l = self.sorted_by_ktype.get(ktype, [])
+        l = l[bisect.bisect_left(l, lo):]
+        return [self.kernel_urls[p] for (_, p) in l]
+
+    def latest_per_series(self):
+        '''
+        Returns-->OrderedDict-like list of (series, KernelURL) tuples
+            series-->tuple (major, minor)
+            Newest version in each series, in descending order of series
+        '''
+        ret = []
+        for series in sorted(self.sorted_by_series.keys(), reverse=True):
+            ret.append((series, self.newest(series=series)))
+        return ret
+
+    def version_tuple(self, kurl):
+        '''
+        kurl-->KernelURL namedtuple in catalog
+        Returns-->tuple as returned by kver_tuple or None
+        '''
+        pos = self.pos_by_kurl.get(kurl, None)
+        if pos is None:
+            return kver_tuple(kurl.kver)
+        return self.vtuples[pos]
+
+
 def filter_kernel_urls(l, ktype=None, kver=None):
     '''
     l-->LIST of KernelURL namedtuples - as returned by get_kernel_urls()
+        or KernelCatalog
     ktype-->str or None
         If str, must be one of: latest|mainline|stable|longterm|linux-next
         If None, any type of kernel is allowed
@@ -172,35 +1151,13 @@ def filter_kernel_urls(l, ktype=None, kver=None):
         - stable
         - longterm (in order they appear)
     '''
-    ret = []
-    for u in l:
-        if ktype and u.ktype != ktype:
-            continue
-        if kver:
-            l_kver = kver.split('.')
-            l_u_kver = u.kver.split('.')
-            if len(l_kver) == 2:
-                if l_kver[:2] != l_u_kver[:2]:
-                    continue
-            else:
-                if kver != u.kver:
-                    continue
-        ret.append(u)
+    if not isinstance(l, KernelCatalog):
+        l = KernelCatalog(l)
+    ret = l.find(ktype=ktype, kver=kver)
     if ret:
-        return ret[0]
-    else:
-        # Look for ktype == 'unsupported' (older kernel not in JSON)
-        override_kver = os.environ.get('KERNEL_VERSION', None)
-        if override_kver:
-            for u in l:
-                if ktype != 'unsupported':
-                    continue
-                if u.kver == override_kver:
-                    ret.append(u)
-                    break
-            if ret:
-                return ret[0]
-            else:
-                return None
-
-        return None
+        return ret
+    # Look for ktype == 'unsupported' (older kernel not in JSON)
+    override_kver = normalize_kver(os.environ.get('KERNEL_VERSION', None))
+    if override_kver and ktype == 'unsupported':
+        return l.find(ktype='unsupported', kver=override_kver)
+    return None
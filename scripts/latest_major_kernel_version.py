@@ -11,11 +11,14 @@ Examples:
     5.0.0                           5.0
 '''
 
-from kernel_url import get_kernel_urls, filter_kernel_urls
+from kernel_url import get_kernel_urls, KernelCatalog
 
 
-l = get_kernel_urls()
-k = filter_kernel_urls(l, ktype='latest')
-ver_splits = k.kver.split('.')
-ret = '.'.join(ver_splits[:2])
+catalog = KernelCatalog(get_kernel_urls())
+k = catalog.find(ktype='latest')
+vt = catalog.version_tuple(k)
+if vt is None:
+    ret = '.'.join(k.kver.split('.')[:2])
+else:
+    ret = '%d.%d' % vt[:2]
 print(ret)
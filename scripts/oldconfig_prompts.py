@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+'''
+Answers 'make oldconfig' questions under pexpect as soon as they are
+asked - used by answer_questions in update_kernel_config.py and
+config_update.py
+
+    - Output is read in short polls - PROMPT_POLL_MIN seconds, doubling
+      up to PROMPT_POLL_MAX while nothing happens
+    - Questions matching question_pat or CHOICE_PAT are answered when
+      they match
+    - Prompts the patterns miss are answered with the default (blank line)
+      as soon as the child is seen blocked reading the tty
+      (/proc/<pid>/syscall, else /proc/<pid>/wchan) twice in a row with an
+      unterminated last output line. If /proc cannot tell, a last line
+      ending like a prompt (PROMPT_SUFFIX_PAT) that stays unchanged for
+      PROMPT_QUIET seconds is used instead
+    - Only when the state of the child is unknown AND no prompt is seen for
+      the stall timeout is a blank line sent blindly. The stall timeout is
+      PROMPT_STALL_FACTOR x slowest prompt seen so far, between
+      PROMPT_STALL_MIN and the maximum passed in. A child known to be busy
+      (not reading) is never sent blind answers
+    - Latency of each prompt (previous answer --> prompt detected) is kept
+      in PromptStats - histogram and slowest prompts are written with
+      debug callable
+'''
+import os
+import re
+import time
+import pexpect
+
+
+PROMPT_POLL_MIN = 0.01
+PROMPT_POLL_MAX = 0.1
+PROMPT_QUIET = 0.2
+PROMPT_STALL_MIN = 1.0
+PROMPT_STALL_FACTOR = 4
+PROMPT_SLOWEST = 20
+
+CHOICE_PAT = '^\s*choice.*$'
+PROMPT_SUFFIX_PAT = re.compile('(\]|\?|:|\(NEW\)) $')
+PROMPT_KEY_PAT = re.compile('\((?P<k>[A-Za-z0-9_]+)\) \[')
+
+# How a prompt was detected
+HOW_PATTERN = 'pattern'
+HOW_CHOICE = 'choice'
+HOW_BLOCKED = 'blocked'
+HOW_SUFFIX = 'suffix'
+HOW_TIMEOUT = 'timeout'
+HOW_ALL = [HOW_PATTERN, HOW_CHOICE, HOW_BLOCKED, HOW_SUFFIX, HOW_TIMEOUT]
+
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+HISTOGRAM_WIDTH = 40
+
+# read(2) syscall numbers by 'uname -m' - first field of /proc/<pid>/syscall
+READ_SYSCALLS = {
+    'x86_64': [0], 'i386': [3], 'i686': [3], 'armv7l': [3], 'armv6l': [3],
+    'aarch64': [63], 'riscv64': [63], 'loongarch64': [63],
+    'ppc64le': [3], 'ppc64': [3], 's390x': [3],
+}
+# /proc/<pid>/wchan of a process waiting in read on a tty
+TTY_READ_WCHANS = ['n_tty_read', 'wait_woken', 'tty_read']
+
+
+def session_pids(sid):
+    '''
+    sid-->int: session id - pexpect.spawn child is a session leader
+    Returns-->list of int: pids in session
+    '''
+    ret = []
+    try:
+        entries = os.listdir('/proc')
+    except:
+        return ret
+    for d in entries:
+        if not d.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % (d,), 'r') as f:
+                s = f.read()
+        except:
+            continue
+        # comm (field 2) may contain spaces and parentheses
+        fields = s[s.rfind(')') + 2:].split()
+        try:
+            if int(fields[3]) == sid:
+                ret.append(int(d))
+        except:
+            continue
+    return ret
+
+
+def reading_stdin(pid):
+    '''
+    pid-->int
+    Returns-->bool or None: True if pid is blocked reading fd 0, False if
+        it is not, None if /proc does not tell
+    '''
+    read_nrs = READ_SYSCALLS.get(os.uname().machine, None)
+    if read_nrs is not None:
+        try:
+            with open('/proc/%d/syscall' % (pid,), 'r') as f:
+                fields = f.read().split()
+            if fields and fields[0] == 'running':
+                return False
+            if len(fields) > 1 and fields[0].isdigit():
+                return int(fields[0]) in read_nrs and int(fields[1], 16) == 0
+        except:
+            pass
+    try:
+        with open('/proc/%d/wchan' % (pid,), 'r') as f:
+            wchan = f.read().strip()
+    except:
+        return None
+    if not wchan or wchan == '0':
+        return None
+    return wchan in TTY_READ_WCHANS
+
+
+def child_reading_stdin(sid):
+    '''
+    sid-->int: session id (pid of pexpect.spawn child)
+    Returns-->bool or None: True if any process in session is blocked
+        reading stdin, False if none is, None if /proc does not tell
+    '''
+    ret = False
+    for pid in session_pids(sid):
+        r = reading_stdin(pid)
+        if r:
+            return True
+        if r is None:
+            ret = None
+    return ret
+
+
+class PromptStats(object):
+    '''
+    Latency of each prompt - from previous answer (or start) until prompt
+    was detected
+    '''
+    def __init__(self):
+        # list of (latency_secs, key, how)
+        self.prompts = []
+
+    def add(self, latency, key, how):
+        self.prompts.append((latency, key, how))
+
+    def stall_timeout(self, max_timeout):
+        '''
+        max_timeout-->float: seconds
+        Returns-->float: seconds to wait before sending a blank line when
+            state of child is unknown
+        '''
+        seen = [x[0] for x in self.prompts if x[2] != HOW_TIMEOUT]
+        if not seen:
+            return max_timeout
+        return max(PROMPT_STALL_MIN, min(
+            max_timeout, PROMPT_STALL_FACTOR * max(seen)
+        ))
+
+    def histogram(self):
+        '''
+        Returns-->list of (label, count)
+        '''
+        counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for (latency, key, how) in self.prompts:
+            ms = latency * 1000
+            i = 0
+            while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+                i += 1
+            counts[i] += 1
+        labels = ['<= %d' % (x,) for x in LATENCY_BUCKETS_MS]
+        labels.append('> %d' % (LATENCY_BUCKETS_MS[-1],))
+        return list(zip(labels, counts))
+
+    def write(self, debug):
+        '''
+        debug-->callable: str-->None
+        Writes histogram and slowest prompts
+        '''
+        if not self.prompts:
+            return
+        total = sum([x[0] for x in self.prompts])
+        by_how = [
+            '%s %d' % (h, len([x for x in self.prompts if x[2] == h]))
+            for h in HOW_ALL
+        ]
+        debug('Prompt latency - %d prompts, %.1f secs waiting: %s' % (
+            len(self.prompts), total, ', '.join(by_how),
+        ))
+        hist = self.histogram()
+        most = max([c for (l, c) in hist])
+        for (label, count) in hist:
+            if not count:
+                continue
+            debug('    %-8s ms  %6d  %s' % (
+                label, count,
+                '#' * max(1, int(round(HISTOGRAM_WIDTH * count / most))),
+            ))
+        debug('Slowest prompts:')
+        for (latency, key, how) in sorted(
+            self.prompts, key=lambda x: x[0], reverse=True
+        )[:PROMPT_SLOWEST]:
+            debug('    %9.1f ms  %-54s  %s' % (latency * 1000, key, how))
+
+
+def answer_prompts(c, question_pat, answer, max_timeout, debug=None):
+    '''
+    c-->pexpect.spawn: running make oldconfig
+    question_pat-->str: regex for a question
+    answer-->callable: match (of question_pat)-->(key, ans)
+        key-->str: name recorded for the prompt
+        ans-->str: line to send ('' for default)
+    max_timeout-->float: max seconds before sending a blank line when
+        state of child is unknown
+    debug-->callable: str-->None - if set, PromptStats are written
+    Returns-->PromptStats
+    '''
+    stats = PromptStats()
+    patterns = [pexpect.EOF, pexpect.TIMEOUT, question_pat, CHOICE_PAT]
+    poll = PROMPT_POLL_MIN
+    t0 = time.time()
+    # Pending (unmatched) output and when it last changed
+    (pending, changed) = ('', t0)
+    # Child was seen blocked reading stdin with same pending output
+    blocked_seen = False
+
+    while True:
+        ind = c.expect(patterns, timeout=poll)
+        now = time.time()
+        if ind == 0:        # EOF
+            break
+        if ind == 2:        # question
+            (key, ans) = answer(c.match)
+            how = HOW_PATTERN
+        elif ind == 3:      # choice
+            (key, ans) = ('choice', '')
+            how = HOW_CHOICE
+        else:               # TIMEOUT - nothing matched yet
+            before = c.before or ''
+            if before != pending:
+                (pending, changed) = (before, now)
+                blocked_seen = False
+            # Text after last newline - prompts do not end with newline.
+            # Echo of the previous answer does
+            tail = pending.rsplit('\n', 1)[-1]
+            how = None
+            if tail.strip():
+                blocked = child_reading_stdin(c.pid)
+                if blocked:
+                    if blocked_seen:
+                        how = HOW_BLOCKED
+                    else:
+                        # Read once more - output may not be read yet
+                        blocked_seen = True
+                        poll = 0
+                        continue
+                elif blocked is None:
+                    if re.search(PROMPT_SUFFIX_PAT, tail) and \
+                            now - changed >= PROMPT_QUIET:
+                        how = HOW_SUFFIX
+                    elif now - t0 >= stats.stall_timeout(max_timeout):
+                        how = HOW_TIMEOUT
+            elif now - t0 >= stats.stall_timeout(max_timeout) and \
+                    child_reading_stdin(c.pid) is None:
+                how = HOW_TIMEOUT
+            if how is None:
+                poll = min(max(poll * 2, PROMPT_POLL_MIN), PROMPT_POLL_MAX)
+                continue
+            m = re.search(PROMPT_KEY_PAT, tail)
+            key = m and m.group('k') or tail.strip()[-54:] or '(none)'
+            ans = ''
+        c.sendline(ans)
+        stats.add(now - t0, key, how)
+        t0 = time.time()
+        (pending, changed) = ('', t0)
+        blocked_seen = False
+        poll = PROMPT_POLL_MIN
+
+    if debug is not None:
+        stats.write(debug)
+    return stats
@@ -9,20 +9,38 @@ PROG_DIR=${PROG_DIR:-$(dirname ${PROG_PATH})}
 PROG_NAME=${PROG_NAME:-$(basename ${PROG_PATH})}
 SCRIPT_DIR="${PROG_DIR}"
 
+# Required packages are checked by get_kernel_source_overlapped or
+# build_pipeline_dag if KERNEL_BUILD_PIPELINE=overlap or dag - not exported
+KB_DEFER_REQD_PKGS_CHECK=yes
+# Only the build entry point resolves the kernel and writes the build
+# manifest (load_build_manifest) - not exported
+KB_MANIFEST_WRITE=yes
 . ${SCRIPT_DIR}/build_kernel_functions.sh || exit 1
 
 create_dirs || exit 1
-# Need 3 GB
-check_avail_disk_space 3000000000 $KB_TOP_DIR || exit 1
 
-can_build_metapackage_first
-if [ $? -eq 0 ]; then
-    build_metapackages || exit 1
-    get_kernel_source || exit 1
+if [ "$KERNEL_BUILD_PIPELINE" = "dag" ]; then
+    # Need 3 GB
+    build_pipeline_dag 3000000000
+    exit $?
+fi
+
+if [ "$KERNEL_BUILD_PIPELINE" = "overlap" ]; then
+    # Need 3 GB
+    get_kernel_source_overlapped 3000000000 || exit 1
 else
-    get_kernel_source || exit 1
-    KERN_VER=$(kernel_version $BUILD_DIR) || exit 1
-    build_metapackages || exit 1
+    # Need 3 GB
+    check_avail_disk_space 3000000000 $KB_TOP_DIR || exit 1
+
+    can_build_metapackage_first
+    if [ $? -eq 0 ]; then
+        build_metapackages || exit 1
+        get_kernel_source || exit 1
+    else
+        get_kernel_source || exit 1
+        KERN_VER=$(kernel_version $BUILD_DIR) || exit 1
+        build_metapackages || exit 1
+    fi
 fi
 
 apply_patches || exit 1
@@ -73,6 +73,11 @@ class Singleton(with_metaclass(SingletonMeta)):
 # ---------- End of Singleton-related ------------------------------------
 
 
+# Persistent cache shared by all scripts - can be overridden by
+# KERNEL_CACHE_DIR environment variable
+DEFAULT_CACHE_DIR = '~/.cache/kernel_build'
+
+
 PathNT = namedtuple('PathNT', [
     'exists', 'isfile', 'isdir', 'islink',
     'dir_exists', 'realpath', 'realpath_dir', 'normpath'
@@ -163,6 +168,47 @@ def path_2_nt(p, expanduser=True, expandvars=False):
     )
 
 
+def get_cache_dir(subdir=None, create=True):
+    '''
+    subdir-->str or None: sub-directory under cache dir
+    create-->bool: If True, directory is created if it does not exist
+    Returns-->str: absolute path of directory or None if create is True
+        and directory could not be created
+    Cache dir is KERNEL_CACHE_DIR if set, DEFAULT_CACHE_DIR otherwise
+    '''
+    d = os.environ.get('KERNEL_CACHE_DIR', None) or DEFAULT_CACHE_DIR
+    d = os.path.realpath(os.path.expanduser(d))
+    if subdir:
+        d = os.path.join(d, subdir)
+    if create:
+        try:
+            os.makedirs(d, exist_ok=True)
+        except:
+            return None
+    return d
+
+
+def write_file_atomic(f, s, encoding=DEFAULT_ENCODING):
+    '''
+    f-->str: file path
+    s-->str or bytes
+    encoding-->str: used only if s is str
+    Writes to a temporary file in same dir and renames it to f, so that
+    readers never see a partially written file
+    Raises exception on failure
+    '''
+    if isinstance(s, str):
+        s = s.encode(encoding)
+    tmp = '%s.%d.tmp' % (f, os.getpid())
+    try:
+        with open(tmp, 'wb') as fd:
+            fd.write(s)
+        os.replace(tmp, f)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
 def file_contents(f, encoding=None, debug=sys.stderr.write):
     '''
     f-->str: file path
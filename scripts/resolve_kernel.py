@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+'''
+Usage:
+    resolve_kernel.py resolve <manifest>
+        Chooses kernel (same logic as show_chosen_kernel.py), writes JSON
+        build manifest and prints shell variable assignments
+    resolve_kernel.py vars <manifest>
+        Prints shell variable assignments from existing manifest
+    resolve_kernel.py show <manifest>
+        Shows available kernels and chosen kernel from existing manifest
+
+Shell variables printed (for eval):
+    MANIFEST_KERN_VER           - version used for kernel and metapackages
+    MANIFEST_KTYPE
+    MANIFEST_URL                - download URL on fastest mirror
+    MANIFEST_ORIGIN_URL         - download URL before mirror selection
+    MANIFEST_SIG_URL
+    MANIFEST_SHA256             - from kernel.org sha256sums.asc (if known)
+    MANIFEST_CONFIG_VERSION
+    MANIFEST_MIRROR
+
+Following environment variables can be set to override default logic:
+    KERNEL_CONFIG, KERNEL_VERSION, KERNEL_TYPE
+    See show_chosen_kernel.py
+    KERNEL_MIRRORS: space-separated mirror base URLs, or none
+
+Exits with non-zero return code if no kernel could be chosen or
+manifest could not be read
+'''
+import sys
+import shlex
+from choose_kernel import resolve, read_manifest, show_manifest
+
+
+SHELL_VARS = [
+    ('MANIFEST_KERN_VER', 'kern_ver'),
+    ('MANIFEST_KTYPE', 'ktype'),
+    ('MANIFEST_URL', 'download_url'),
+    ('MANIFEST_ORIGIN_URL', 'origin_url'),
+    ('MANIFEST_SIG_URL', 'sig_url'),
+    ('MANIFEST_SHA256', 'sha256'),
+    ('MANIFEST_CONFIG_VERSION', 'config_version'),
+    ('MANIFEST_MIRROR', 'mirror'),
+]
+
+
+def print_shell_vars(d):
+    '''
+    d-->dict: build manifest
+    '''
+    for (var, key) in SHELL_VARS:
+        print('%s=%s' % (var, shlex.quote(str(d.get(key, None) or ''))))
+
+
+if len(sys.argv) != 3 or sys.argv[1] not in ['resolve', 'vars', 'show']:
+    sys.stderr.write(__doc__)
+    exit(1)
+
+(cmd, manifest) = sys.argv[1:3]
+try:
+    if cmd == 'resolve':
+        d = resolve(manifest)
+        if not d:
+            sys.stderr.write('No available kernels based on settings\n')
+            exit(1)
+    else:
+        d = read_manifest(manifest)
+except Exception as e:
+    sys.stderr.write('%s %s: %s\n' % (cmd, manifest, str(e)))
+    exit(1)
+
+if cmd == 'show':
+    show_manifest(d)
+else:
+    print_shell_vars(d)
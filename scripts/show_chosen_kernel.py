@@ -26,17 +26,12 @@ Default logic:
         Can override (filter) with KERNEL_TYPE
 '''
 
-from choose_kernel import get_chosen_kernel_url
+from kernel_url import get_kernel_urls, KernelCatalog
+from choose_kernel import get_chosen_kernel_url, chosen_kernel_version
 
-kurl = get_chosen_kernel_url(verbose=False)
+catalog = KernelCatalog(get_kernel_urls())
+kurl = get_chosen_kernel_url(verbose=False, catalog=catalog)
 if kurl:
-    # .0 versions show up on kernel.org JSON API without .0 subversion
-    # This breaks matapackage --> kernel package dependency - since
-    # we use show_chosen_url.py to create metapackages BEFORE
-    # downloading kernel
-    kver = kurl.kver
-    if len(kver.split('.')) < 3:
-        kver += '.0'
-    print(kver)
+    print(chosen_kernel_version(kurl, catalog=catalog))
 else:
     exit(1)
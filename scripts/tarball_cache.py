@@ -0,0 +1,766 @@
+#!/usr/bin/env python3
+'''
+Usage:
+    tarball_cache.py fetch <url> [<alias_url> ...]
+        Downloads url into cache unless already cached and prints path
+        of cached file. alias_url(s) are recorded as names for the same
+        file - e.g. kernel.org URL of a tarball downloaded from a mirror
+    tarball_cache.py path <url>
+        Prints path of cached file. Exits with return code 1 if url is
+        not cached - makes no network requests
+    tarball_cache.py stream <url> [<alias_url> ...]
+        Same as fetch, but writes file contents to stdout (in order) as
+        they are downloaded - e.g. to pipe into tar, so that extraction
+        overlaps the download
+    tarball_cache.py evict <url>
+        Removes cached file of url and every URL recorded for it
+
+    fetch, path and stream accept --sha256 <hex digest> (after command):
+        path    : cached file with a different sha256 is evicted and
+                  exit code is 1
+        fetch   : download with a different sha256 is discarded and
+        stream    exit code is 1. Since stream computes sha256 while
+                  streaming, the consumer has to check the exit code
+    tarball_cache.py incremental [--sigs] <url>
+        url is a stable kernel tarball (e.g. .../v5.x/linux-5.10.18.tar.xz)
+        that is NOT cached. Finds the nearest older cached tarball in
+        the same series (e.g. 5.10.17), fetches the kernel.org patches
+        that update it to url (incr/patch-5.10.17-18.xz) and prints:
+            <base_url> <base_path>
+            <patch_url> <patch_path>    (one line per patch, in order)
+        With --sigs, kernel.org signatures (.sign - over UNCOMPRESSED
+        file) of base tarball and each patch are also fetched and their
+        path is printed as a third column
+        Exits with return code 1 if there is no such plan
+
+Persistent, content-addressed download cache - under KERNEL_CACHE_DIR
+(default ~/.cache/kernel_build), NOT under KERNEL_BUILD_DIR:
+    tarballs/blobs/<sha256>         - file contents, named by sha256
+    tarballs/urls/<key>.json        - url, sha256, size, fetch time
+    tarballs/partial/<key>.part     - incomplete download (resumable)
+    tarballs/locks/<key>.lock       - one download of a URL at a time
+    key is sha256 of URL
+
+    - Downloads are atomic - a blob appears only after it is complete
+      (rename)
+    - Interrupted downloads are resumed with a Range request
+      (If-Range protects against a changed file on the server)
+    - Concurrent fetches of the same URL (e.g. two builds) wait for
+      each other (flock) instead of downloading twice
+    - The same contents downloaded from different mirrors are kept once
+    - If the server supports Range requests, the file is downloaded
+      in KERNEL_DOWNLOAD_SEGMENTS (default 4) segments over parallel
+      connections. Segments are reassembled in order and resumed
+      individually. Throughput of each segment is appended to
+      START_END_TIME_FILEPATH (if set)
+'''
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import threading
+import traceback
+from pyutils import get_cache_dir, write_file_atomic
+from kernel_url import HttpClient
+
+
+TARBALL_CACHE_SUBDIR = 'tarballs'
+CHUNK_SIZE = 1024 * 1024
+# Attempts (resuming each time) before giving up on a download
+FETCH_ATTEMPTS = 5
+# Parallel connections for one download - can be overridden by
+# KERNEL_DOWNLOAD_SEGMENTS environment variable. 1 disables segmenting
+DOWNLOAD_SEGMENTS = 4
+# Segments are never smaller than this
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+# Incremental update is used only if it needs at most these many patches
+INCR_MAX_PATCHES = 20
+CONTENT_RANGE_PAT = re.compile(
+    '^bytes\\s+(?P<START>[0-9]+)-[0-9]+/(?P<TOTAL>[0-9]+|\\*)$'
+)
+STABLE_TARBALL_PAT = re.compile(
+    '^(?P<DIR>.*/)linux-(?P<MAJOR>[0-9]+)\\.(?P<MINOR>[0-9]+)'
+    '(\\.(?P<PATCH>[0-9]+))?\\.tar\\.(xz|gz|bz2)$'
+)
+COMPRESSED_SUFFIX_PAT = re.compile('\\.(xz|gz|bz2)$')
+
+
+class HttpStatusError(ValueError):
+    '''Unexpected HTTP status - retrying will not help'''
+    pass
+
+
+def url_key(url):
+    '''
+    url-->str
+    Returns-->str: sha256 hex digest of url
+    '''
+    return hashlib.sha256(url.encode('utf8')).hexdigest()
+
+
+def num_segments():
+    '''
+    Returns-->int: KERNEL_DOWNLOAD_SEGMENTS or DOWNLOAD_SEGMENTS
+    '''
+    try:
+        n = int(os.environ.get('KERNEL_DOWNLOAD_SEGMENTS', DOWNLOAD_SEGMENTS))
+    except:
+        n = DOWNLOAD_SEGMENTS
+    return max(n, 1)
+
+
+def show_timing_msg(msg):
+    '''
+    msg-->str
+    Appends msg to START_END_TIME_FILEPATH if set, else writes to stderr
+    '''
+    f = os.environ.get('START_END_TIME_FILEPATH', None)
+    try:
+        if f:
+            with open(f, 'a') as fd:
+                fd.write(msg + '\n')
+            return
+    except:
+        pass
+    sys.stderr.write(msg + '\n')
+
+
+def copy_out(f, out, h=None):
+    '''
+    f-->str: path
+    out-->file-like object (binary) or None
+    h-->hashlib object or None: updated with contents of f
+    '''
+    with open(f, 'rb') as fd:
+        while True:
+            b = fd.read(CHUNK_SIZE)
+            if not b:
+                break
+            if h is not None:
+                h.update(b)
+            if out is not None:
+                out.write(b)
+    if out is not None:
+        out.flush()
+
+
+class Segment(object):
+    '''
+    Byte range [start, end) of a file - done bytes from start are on disk
+    '''
+    def __init__(self, start, end, done=0):
+        self.start = start
+        self.end = end
+        self.done = done
+        self.error = None
+        self.nbytes = 0         # bytes downloaded in this run
+        self.elapsed = 0.0      # seconds spent downloading in this run
+
+    def pos(self):
+        return self.start + self.done
+
+    def complete(self):
+        return self.pos() >= self.end
+
+
+class SegmentedDownload(object):
+    '''
+    Downloads url into part (preallocated to size) with one Range request
+    per segment, over parallel connections. The caller's thread reads
+    completed bytes back in order, so that the file can be streamed
+    (e.g. to tar) while later segments are still downloading, and sha256
+    is computed on the way
+
+    Progress of each segment is kept in <part>.json, so that an
+    interrupted download resumes each segment where it stopped
+    '''
+    def __init__(self, url, part, size, validator, nsegs, out=None):
+        '''
+        url-->str
+        part-->str: path of partial file
+        size-->int: size of file (Content-Length)
+        validator-->str or None: ETag or Last-Modified - used in If-Range
+        nsegs-->int: number of segments (parallel connections)
+        out-->file-like object (binary) or None
+        '''
+        self.url = url
+        self.part = part
+        self.size = size
+        self.validator = validator
+        self.nsegs = nsegs
+        self.out = out
+        self.cond = threading.Condition()
+        # Set when run() gives up - segment threads stop writing
+        self.stop = threading.Event()
+        self.segments = self.__load_or_split()
+        self.fd = None
+
+    def __meta_path(self):
+        return self.part + '.json'
+
+    def __load_or_split(self):
+        '''
+        Returns-->LIST of Segment
+        '''
+        try:
+            with open(self.__meta_path(), 'r') as f:
+                meta = json.load(f)
+            if (
+                os.path.isfile(self.part) and
+                meta.get('validator', None) == self.validator and
+                meta.get('size', None) == self.size and
+                meta.get('segments', None)
+            ):
+                return [Segment(*x) for x in meta['segments']]
+        except:
+            pass
+        seg_size = max(-(-self.size // self.nsegs), MIN_SEGMENT_SIZE)
+        return [
+            Segment(x, min(x + seg_size, self.size))
+            for x in range(0, self.size, seg_size)
+        ]
+
+    def save(self):
+        '''Saves progress of segments in <part>.json'''
+        # Held while writing - threads share the temporary file name
+        with self.cond:
+            segs = [[x.start, x.end, x.done] for x in self.segments]
+            try:
+                write_file_atomic(self.__meta_path(), json.dumps({
+                    'validator': self.validator,
+                    'size': self.size,
+                    'segments': segs,
+                }))
+            except:
+                pass
+
+    def __download_segment(self, seg):
+        '''
+        Runs in its own thread - sets seg.error on failure
+        Returns when seg is complete or self.stop is set
+        '''
+        t0 = time.time()
+        attempt = 0
+        while not seg.complete() and not self.stop.is_set():
+            try:
+                headers = {'Range': 'bytes=%d-%d' % (seg.pos(), seg.end - 1)}
+                if self.validator:
+                    headers['If-Range'] = self.validator
+                (resp, _) = HttpClient().open(self.url, headers=headers)
+                try:
+                    if resp.status != 206:
+                        raise ValueError('%s: HTTP status %d for range' % (
+                            self.url, resp.status))
+                    while not seg.complete():
+                        if self.stop.is_set():
+                            break
+                        b = resp.read(min(CHUNK_SIZE, seg.end - seg.pos()))
+                        if not b:
+                            raise ValueError('%s: short read' % (self.url,))
+                        os.pwrite(self.fd, b, seg.pos())
+                        with self.cond:
+                            seg.done += len(b)
+                            seg.nbytes += len(b)
+                            self.cond.notify_all()
+                finally:
+                    resp.close()
+            except Exception as e:
+                attempt += 1
+                if attempt >= FETCH_ATTEMPTS:
+                    with self.cond:
+                        seg.error = e
+                        self.cond.notify_all()
+                    break
+                self.stop.wait(1)
+        seg.elapsed = time.time() - t0
+        self.save()
+
+    def run(self):
+        '''
+        Returns-->str: sha256 hex digest of complete file
+        Raises exception if any segment fails
+        '''
+        self.fd = os.open(self.part, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self.fd, self.size)
+        self.save()
+        threads = []
+        for seg in self.segments:
+            if seg.complete():
+                continue
+            t = threading.Thread(target=self.__download_segment, args=(seg,))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        h = hashlib.sha256()
+        pos = 0
+        try:
+            for seg in self.segments:
+                while pos < seg.end:
+                    with self.cond:
+                        while seg.pos() <= pos and seg.error is None:
+                            self.cond.wait()
+                        if seg.pos() <= pos:
+                            raise seg.error
+                        avail = seg.pos()
+                    while pos < avail:
+                        b = os.pread(
+                            self.fd, min(CHUNK_SIZE, avail - pos), pos)
+                        h.update(b)
+                        if self.out is not None:
+                            self.out.write(b)
+                        pos += len(b)
+            if self.out is not None:
+                self.out.flush()
+        finally:
+            # Threads must not write to fd after it is closed
+            self.stop.set()
+            for t in threads:
+                t.join()
+            self.save()
+            os.close(self.fd)
+        self.report()
+        return h.hexdigest()
+
+    def report(self):
+        '''Appends throughput of each segment to timing file'''
+        n = len(self.segments)
+        total = 0
+        elapsed = 0.0
+        for (i, seg) in enumerate(self.segments):
+            if not seg.nbytes:
+                continue
+            total += seg.nbytes
+            elapsed = max(elapsed, seg.elapsed)
+            show_timing_msg('%-39s: %8.2f MB/s (%d bytes in %.1fs)' % (
+                'Download segment %d/%d' % (i + 1, n),
+                seg.nbytes / max(seg.elapsed, 1e-6) / 1e6,
+                seg.nbytes, seg.elapsed,
+            ))
+        if total:
+            show_timing_msg('%-39s: %8.2f MB/s (%d bytes in %.1fs)' % (
+                'Download total (%d segments)' % (n,),
+                total / max(elapsed, 1e-6) / 1e6, total, elapsed,
+            ))
+
+
+class TarballCache(object):
+    '''
+    See module docstring for layout
+    '''
+    def __init__(self):
+        self.cache_dir = get_cache_dir(TARBALL_CACHE_SUBDIR)
+        if not self.cache_dir:
+            raise ValueError('Could not create cache directory')
+        for d in ['blobs', 'urls', 'partial', 'locks']:
+            os.makedirs(os.path.join(self.cache_dir, d), exist_ok=True)
+
+    def __path(self, d, f):
+        return os.path.join(self.cache_dir, d, f)
+
+    def blob_path(self, sha256):
+        '''
+        sha256-->str: hex digest
+        Returns-->str: path of blob (may not exist)
+        '''
+        return self.__path('blobs', sha256)
+
+    def __read_url_meta(self, url):
+        '''
+        Returns-->dict or None
+        '''
+        try:
+            with open(self.__path('urls', url_key(url) + '.json'), 'r') as f:
+                return json.load(f)
+        except:
+            return None
+
+    def record(self, url, sha256, size):
+        '''
+        url-->str
+        sha256-->str: hex digest of blob
+        size-->int
+        Records url as a name for blob sha256
+        '''
+        write_file_atomic(
+            self.__path('urls', url_key(url) + '.json'),
+            json.dumps({
+                'url': url,
+                'sha256': sha256,
+                'size': size,
+                'fetched': time.time(),
+            }, indent=1)
+        )
+
+    def cached_urls(self):
+        '''
+        Returns-->LIST of (str, str): (url, path of blob) for every url
+            whose blob is in the cache
+        '''
+        ret = []
+        d = os.path.join(self.cache_dir, 'urls')
+        for f in sorted(os.listdir(d)):
+            if not f.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(d, f), 'r') as fd:
+                    meta = json.load(fd)
+                p = self.blob_path(meta['sha256'])
+                if os.path.isfile(p):
+                    ret.append((meta['url'], p))
+            except:
+                continue
+        return ret
+
+    def evict(self, url):
+        '''
+        url-->str
+        Removes blob of url and records of all URLs pointing at it
+        Returns-->bool: True if anything was removed
+        '''
+        meta = self.__read_url_meta(url)
+        if not meta:
+            return False
+        digest = meta.get('sha256', None)
+        d = os.path.join(self.cache_dir, 'urls')
+        for f in os.listdir(d):
+            try:
+                with open(os.path.join(d, f), 'r') as fd:
+                    if json.load(fd).get('sha256', None) != digest:
+                        continue
+                os.remove(os.path.join(d, f))
+            except:
+                continue
+        try:
+            os.remove(self.blob_path(digest))
+        except:
+            pass
+        return True
+
+    def lookup(self, url, sha256=None):
+        '''
+        url-->str
+        sha256-->str or None: expected hex digest - if set and a blob with
+            that digest exists, it is returned even if url was never
+            fetched
+        Returns-->str (path of blob) or None
+        Makes no network requests
+        '''
+        if sha256 and os.path.isfile(self.blob_path(sha256)):
+            return self.blob_path(sha256)
+        meta = self.__read_url_meta(url)
+        if not meta:
+            return None
+        if sha256 and meta.get('sha256', None) != sha256:
+            return None
+        p = self.blob_path(meta['sha256'])
+        if os.path.isfile(p):
+            return p
+        return None
+
+    def __download(self, url, part):
+        '''
+        url-->str
+        part-->str: path of partial file - appended to if it exists
+        Returns-->None
+        Raises exception on failure - part is left in place to resume
+            HttpStatusError if retrying will not help
+        '''
+        part_meta_path = part + '.json'
+        headers = {}
+        offset = 0
+        if os.path.isfile(part):
+            offset = os.path.getsize(part)
+            try:
+                with open(part_meta_path, 'r') as f:
+                    meta = json.load(f)
+                # Preallocated file of a SegmentedDownload cannot be resumed
+                # from its end
+                validator = None
+                total = None
+                if not meta.get('segments', None):
+                    validator = meta.get('validator', None)
+                    total = meta.get('size', None)
+            except:
+                (validator, total) = (None, None)
+            if offset and validator and total is not None:
+                if offset == total:
+                    # Complete - interrupted before it became a blob
+                    return
+                if offset > total:
+                    offset = 0
+            if offset and validator:
+                headers['Range'] = 'bytes=%d-' % (offset,)
+                headers['If-Range'] = validator
+            else:
+                offset = 0
+        (resp, _) = HttpClient().open(url, headers=headers)
+        try:
+            if resp.status == 416 and offset:
+                # Range starts at or beyond end of file - start over
+                self.__remove_part(part)
+                return self.__download(url, part)
+            if resp.status == 200:
+                offset = 0
+                total = resp.getheader('Content-Length', None)
+                total = int(total) if total is not None else None
+            elif resp.status == 206:
+                m = re.match(
+                    CONTENT_RANGE_PAT,
+                    resp.getheader('Content-Range', '').strip())
+                if not m or int(m.group('START')) != offset:
+                    raise ValueError('%s: unexpected Content-Range: %s' % (
+                        url, resp.getheader('Content-Range', None)))
+                total = m.group('TOTAL')
+                total = int(total) if total != '*' else None
+            else:
+                raise HttpStatusError('%s: HTTP status %d' % (
+                    url, resp.status))
+            validator = (
+                resp.getheader('ETag', None) or
+                resp.getheader('Last-Modified', None)
+            )
+            write_file_atomic(part_meta_path, json.dumps({
+                'validator': validator,
+                'size': total,
+            }))
+            with open(part, 'r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                pos = offset
+                while True:
+                    b = resp.read(CHUNK_SIZE)
+                    if not b:
+                        break
+                    f.write(b)
+                    pos += len(b)
+            if total is not None and pos < total:
+                raise ValueError('%s: short read (%d of %d bytes)' % (
+                    url, pos, total))
+        finally:
+            resp.close()
+
+    def __remove_part(self, part):
+        '''
+        part-->str: path of partial file
+        Removes part and its <part>.json
+        '''
+        for f in [part, part + '.json']:
+            try:
+                os.remove(f)
+            except:
+                pass
+
+    def fetch(self, url, aliases=None, sha256=None, out=None):
+        '''
+        url-->str
+        aliases-->LIST of str or None: other URLs for the same file
+        sha256-->str or None: expected hex digest
+        out-->file-like object (binary) or None: If set, file contents
+            are written to out - as they are downloaded, if not cached
+        Returns-->str: path of blob
+        Raises exception if download fails or sha256 does not match
+        '''
+        aliases = [u for u in (aliases or []) if u and u != url]
+        p = self.lookup(url, sha256=sha256)
+        if p is None:
+            for u in aliases:
+                p = self.lookup(u, sha256=sha256)
+                if p:
+                    break
+        if p is None:
+            key = url_key(url)
+            part = self.__path('partial', key + '.part')
+            with open(self.__path('locks', key + '.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                # Another process may have completed it while we waited
+                p = self.lookup(url, sha256=sha256)
+                if p is None:
+                    p = self.__fetch_locked(url, part, sha256, out=out)
+                    out = None
+        if out is not None:
+            copy_out(p, out)
+        blob_sha256 = os.path.basename(p)
+        size = os.path.getsize(p)
+        for u in [url] + aliases:
+            self.record(u, blob_sha256, size)
+        return p
+
+    def __probe(self, url):
+        '''
+        url-->str
+        Returns-->(int, str): size and validator (ETag or Last-Modified)
+            size is None if server does not support Range requests or
+            does not send Content-Length
+        '''
+        try:
+            r = HttpClient().request(url, 'HEAD')
+            if r.status != 200:
+                return (None, None)
+            validator = (
+                r.headers.get('etag', None) or
+                r.headers.get('last-modified', None)
+            )
+            if r.headers.get('accept-ranges', '').lower() != 'bytes':
+                return (None, validator)
+            return (int(r.headers['content-length']), validator)
+        except:
+            return (None, None)
+
+    def __fetch_locked(self, url, part, sha256, out=None):
+        '''
+        Called with lock for url held
+        out-->file-like object (binary) or None
+        Returns-->str: path of blob
+        '''
+        (size, validator) = self.__probe(url)
+        if size:
+            digest = SegmentedDownload(
+                url, part, size, validator, num_segments(), out=out).run()
+        else:
+            attempt = 0
+            while True:
+                try:
+                    self.__download(url, part)
+                    break
+                except HttpStatusError:
+                    raise
+                except:
+                    attempt += 1
+                    if attempt >= FETCH_ATTEMPTS:
+                        raise
+                    sys.stderr.write(
+                        'Download interrupted - resuming: %s\n' % (url,))
+            h = hashlib.sha256()
+            copy_out(part, out, h)
+            digest = h.hexdigest()
+        try:
+            os.remove(part + '.json')
+        except:
+            pass
+        if sha256 and digest != sha256:
+            os.remove(part)
+            raise ValueError('%s: sha256 mismatch: expected %s got %s' % (
+                url, sha256, digest))
+        blob = self.blob_path(digest)
+        os.replace(part, blob)
+        return blob
+
+
+def sig_url(url):
+    '''
+    url-->str: URL of compressed file on kernel.org (or mirror)
+    Returns-->str: URL of kernel.org signature of uncompressed file -
+        e.g. linux-5.10.tar.xz --> linux-5.10.tar.sign
+    '''
+    return re.sub(COMPRESSED_SUFFIX_PAT, '.sign', url)
+
+
+def incremental_plan(cache, url, sigs=False):
+    '''
+    cache-->TarballCache
+    url-->str: URL of stable kernel tarball - e.g.
+        https://cdn.kernel.org/pub/linux/kernel/v5.x/linux-5.10.18.tar.xz
+    sigs-->bool: If True, signature (sig_url) of each element is fetched
+        into cache and its path is appended to the tuple
+    Returns-->LIST of (str, str) - (url, path) - or None
+        (url, path, sig_path) if sigs is True
+        First element is cached base tarball, rest are patches (fetched
+        into cache) to apply in order, with patch -p1
+    Patches are fetched from the same directory as url (same mirror):
+        patch-5.10.1.xz         : 5.10 --> 5.10.1
+        incr/patch-5.10.17-18.xz: 5.10.17 --> 5.10.18
+    '''
+    m = re.match(STABLE_TARBALL_PAT, url)
+    if not m or cache.lookup(url):
+        return None
+    target = int(m.groupdict()['PATCH'] or 0)
+    series = (m.groupdict()['MAJOR'], m.groupdict()['MINOR'])
+    # Nearest older cached version of same series
+    base = None
+    for (u, p) in cache.cached_urls():
+        bm = re.match(STABLE_TARBALL_PAT, u)
+        if not bm:
+            continue
+        if (bm.groupdict()['MAJOR'], bm.groupdict()['MINOR']) != series:
+            continue
+        n = int(bm.groupdict()['PATCH'] or 0)
+        if n >= target or (base is not None and n <= base[0]):
+            continue
+        base = (n, u, p)
+    if base is None or (target - base[0]) > INCR_MAX_PATCHES:
+        return None
+
+    d = m.groupdict()['DIR']
+    sver = '%s.%s' % series
+    patch_urls = []
+    n = base[0]
+    if n == 0:
+        patch_urls.append('%spatch-%s.1.xz' % (d, sver))
+        n = 1
+    while n < target:
+        patch_urls.append('%sincr/patch-%s.%d-%d.xz' % (d, sver, n, n + 1))
+        n += 1
+    ret = [(base[1], base[2])]
+    for u in patch_urls:
+        ret.append((u, cache.fetch(u)))
+    if sigs:
+        ret = [x + (cache.fetch(sig_url(x[0])),) for x in ret]
+    return ret
+
+
+def main():
+    args = sys.argv[1:]
+    sha256 = None
+    if '--sha256' in args:
+        i = args.index('--sha256')
+        sha256 = (args[i + 1:i + 2] or [''])[0].lower() or None
+        del args[i:i + 2]
+    sigs = '--sigs' in args
+    if sigs:
+        args.remove('--sigs')
+    if len(args) < 2 or args[0] not in [
+        'fetch', 'path', 'stream', 'incremental', 'evict'
+    ]:
+        sys.stderr.write(__doc__)
+        exit(1)
+    cmd = args[0]
+    url = args[1]
+    try:
+        cache = TarballCache()
+        if cmd == 'path':
+            p = cache.lookup(url)
+            if p and sha256 and os.path.basename(p) != sha256:
+                sys.stderr.write(
+                    'Evicting cached %s: sha256 %s expected %s\n' % (
+                        url, os.path.basename(p), sha256))
+                cache.evict(url)
+                p = None
+        elif cmd == 'evict':
+            exit(0 if cache.evict(url) else 1)
+        elif cmd == 'incremental':
+            plan = incremental_plan(cache, url, sigs=sigs)
+            if not plan:
+                exit(1)
+            for x in plan:
+                print(' '.join(x))
+            exit(0)
+        elif cmd == 'stream':
+            p = cache.fetch(
+                url, aliases=args[2:], sha256=sha256, out=sys.stdout.buffer)
+        else:
+            p = cache.fetch(url, aliases=args[2:], sha256=sha256)
+    except Exception:
+        sys.stderr.write(traceback.format_exc())
+        exit(1)
+    if not p:
+        exit(1)
+    if cmd != 'stream':
+        print(p)
+
+
+if __name__ == '__main__':
+    main()
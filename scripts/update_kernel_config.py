@@ -9,6 +9,8 @@ import time
 from collections import namedtuple
 import subprocess
 from textwrap import wrap
+from concurrent.futures import ProcessPoolExecutor
+from oldconfig_prompts import answer_prompts
 from pyutils import (
     DEFAULT_ENCODING,
     format_exc,
@@ -16,6 +18,12 @@ from pyutils import (
     remove_blank_lines,
     FileWriteSingleton,
 )
+from kconfig_index import (
+    KconfigIndex,
+    kernel_version,
+    kconfig_tree_hash,
+)
+from kconfig_engine import KconfigEngine
 
 
 # Do not change this unless kernel .config format changes!
@@ -23,10 +31,13 @@ _CONFIG = 'CONFIG_'
 
 CMD_LISTNEWCONFIG = 'make -s listnewconfig 2>/dev/null'
 CMD_OLDCONFIG = 'make -s oldconfig'
-CMD_ARG_MAX = 'getconf ARG_MAX'
+CMD_OLDDEFCONFIG = 'make -s olddefconfig'
+# KERNEL_OLDCONFIG_MODE: how NEW symbols are answered
+OLDCONFIG_MODE_OLDDEFCONFIG = 'olddefconfig'
+OLDCONFIG_MODE_INTERACTIVE = 'interactive'
+# Answers computed up front (olddefconfig mode) - next to .config
+ANSWERS_FRAGMENT_FILENAME = '.config.answers'
 
-CMD_LEN_THRESHOLD = 4096
-CMD_LEN_SAFETY_FACTOR = 200
 ANSWER_QUESTIONS_TIMEOUT = 5
 MAX_ATTEMPTS = 3
 
@@ -44,6 +55,39 @@ BLANK_LINE_PAT = re.compile('^\s*$')
 COMMENT_LINE_PAT = re.compile('^\s*#')
 UNINDENTED_LINE_PAT = re.compile('^\S+')
 
+# Kconfig section patterns - compiled once, also in worker processes
+KEY_PAT = re.compile(
+    '^(config|menuconfig)\s+(?P<%s>\S+)' % (GD_KEY,),
+    re.MULTILINE + re.DOTALL
+)
+TYPE_PROMPT_PAT = re.compile(
+    '^\s+(?P<%s>bool|tristate|string|hex|int)\s*?(?P<%s>.*?)$' % (
+        GD_TYPE, GD_PROMPT,
+    ),
+    re.MULTILINE,
+)
+UNQUOTE_PAT = re.compile('^"(?P<%s>.*?)"$' % (GD_QUOTED,))
+DEFAULT_PAT = re.compile(
+    '^\s+(default|def_bool|def_tristate)\s+(?P<%s>.*$)$' % (
+        GD_DEFAULT,
+    ),
+    re.MULTILINE,
+)
+TYPE_DEFAULT_PAT = re.compile(
+    '^\s+def_(?P<%s>bool|tristate)\s+(?P<%s>.*$)$' % (
+        GD_TYPE, GD_DEFAULT
+    ),
+    re.MULTILINE,
+)
+# Kconfig files without a line matching this define no symbols
+SYM_LINE_PAT = re.compile('^(config|menuconfig) \S+$', re.MULTILINE)
+
+# Kconfig files are parsed in a process pool - but not if there are fewer
+# files than this
+KCONFIG_PARALLEL_MIN_FILES = 64
+# Files sent to a worker process at a time
+KCONFIG_PARALLEL_CHUNKSIZE = 16
+
 # LineNT lt values
 LINE_INVALID = 0
 LINE_EMPTY = 1
@@ -62,6 +106,8 @@ KCONFIG_VALUE_DIFFERENT = 32
 
 DEBUG_SINGLETON = None
 BUILD_DIR = None
+# Out-of-tree object dir (make O=) - from environment
+KBUILD_OUTPUT = None
 CMD_OUT_FILE = None
 
 
@@ -86,6 +132,38 @@ class ChosenOutSingleton(FileWriteSingleton):
     pass
 
 
+def dot_config_path():
+    '''
+    Returns-->str: path of kernel .config - under KBUILD_OUTPUT if set
+    '''
+    return os.path.join(KBUILD_OUTPUT or BUILD_DIR, '.config')
+
+
+def oldconfig_mode():
+    '''
+    Returns-->str: OLDCONFIG_MODE_OLDDEFCONFIG or OLDCONFIG_MODE_INTERACTIVE
+        from KERNEL_OLDCONFIG_MODE - default OLDCONFIG_MODE_INTERACTIVE
+    '''
+    if os.environ.get('KERNEL_OLDCONFIG_MODE', '') == OLDCONFIG_MODE_OLDDEFCONFIG:
+        return OLDCONFIG_MODE_OLDDEFCONFIG
+    return OLDCONFIG_MODE_INTERACTIVE
+
+
+def oldconfig_answer(k, t, cur, opts):
+    '''
+    k-->str: CFG_KEY
+    t-->str: type
+    cur-->str or None: current (default) value
+    opts-->list of str: allowed values for bool / tristate
+    Returns-->str or None: answer - None to accept default
+        Same choice as OldConfig.answer_questions - m wherever allowed
+    Used as answer callable for KconfigEngine.oldconfig
+    '''
+    if t in ['bool', 'tristate'] and 'm' in opts:
+        return 'm'
+    return None
+
+
 def debug(s):
     '''
     s-->str
@@ -286,8 +364,8 @@ class LinuxDotConfig(object):
         '''
         Sets instance vars
         '''
-        self.config = os.path.join(BUILD_DIR, '.config')
-        f = os.path.join(BUILD_DIR, '.config')
+        self.config = dot_config_path()
+        f = self.config
         try:
             parser = CfgParser(f=f, undef=True)
         except Exception as e:
@@ -373,6 +451,193 @@ class LinuxDotConfig(object):
             return False
 
 
+def kconfig_files(build_dir):
+    '''
+    build_dir-->str
+    Returns-->list of str: paths (relative to build_dir, sorted) of ALL
+        files named Kconfig under build_dir - symlinks are not followed
+    '''
+    ret = []
+    dirs = ['']
+    while dirs:
+        d = dirs.pop()
+        try:
+            it = os.scandir(os.path.join(build_dir, d))
+        except:
+            continue
+        with it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    if e.name != '.git':
+                        dirs.append(os.path.join(d, e.name))
+                elif e.name == 'Kconfig' and e.is_file(follow_symlinks=False):
+                    ret.append(os.path.join(d, e.name))
+    return sorted(ret)
+
+
+def syms_2_line_pat(syms):
+    '''
+    syms-->list of str: CFG_KEYS. If syms is empty, ALL CFG_KEYs are considered
+    Returns-->compiled re: matches lines that introduce one of syms
+    '''
+    if not syms:
+        return SYM_LINE_PAT
+    return re.compile('^(config|menuconfig) (%s)$' % (
+        '|'.join([re.escape(x) for x in syms]),
+    ), re.MULTILINE)
+
+
+def kconfig_2_sections(s):
+    '''
+    s-->str: Kconfig file contents
+    Returns-->list of str: sections starting with unindented non-space char
+    '''
+    ret = []
+    lines = s.splitlines()
+
+    acc = []
+    for l in lines:
+        if re.match(UNINDENTED_LINE_PAT, l):
+            # Little hack when type def or default line is not indented
+            # but has no blank line above
+            if acc and re.match(BLANK_LINE_PAT, acc[-1]):
+                # push previous
+                if acc:
+                    ret.append('\n'.join(acc))
+                    acc = []
+        acc.append(l)
+
+    if acc:
+        ret.append('\n'.join(acc))
+    return [x for x in ret if x.strip()]
+
+
+def kconfig_file_2_nt_dict(build_dir, f, syms=[], line_pat=SYM_LINE_PAT):
+    '''
+    build_dir-->str
+    f-->str: Kconfig file path relative to build_dir
+    syms-->list of str: CFG_KEYS. If syms is empty, ALL CFG_KEYs are considered
+    line_pat-->compiled re: from syms_2_line_pat(syms)
+    Returns-->OrderedDict or None if f has no line matching line_pat:
+        key-->str: CFG_KEY
+        val-->list of CfgVarNT
+    '''
+    (fstr, _) = file_contents(os.path.join(build_dir, f))
+    if not re.search(line_pat, fstr):
+        return None
+    secs = kconfig_2_sections(fstr)
+
+    t = None
+    k = None
+    p = None
+    default = None
+    default_str = None
+
+    syms = dict.fromkeys(syms)
+    ret = OrderedDict()
+    for sec in secs:
+        m = re.search(KEY_PAT, sec)
+        if not m:
+            continue
+        try:
+            k = m.groupdict()[GD_KEY]
+        except Exception as e:
+            continue
+        if syms and k not in syms:
+            continue
+        m = re.search(TYPE_PROMPT_PAT, sec)
+        if m:
+            try:
+                t = m.groupdict()[GD_TYPE]
+            except:
+                pass
+            try:
+                p = m.groupdict()[GD_PROMPT]
+                m = re.search(UNQUOTE_PAT, p)
+                if m:
+                    try:
+                        p = m.groupdict()[GD_QUOTED]
+                    except:
+                        pass
+            except:
+                pass
+        m = re.search(DEFAULT_PAT, sec)
+        if m:
+            try:
+                default_str = m.groupdict()[GD_DEFAULT]
+                m = re.search(UNQUOTE_PAT, default_str)
+                if m:
+                    try:
+                        default_str = m.groupdict()[GD_QUOTED]
+                    except:
+                        pass
+            except:
+                pass
+        # type and default may have been specified together
+        # using def_bool or def_tristate
+        if not t:
+            m = re.search(TYPE_DEFAULT_PAT, sec)
+            if m:
+                try:
+                    t = m.groupdict()[GD_TYPE]
+                except:
+                    pass
+                if not default_str:
+                    try:
+                        default_str = m.groupdict()[GD_DEFAULT]
+                        m = re.search(UNQUOTE_PAT, default_str)
+                        if m:
+                            try:
+                                default_str = m.groupdict()[GD_QUOTED]
+                            except:
+                                pass
+                    except:
+                        pass
+        if default_str in ['y', 'n', 'm']:
+            default = default_str
+        if t in ['string', 'int', 'hex']:
+            default = default_str
+        if not default_str:
+            default = 'n'
+
+        nt = CfgVarNT(
+            f=f, k=k, t=t, p=p, sec=sec,
+            default=default, default_str=default_str
+        )
+
+        if k in ret:
+            ret[k] = ret[k] + [nt]
+        else:
+            ret[k] = [nt]
+
+    return ret
+
+
+# Set in each worker process by parse_worker_init
+WORKER_ARGS = None
+
+
+def parse_worker_init(build_dir, syms):
+    '''
+    Initializer of worker processes of KConfigsReader.get_nt_dict
+    '''
+    global WORKER_ARGS
+    WORKER_ARGS = (build_dir, syms, syms_2_line_pat(syms))
+
+
+def parse_worker(f):
+    '''
+    f-->str: Kconfig file path relative to build_dir
+    Returns-->list of (key, list of tuple) or None - plain tuples, so that
+        result does not depend on pickling CfgVarNT
+    '''
+    (build_dir, syms, line_pat) = WORKER_ARGS
+    d = kconfig_file_2_nt_dict(build_dir, f, syms, line_pat)
+    if d is None:
+        return None
+    return [(k, [tuple(nt) for nt in ntl]) for (k, ntl) in d.items()]
+
+
 class KConfigsReader(object):
     '''
     Kconfig language reference:
@@ -397,234 +662,64 @@ class KConfigsReader(object):
     def __init__(self, syms=[]):
         '''
         syms-->list of str: CFG_KEYS. If syms is empty, ALL CFG_KEYs are considered
+
+        Kconfig files are parsed only if the tree is not in the persistent
+        index (kconfig_index.py) - unless KERNEL_KCONFIG_INDEX is 'no'.
+        If the tree is in the index, ntd is a KconfigTree and get_type /
+        get_default are index lookups
         '''
         start_time = time.time()
 
         self.syms = syms
+        self.tree = None
+        self.kconfig_files = kconfig_files(BUILD_DIR)
+        (index, kver, tree_hash) = self.__open_index()
+        if index is not None:
+            try:
+                (tree_id, n) = index.lookup(kver, tree_hash)
+                if tree_id is not None:
+                    self.tree = index.tree(tree_id, CfgVarNT, syms)
+                    self.ntd = self.tree
+                    debug('Kconfig index hit (%s, %d Kconfig files) in %.1f secs' % (
+                        kver, n, time.time() - start_time,
+                    ))
+                    return
+            except Exception as e:
+                debug(format_exc(e, msg='Kconfig index lookup failed'))
+
         (self.ntd, n) = self.get_nt_dict()
 
         debug('Analyzed %d Kconfig files in %.1f secs' % (
             n, time.time() - start_time,
         ))
-
-    def __syms_2_grep_pat(self):
-        '''
-        Returns-->str
-        If length of self.syms is large enough, concatenating them into a grep pattern
-        will make the command line too long. In that case (checked with 'getconf ARG_MAX'
-        this function will return ALL Kconfig files that define at least one symbol
-        and filtering will (should) happen in __syms_2_re_pat
-        '''
-        ret = []
-        l1 = ['config', 'menuconfig']
-        if self.syms:
-            l2 = self.syms
-        else:
-            l2 = ['\S+']
-        for i in l1:
-            for j in l2:
-                ret.append('^%s %s$' % (i, j))
-        ret = '|'.join(ret)
-        if len(ret) > CMD_LEN_THRESHOLD:
-            max_cmd_len = subprocess.check_output(CMD_ARG_MAX, shell=True)
-            max_cmd_len = int(max_cmd_len.decode(DEFAULT_ENCODING))
-            if len(ret) < (max_cmd_len - CMD_LEN_SAFETY_FACTOR):
-                ret = []
-                l2 = ['\S+']
-                for i in l1:
-                    for j in l2:
-                        ret.append('^%s %s$' % (i, j))
-                ret = '|'.join(ret)
-        return ret
-
-    def __kconfig_files(self):
-        '''
-        Returns-->list of str: Kconfig file paths UNDER BUILD_DIR
-        Only those Kconfig files that contain '^config \S+ | ^menuconfig \S+'
-        are returned - not all. There are ~24 Kconfig files without this pattern
-        (ver 5.9-rc6) and none of them are relevant (checked manually)
-
-        If length of self.syms is large enough, concatenating them into a grep pattern
-        will make the command line too long. In that case (checked with 'getconf ARG_MAX'
-        this function will return ALL Kconfig files that define at least one symbol
-        and filtering will (should) happen in file_2_nt_dict
-        '''
-        oldpwd = os.getcwd()
-        os.chdir(BUILD_DIR)
-
-        grep_pat = self.__syms_2_grep_pat()
-        cmd = "grep -Pl '%s' $(find -type f -name Kconfig)" % (grep_pat,)
-
-        ret = []
-        for f in subprocess.check_output(
-            cmd, shell=True
-        ).decode(DEFAULT_ENCODING).replace('\n', ' ').split(None):
-            if f.startswith('./'):
-                f = f[2:]
-            ret.append(f)
-
-        os.chdir(oldpwd)
-        return ret
-
-    def __kconfig_2_sections(self, s):
-        '''
-        s-->str: Kconfig file contents
-        Returns-->list of str: sections starting with unindented non-space char
-        '''
-        ret = []
-        lines = s.splitlines()
-        UNINDENTED_LINE_PAT = re.compile('^\S+')
-
-        acc = []
-        for l in lines:
-            if re.match(UNINDENTED_LINE_PAT, l):
-                # Little hack when type def or default line is not indented
-                # but has no blank line above
-                if acc and re.match(BLANK_LINE_PAT, acc[-1]):
-                    # push previous
-                    if acc:
-                        ret.append('\n'.join(acc))
-                        acc = []
-            acc.append(l)
-
-        if acc:
-            ret.append('\n'.join(acc))
-        return [x for x in ret if x.strip()]
-
-    def __file_2_nt_dict(self, f):
-        '''
-        f-->str: Kconfig file path
-        Returns-->OrderedDict:
-            key-->str: CFG_KEY
-            val-->list of CfgVarNT
-        '''
-        oldpwd = os.getcwd()
-        os.chdir(BUILD_DIR)
-
-        key_pat = re.compile(
-            '^(config|menuconfig)\s+(?P<%s>\S+)' % (GD_KEY,),
-            re.MULTILINE + re.DOTALL
-        )
-        type_prompt_pat = re.compile(
-            '^\s+(?P<%s>bool|tristate|string|hex|int)\s*?(?P<%s>.*?)$' % (
-                GD_TYPE, GD_PROMPT,
-            ),
-            re.MULTILINE,
-        )
-        unquote_pat = re.compile('^"(?P<%s>.*?)"$' % (GD_QUOTED,))
-        default_pat = re.compile(
-            '^\s+(default|def_bool|def_tristate)\s+(?P<%s>.*$)$' % (
-                GD_DEFAULT,
-            ),
-            re.MULTILINE,
-        )
-        type_default_pat = re.compile(
-            '^\s+def_(?P<%s>bool|tristate)\s+(?P<%s>.*$)$' % (
-                GD_TYPE, GD_DEFAULT
-            ),
-            re.MULTILINE,
-        )
-
-        sec_pat = []
-        l1 = ['config', 'menuconfig']
-        if self.syms:
-            l2 = self.syms
-        else:
-            l2 = ['\S+']
-        for i in l1:
-            for j in l2:
-                sec_pat.append('^%s (%s).*?$' % (i, j))
-        sec_pat = '|'.join(sec_pat)
-        sec_pat = re.compile(sec_pat, re.MULTILINE + re.DOTALL)
-
-        (fstr, _) = file_contents(f)
-        secs = self.__kconfig_2_sections(fstr)
-
-        t = None
-        k = None
-        p = None
-        default = None
-        default_str = None
-
-        syms = dict.fromkeys(self.syms)
-        ret = OrderedDict()
-        for sec in secs:
-            m = re.search(key_pat, sec)
-            if not m:
-                continue
+        # Index has ALL symbols - cannot store if filtered by syms
+        if index is not None and not self.syms:
             try:
-                k = m.groupdict()[GD_KEY]
+                index.store(
+                    kver, tree_hash, n, self.ntd,
+                    self.get_type, self.get_default
+                )
+                index.prune()
+                debug('Kconfig index stored (%s)' % (kver,))
             except Exception as e:
-                continue
-            if self.syms and k not in syms:
-                continue
-            m = re.search(type_prompt_pat, sec)
-            if m:
-                try:
-                    t = m.groupdict()[GD_TYPE]
-                except:
-                    pass
-                try:
-                    p = m.groupdict()[GD_PROMPT]
-                    m = re.search(unquote_pat, p)
-                    if m:
-                        try:
-                            p = m.groupdict()[GD_QUOTED]
-                        except:
-                            pass
-                except:
-                    pass
-            m = re.search(default_pat, sec)
-            if m:
-                try:
-                    default_str = m.groupdict()[GD_DEFAULT]
-                    m = re.search(unquote_pat, default_str)
-                    if m:
-                        try:
-                            default_str = m.groupdict()[GD_QUOTED]
-                        except:
-                            pass
-                except:
-                    pass
-            # type and default may have been specified together
-            # using def_bool or def_tristate
-            if not t:
-                m = re.search(type_default_pat, sec)
-                if m:
-                    try:
-                        t = m.groupdict()[GD_TYPE]
-                    except:
-                        pass
-                    if not default_str:
-                        try:
-                            default_str = m.groupdict()[GD_DEFAULT]
-                            m = re.search(unquote_pat, default_str)
-                            if m:
-                                try:
-                                    default_str = m.groupdict()[GD_QUOTED]
-                                except:
-                                    pass
-                        except:
-                            pass
-            if default_str in ['y', 'n', 'm']:
-                default = default_str
-            if t in ['string', 'int', 'hex']:
-                default = default_str
-            if not default_str:
-                default = 'n'
-
-            nt = CfgVarNT(
-                f=f, k=k, t=t, p=p, sec=sec,
-                default=default, default_str=default_str
-            )
-
-            if k in ret:
-                ret[k] = ret[k] + [nt]
-            else:
-                ret[k] = [nt]
+                debug(format_exc(e, msg='Kconfig index store failed'))
 
-        os.chdir(oldpwd)
-        return ret
+    def __open_index(self):
+        '''
+        Returns-->(index, kver, tree_hash):
+            index-->KconfigIndex or None if index is disabled or unavailable
+            kver-->str: kernel version
+            tree_hash-->str: hash of ALL Kconfig files under BUILD_DIR
+        '''
+        if os.environ.get('KERNEL_KCONFIG_INDEX', 'yes') == 'no':
+            return (None, None, None)
+        try:
+            kver = kernel_version(BUILD_DIR)
+            tree_hash = kconfig_tree_hash(BUILD_DIR, self.kconfig_files)
+            return (KconfigIndex(), kver, tree_hash)
+        except Exception as e:
+            debug(format_exc(e, msg='Kconfig index not used'))
+            return (None, None, None)
 
     def get_nt_dict(self):
         '''
@@ -633,20 +728,63 @@ class KConfigsReader(object):
                 key-->str: CFG_KEY
                 val-->list of CfgVarNT
             n-->int: number of Kconfig files considered
+        Files are parsed in a process pool (one process per CPU) and
+        merged in order of self.kconfig_files - same result as parsing
+        serially
         '''
         ret = OrderedDict()
 
-        kconfig_files = self.__kconfig_files()
+        files = self.kconfig_files
+        nproc = self.__num_procs()
+        results = None
+        if nproc > 1 and len(files) >= KCONFIG_PARALLEL_MIN_FILES:
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=nproc,
+                    initializer=parse_worker_init,
+                    initargs=(BUILD_DIR, self.syms),
+                ) as ex:
+                    results = [
+                        x is not None and OrderedDict(
+                            (k, [CfgVarNT(*t) for t in tl]) for (k, tl) in x
+                        ) or None
+                        for x in ex.map(
+                            parse_worker, files,
+                            chunksize=KCONFIG_PARALLEL_CHUNKSIZE
+                        )
+                    ]
+                debug('Parsed Kconfig files with %d processes' % (nproc,))
+            except Exception as e:
+                debug(format_exc(e, msg='Parallel Kconfig parsing failed'))
+                results = None
+        if results is None:
+            line_pat = syms_2_line_pat(self.syms)
+            results = [
+                kconfig_file_2_nt_dict(BUILD_DIR, f, self.syms, line_pat)
+                for f in files
+            ]
 
-        for f in kconfig_files:
-            ret1 = self.__file_2_nt_dict(f=f)
+        n = 0
+        for ret1 in results:
+            if ret1 is None:
+                continue
+            n += 1
             for (k, v) in ret1.items():
                 if k in ret:
                     ret[k] = ret[k] + ret1[k]
                 else:
                     ret[k] = ret1[k]
 
-        return (ret, len(kconfig_files))
+        return (ret, n)
+
+    def __num_procs(self):
+        '''
+        Returns-->int: number of CPUs this process can run on
+        '''
+        try:
+            return len(os.sched_getaffinity(0))
+        except:
+            return os.cpu_count() or 1
 
     def get_type(self, k):
         '''
@@ -654,6 +792,8 @@ class KConfigsReader(object):
         Returns-->str or None
         '''
         ret = None
+        if self.tree is not None:
+            return self.tree.get_type(k)
         if k not in self.ntd:
             return ret
         ntl = self.ntd[k]
@@ -670,6 +810,8 @@ class KConfigsReader(object):
         Returns-->str or None
         '''
         ret = None
+        if self.tree is not None:
+            return self.tree.get_default(k)
         if k not in self.ntd:
             return ret
         ntl = self.ntd[k]
@@ -944,6 +1086,10 @@ class OldConfig(object):
             self.non_def_ans_dict = OrderedDict()
         self.update_dict = OrderedDict()
         self.error_dict = OrderedDict()
+        # Set by predict
+        self.engine = None
+        self.predicted = None
+        self.answers = OrderedDict()
 
         self.attempts = 0
 
@@ -960,8 +1106,11 @@ class OldConfig(object):
                 return False
             if not self.new_syms:
                 return True
+            if self.attempts == 0:
+                self.predict()
             if not self.run_oldconfig():   # updates self.attempts, sets self.kcr
                 return False
+            self.check_prediction()
 
             self.error_dict = Comparisons.check_prefs(
                 a=self.update_dict,
@@ -972,6 +1121,9 @@ class OldConfig(object):
 
             if self.error_dict:
                 self.show_error_dict()
+                if self.errors_predicted():
+                    print('Kconfig dependencies prevent these values - not trying again')
+                    break
             else:
                 if self.new_syms:
                     print('All prefs and answer_question responses set in kernel config')
@@ -984,6 +1136,74 @@ class OldConfig(object):
             return False
         return True
 
+    def predict(self):
+        '''
+        Predicts .config after make oldconfig with KconfigEngine - from
+        .config written by update_ldc and answers from oldconfig_answer
+        Sets self.engine and self.predicted (same format as
+        LinuxDotConfig.prefs_dict) - None if KERNEL_KCONFIG_ENGINE is 'no'
+        or engine failed
+        Returns-->None
+        '''
+        if os.environ.get('KERNEL_KCONFIG_ENGINE', 'yes') == 'no':
+            return
+        start_time = time.time()
+        try:
+            engine = KconfigEngine(BUILD_DIR, objtree=KBUILD_OUTPUT)
+            engine.load_config(dot_config_path())
+            asked = engine.oldconfig(answer=oldconfig_answer)
+            self.predicted = engine.config_dict()
+            self.engine = engine
+            for (k, v) in asked.items():
+                if engine.syms[k].is_choice:
+                    if v:
+                        self.answers[v] = 'y'
+                else:
+                    self.answers[k] = v
+        except Exception as e:
+            debug(format_exc(e, msg='Kconfig engine failed'))
+            return
+        debug('Kconfig engine: %d files, %d symbols, %d questions predicted (%.1f seconds)' % (
+            len(engine.files), len(engine.syms), len(asked),
+            time.time() - start_time,
+        ))
+        for w in engine.warnings:
+            debug('    Kconfig engine: %s' % (w,))
+
+    def check_prediction(self):
+        '''
+        Compares self.predicted with .config written by FIRST make oldconfig
+        Mismatches are written to chosen.out
+        Returns-->None
+        '''
+        if self.predicted is None or self.attempts != 1:
+            return
+        (a, b) = (self.predicted, self.post_ldc.prefs_dict)
+        mismatches = [
+            k for k in list(a.keys()) + [x for x in b if x not in a]
+            if a.get(k, None) != b.get(k, None)
+        ]
+        debug('Kconfig engine prediction: %d of %d symbols differ' % (
+            len(mismatches), len(b),
+        ))
+        for k in mismatches:
+            debug('    %-54s  predicted(%s)  oldconfig(%s)' % (
+                k, str(a.get(k, None)), str(b.get(k, None)),
+            ))
+
+    def errors_predicted(self):
+        '''
+        Returns-->bool: KconfigEngine predicted the value make oldconfig set
+            for EVERY key in self.error_dict. Trying again would write the
+            same values and get the same result
+        '''
+        if self.predicted is None or self.attempts != 1 or not self.error_dict:
+            return False
+        for k in self.error_dict.keys():
+            if self.predicted.get(k, None) != self.post_ldc.prefs_dict.get(k, None):
+                return False
+        return True
+
     def prune_error_dict(self):
         '''
         [A] We IGNORE errors where update_dict has 'n' and config has 'y', 'm' or None
@@ -1047,11 +1267,22 @@ class OldConfig(object):
         Returns-->bool: success
         '''
         self.attempts += 1
-        print('Running make oldconfig - attempt(%d)' % (self.attempts))
+        if oldconfig_mode() == OLDCONFIG_MODE_OLDDEFCONFIG and \
+                self.predicted is not None:
+            cmd = CMD_OLDDEFCONFIG
+            answer_fn = self.answer_up_front
+        else:
+            if oldconfig_mode() == OLDCONFIG_MODE_OLDDEFCONFIG:
+                # No answers without KconfigEngine - NEW tristates would
+                # get their defaults instead of m
+                print('No Kconfig prediction - answering questions instead')
+            cmd = CMD_OLDCONFIG
+            answer_fn = self.answer_questions
+        print('Running %s - attempt(%d)' % (cmd, self.attempts))
         start_time = time.time()
-        (success, self.non_def_ans_dict) = self.answer_questions()
+        (success, self.non_def_ans_dict) = answer_fn()
         if not success:
-            print('%s failed' % (CMD_OLDCONFIG,))
+            print('%s failed' % (cmd,))
             return success
         print('Oldconfig completed (%.1f seconds)' % (
             time.time() - start_time
@@ -1080,6 +1311,9 @@ class OldConfig(object):
             if len(v2) > V1_V2_LEN:
                 v2 = TOO_LONG
             print(FMT % (k, v1, v2))
+            if self.engine is not None:
+                for r in self.engine.explain(k, want=v1 or None):
+                    print('        %s' % (r,))
 
     def tristate_sym_dict(self, d):
         '''
@@ -1101,6 +1335,68 @@ class OldConfig(object):
                 ret[k] = 'm'
         return ret
 
+    def answer_up_front(self):
+        '''
+        Writes answers to NEW questions (self.answers from predict - same
+        choices as answer_questions) to ANSWERS_FRAGMENT_FILENAME, merges
+        them into .config and runs CMD_OLDDEFCONFIG once. olddefconfig
+        sets every symbol still without a value to its default without
+        asking. KCONFIG_ALLCONFIG is read only by all*config targets, so
+        the fragment is merged into .config instead
+        Needs self.predicted - run_oldconfig uses answer_questions when
+        KconfigEngine is disabled or failed
+        Returns-->(success, d):
+            success-->bool
+            d-->OrderedDict: Non default answers chosen
+                key-->str: CFG_KEY
+                val-->str: chosen
+        '''
+        start_time = time.time()
+        answers = OrderedDict()
+        if self.attempts == 1:
+            answers = self.answers
+        fragment = os.path.join(
+            os.path.dirname(dot_config_path()), ANSWERS_FRAGMENT_FILENAME
+        )
+        debug('')
+        debug('Starting answer_up_front')
+        try:
+            with open(fragment, mode='w', encoding=DEFAULT_ENCODING) as f:
+                for (k, v) in answers.items():
+                    f.write('%s%s=%s\n' % (_CONFIG, k, v))
+        except Exception as e:
+            debug(format_exc(e, msg='Could not write %s' % (fragment,)))
+        if answers and not self.post_ldc.update(answers, silent=True):
+            return (False, OrderedDict())
+        try:
+            with open(CMD_OUT_FILE, 'a+') as f:
+                ret = subprocess.call(
+                    CMD_OLDDEFCONFIG, shell=True,
+                    stdin=subprocess.DEVNULL, stdout=f, stderr=f,
+                )
+        except Exception as e:
+            debug(format_exc(e, msg=CMD_OLDDEFCONFIG))
+            return (False, OrderedDict())
+
+        non_def_ans_dict = OrderedDict()
+        for (k, v) in answers.items():
+            if v == 'm':
+                debug('    %s=%s' % (k, v))
+                non_def_ans_dict[k] = v
+        debug('Completed answer_up_front (%.1f seconds)' % (
+            time.time() - start_time
+        ))
+        debug('Non-default answers: %d - attempt(%d)' % (
+            len(non_def_ans_dict),
+            self.attempts,
+        ))
+        debug('')
+        print('Non-default answers: %d - attempt(%d)' % (
+            len(non_def_ans_dict),
+            self.attempts,
+        ))
+        return (ret == 0, non_def_ans_dict)
+
     def answer_questions(self):
         '''
         Returns-->(success, d):
@@ -1124,59 +1420,43 @@ class OldConfig(object):
         pat_new = '\(NEW\)'
         pat = '^%s %s %s %s' % (pat_desc, pat_key, pat_opts, pat_new)
 
-        question_patterns = [
-            pexpect.EOF,
-            pexpect.TIMEOUT,
-            pat,
-            '^\s*choice.*$',
-        ]
-
         non_def_ans_dict = OrderedDict()
 
+        def answer(m):
+            '''
+            m-->match of pat
+            Returns-->(key, ans)
+            '''
+            gd = m.groupdict()
+            opts = gd['OPTS']
+
+            # Default option (only) will be in UPPER CASE
+            def_ans = [x for x in opts if x in 'YNM']
+            if def_ans:
+                def_ans = def_ans[0]
+            else:
+                def_ans = None
+            if 'm' in opts.lower():
+                ans = [x for x in opts if x in 'mM'][0]
+            else:     # Press RETURN, accept default
+                ans = ''
+
+            if ans != '':
+                debug_choice = '%s=%s' % (gd[GD_KEY], ans)
+                debug('    %-54s  default(%s)  opts(%s)' % (
+                    debug_choice, str(def_ans), str(opts),
+                ))
+                non_def_ans_dict[gd[GD_KEY]] = ans.lower()
+            return (gd[GD_KEY], ans)
+
         debug('')
         debug('Starting answer_questions')
-        while not c.eof():
-            ind = c.expect(question_patterns, timeout=2)
-            if ind == 0:      # EOF
-                break
-            elif ind == 1:      # TIMEOUT
-                c.sendline('')
-                continue
-            elif ind == 2:        # options to choose
-                ans = ''
-                if c.match:
-                    gd = c.match.groupdict()
-                    opts = gd['OPTS']
-
-                    # Default option (only) will be in UPPER CASE
-                    def_ans = [x for x in opts if x in 'YNM']
-                    if def_ans:
-                        def_ans = def_ans[0]
-                    else:
-                        def_ans = None
-                    if 'm' in opts.lower():
-                        ans = [x for x in opts if x in 'mM'][0]
-                    else:     # Press RETURN, accept default
-                        ans = ''
-
-                    # desc = gd['DESC'].splitlines()[-1].strip('\r\n')
-                    if ans != '':
-                        debug_choice = '%s=%s' % (gd[GD_KEY], ans)
-                        debug('    %-54s  default(%s)  opts(%s)' % (
-                            debug_choice, str(def_ans), str(opts),
-                        ))
-                        '''
-                        debug('    %s=%s  default(%s)  opts(%s)' % (
-                            gd[GD_KEY], ans, str(def_ans), str(opts),
-                        ))
-                        '''
-                        non_def_ans_dict[gd[GD_KEY]] = ans.lower()
-                    c.sendline(ans)
-                else:
-                    debug('Unexpected error: index == 1, but c.match is None')
-            elif ind == 3:          # choice
-                # debug('--- CHOICE --- %s\n' % (c.after.splitlines()[-1],))
-                c.sendline('')
+        # Answers as soon as a question is asked - see oldconfig_prompts.py
+        answer_prompts(
+            c, pat, answer,
+            max_timeout=ANSWER_QUESTIONS_TIMEOUT,
+            debug=debug,
+        )
 
         debug('Completed answer_questions (%.1f seconds)' % (
             time.time() - start_time
@@ -1234,7 +1514,8 @@ if __name__ == '__main__':
     if not os.path.isdir(BUILD_DIR):
         print('Not a directory: %s' % (BUILD_DIR,))
         exit(1)
-    KERNEL_CONFIG = os.path.join(BUILD_DIR, '.config')
+    KBUILD_OUTPUT = os.environ.get('KBUILD_OUTPUT', None)
+    KERNEL_CONFIG = dot_config_path()
     if not os.path.exists(KERNEL_CONFIG):
         print('.config not found: %s' % (KERNEL_CONFIG,))
         exit(1)
@@ -1247,7 +1528,12 @@ if __name__ == '__main__':
 
     print('Using kernel config prefs from: %s' % (PREFS_FILE,))
     print('Using kernel build dir: %s' % (BUILD_DIR,))
-    print('Using kernel config make command: %s' % (CMD_OLDCONFIG,))
+    if KBUILD_OUTPUT:
+        print('Using kernel object dir: %s' % (KBUILD_OUTPUT,))
+    if oldconfig_mode() == OLDCONFIG_MODE_OLDDEFCONFIG:
+        print('Using kernel config make command: %s' % (CMD_OLDDEFCONFIG,))
+    else:
+        print('Using kernel config make command: %s' % (CMD_OLDCONFIG,))
     print('Kernel config make output in %s' % (CMD_OUT_FILE,))
     print('Kernel config make choices made in %s' % (CHOSEN_OUT_FILE,))
 